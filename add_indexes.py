@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+import sqlite3
+
+INDEXES = [
+    # Keyset pagination: newest first, ties broken by id
+    'CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, id)',
+    'CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at, id)',
+    'CREATE INDEX IF NOT EXISTS idx_posts_published_created ON posts (published, created_at, id)',
+    'CREATE INDEX IF NOT EXISTS idx_posts_author ON posts (author_id)',
+]
+
+def add_indexes():
+    conn = sqlite3.connect('database.db')
+    cursor = conn.cursor()
+    
+    for statement in INDEXES:
+        cursor.execute(statement)
+    cursor.execute('ANALYZE')
+    
+    conn.commit()
+    conn.close()
+    print("Pagination indexes created successfully!")
+
+if __name__ == "__main__":
+    add_indexes()
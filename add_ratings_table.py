@@ -1,33 +1,28 @@
 #!/usr/bin/env python3
 import sqlite3
 
+import ratings
+
 def add_ratings_table():
     conn = sqlite3.connect('database.db')
     cursor = conn.cursor()
-    
-    # Create ratings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS song_ratings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            song_title TEXT NOT NULL,
-            song_artist TEXT NOT NULL,
-            song_album TEXT,
-            user_identifier TEXT NOT NULL,
-            rating INTEGER NOT NULL CHECK (rating IN (-1, 1)),
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(song_title, song_artist, user_identifier)
-        )
-    ''')
-    
-    # Create index for faster lookups
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_song_ratings_lookup 
-        ON song_ratings (song_title, song_artist)
-    ''')
-    
+
+    # Databases that already hold legacy votes are converted by migrate_songs.py
+    legacy = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_ratings'"
+    ).fetchone()
+    if legacy and ratings.detect_storage(conn) == ratings.LEGACY:
+        conn.close()
+        print("Found legacy song_ratings table; run migrate_songs.py to normalize it.")
+        return
+
+    # Create songs, listeners and song_votes tables
+    ratings.create_normalized_schema(conn)
+    ratings.set_meta(conn, 'ratings_storage', ratings.NORMALIZED)
+
     conn.commit()
     conn.close()
-    print("Song ratings table created successfully!")
+    print("Song ratings tables created successfully!")
 
 if __name__ == "__main__":
-    add_ratings_table()
\ No newline at end of file
+    add_ratings_table()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Create the posts_fts search index and index every existing post.
+
+  python3 add_search_index.py            create the index if it is missing
+  python3 add_search_index.py --rebuild  re-index all posts from scratch
+  python3 add_search_index.py --check    verify the index matches posts
+
+The build runs in one transaction, so servers keep reading posts while it
+runs and see the index only once it is complete.
+"""
+import argparse
+import sqlite3
+import sys
+import time
+
+import search
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the full-text index over posts')
+    parser.add_argument('--database', default='database.db')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--rebuild', action='store_true', help='Re-index every post')
+    group.add_argument('--check', action='store_true', help='Run the FTS5 integrity check')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database, isolation_level=None)  # explicit transactions
+    conn.execute('PRAGMA busy_timeout = 10000')
+    try:
+        if args.check:
+            if not search.has_search_index(conn):
+                print("No search index; run add_search_index.py to build it.")
+                sys.exit(1)
+            try:
+                search.check_search_index(conn)
+            except sqlite3.DatabaseError as e:
+                print(f"Search index is out of date ({e}); run with --rebuild.")
+                sys.exit(1)
+            print("Search index matches posts.")
+            return
+
+        started = time.monotonic()
+        conn.execute('BEGIN IMMEDIATE')
+        created = search.create_search_index(conn)
+        if args.rebuild and not created:
+            search.rebuild_search_index(conn)
+        posts = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+        conn.execute('COMMIT')
+        if created or args.rebuild:
+            print(f"Indexed {posts} posts in {time.monotonic() - started:.1f}s.")
+        else:
+            print("Search index already exists; use --rebuild to re-index.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Add the users/posts change counters behind the list endpoints' ETags.
+
+  python3 add_table_versions.py [--database database.db]
+
+Safe to run more than once; the servers send list responses without an
+ETag until it has been run.
+"""
+import argparse
+import sqlite3
+
+import table_versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track changes to users and posts')
+    parser.add_argument('--database', default='database.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    try:
+        created = table_versions.create_version_tracking(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    if created:
+        print("Change counters created for: " + ', '.join(table_versions.TRACKED_TABLES))
+    else:
+        print("Change counters already exist.")
+
+
+if __name__ == "__main__":
+    main()
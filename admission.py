@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Admission control shared by simple_server.py and app.py.
+
+At most `max_in_flight` requests run at once.  Further requests wait in a
+bounded queue, ordered by priority (CRITICAL before NORMAL before BULK) and
+then by arrival, and lower priorities may only use part of the queue, so
+a flood of list requests cannot crowd out the player.  A request is turned
+away with Shed, which the servers answer with a fast 503 and Retry-After,
+when its share of the queue is full, when it has waited `queue_timeout`,
+or when its deadline has passed.
+
+Every request has a deadline: its arrival time plus the client's
+X-Request-Timeout (in seconds) or the server default.  The deadline is
+kept per thread while the request runs, and connections registered with
+install() abort SQLite statements that are still running after it, since
+the client has stopped waiting for the answer.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+import metrics
+
+CRITICAL, NORMAL, BULK = 0, 1, 2
+PRIORITY_NAMES = ('critical', 'normal', 'bulk')
+QUEUE_SHARE = (1.0, 0.75, 0.25)  # fraction of the queue each priority may fill
+
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_QUEUE_TIMEOUT = 1.0
+DEFAULT_REQUEST_TIMEOUT = 10.0
+TIMEOUT_HEADER = 'X-Request-Timeout'
+PROGRESS_OPS = 10000  # SQLite VM steps between deadline checks
+
+_local = threading.local()
+
+
+class Shed(Exception):
+    """A request that will not be run; retry_after is in whole seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f'Server is overloaded ({reason}); retry in {retry_after}s')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+def request_deadline(received_at, header_value, default_timeout):
+    """Monotonic deadline from the arrival time and an optional timeout header"""
+    timeout = default_timeout
+    if header_value:
+        try:
+            timeout = min(max(float(header_value), 0.0), default_timeout)
+        except ValueError:
+            pass
+    return received_at + timeout
+
+
+def deadline_exceeded():
+    """True once the current thread's request is past its deadline"""
+    deadline = getattr(_local, 'deadline', None)
+    return deadline is not None and time.monotonic() > deadline
+
+
+def install(conn):
+    """Interrupt conn's statements when the running request's deadline passes"""
+    conn.set_progress_handler(deadline_exceeded, PROGRESS_OPS)
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight, max_queue=DEFAULT_MAX_QUEUE,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.in_flight = 0
+        self._queues = tuple(deque() for _ in PRIORITY_NAMES)
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._service_time = 0.05  # moving average, for Retry-After
+        self.admitted = 0
+        self.shed = dict.fromkeys(('queue_full', 'queue_timeout', 'deadline'), 0)
+
+    def admit(self, priority, deadline):
+        """Block until the request may run, or raise Shed"""
+        with self._lock:
+            if time.monotonic() >= deadline:
+                raise self._shed('deadline')  # expired waiting to be accepted
+            if self.in_flight < self.max_in_flight and not self._queued:
+                self.in_flight += 1
+                self.admitted += 1
+                _local.deadline, _local.started = deadline, time.monotonic()
+                return
+            if self._queued >= self.max_queue * QUEUE_SHARE[priority]:
+                raise self._shed('queue_full')
+            waiter = _Waiter()
+            self._queues[priority].append(waiter)
+            self._queued += 1
+            metrics.requests_queued.inc()
+        waiter.event.wait(max(min(self.queue_timeout, deadline - time.monotonic()), 0))
+        with self._lock:
+            if not waiter.granted:
+                self._queues[priority].remove(waiter)
+                self._queued -= 1
+                metrics.requests_queued.dec()
+                raise self._shed('deadline' if time.monotonic() >= deadline
+                                 else 'queue_timeout')
+            self.admitted += 1
+        _local.deadline, _local.started = deadline, time.monotonic()
+        if time.monotonic() >= deadline:
+            self.release()  # the client gave up while this request was queued
+            with self._lock:
+                raise self._shed('deadline')
+
+    def release(self):
+        """Finish an admitted request and hand its slot to the next in line"""
+        started = getattr(_local, 'started', None)
+        _local.deadline = _local.started = None
+        with self._lock:
+            if started is not None:
+                self._service_time += (time.monotonic() - started - self._service_time) * 0.05
+            for queue in self._queues:
+                if queue:
+                    waiter = queue.popleft()
+                    self._queued -= 1
+                    metrics.requests_queued.dec()
+                    waiter.granted = True  # the slot passes straight to the waiter
+                    waiter.event.set()
+                    return
+            self.in_flight -= 1
+
+    def _shed(self, reason):
+        """Count a rejection and build its Shed (called with the lock held)"""
+        self.shed[reason] += 1
+        metrics.requests_shed.inc(reason)
+        backlog = self._queued + self.in_flight
+        retry_after = max(1, math.ceil(backlog * self._service_time / self.max_in_flight))
+        return Shed(reason, retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'queued': {name: len(queue) for name, queue in zip(PRIORITY_NAMES, self._queues)},
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'service_time': round(self._service_time, 4),
+            }
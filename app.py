@@ -1,29 +1,200 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g, make_response, stream_with_context
 import sqlite3
 import os
+import time
 from datetime import datetime
+from functools import wraps
+
+import admission
+import db_pool
+import json_stream
+import listings
+import metrics
+import response_cache
+import search
+import table_versions
 
 app = Flask(__name__)
 
 # Database configuration
 DATABASE = 'database.db'
 
+# Rendered post responses; cleared whenever a post is written
+post_cache = response_cache.ResponseCache()
+
+# Request and SQL timing for /metrics; METRICS_SAMPLE=0.1 times one request in ten
+metrics.configure(sample_rate=float(os.environ.get('METRICS_SAMPLE', '1')))
+db_pool.set_connection_factory(metrics.InstrumentedConnection)
+
+# The development server starts a thread per request; admission bounds how
+# many of them run at once (MAX_IN_FLIGHT) and queues the rest by priority
+admission_control = admission.AdmissionController(
+    int(os.environ.get('MAX_IN_FLIGHT', '16')),
+    max_queue=int(os.environ.get('MAX_QUEUE', admission.DEFAULT_MAX_QUEUE)),
+    queue_timeout=float(os.environ.get('QUEUE_TIMEOUT', admission.DEFAULT_QUEUE_TIMEOUT)),
+    request_timeout=float(os.environ.get('REQUEST_TIMEOUT', admission.DEFAULT_REQUEST_TIMEOUT)))
+db_pool.add_connect_hook(admission.install)
+
+# Endpoints by admission priority; anything not listed is NORMAL
+ENDPOINT_PRIORITIES = {
+    'home': admission.CRITICAL,
+    'get_post': admission.CRITICAL,
+    'get_users': admission.BULK,
+    'get_posts': admission.BULK,
+    'get_published_posts': admission.BULK,
+    'get_metrics': None,      # monitoring must work while overloaded
+    'get_cache_stats': None,
+    'get_admission_stats': None,
+}
+
 def get_db():
-    """Get database connection"""
+    """Get the current thread's pooled database connection"""
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row  # This enables column access by name
+        g.db = db_pool.get_pool(DATABASE).connection()  # rows come back as sqlite3.Row
     return g.db
 
-def close_db(e=None):
-    """Close database connection"""
+def release_db(e=None):
+    """Return the connection to the pool, rolling back any open transaction"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db_pool.get_pool(DATABASE).release()
 
 @app.teardown_appcontext
-def close_db(error):
-    close_db()
+def teardown_db(error):
+    release_db()
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = metrics.RequestTimer()
+    g.request_timer.start()
+
+@app.before_request
+def admit_request():
+    """Wait for an admission slot, or answer 503 with Retry-After"""
+    priority = ENDPOINT_PRIORITIES.get(request.endpoint, admission.NORMAL)
+    if priority is None:
+        return None
+    deadline = admission.request_deadline(
+        time.monotonic(), request.headers.get(admission.TIMEOUT_HEADER),
+        admission_control.request_timeout)
+    try:
+        admission_control.admit(priority, deadline)
+    except admission.Shed as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    g.admitted = True
+    return None
+
+@app.teardown_request
+def release_admission(error):
+    if g.pop('admitted', False):
+        admission_control.release()
+
+@app.errorhandler(sqlite3.OperationalError)
+def deadline_exceeded(error):
+    """SQLite statements are interrupted once the request's deadline passes"""
+    if not admission.deadline_exceeded():
+        raise error
+    response = jsonify({'error': 'Request deadline exceeded'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'other'
+        size = None if response.is_streamed else response.calculate_content_length()
+        timer.finish(route, request.method, response.status_code, size)
+    return response
+
+@app.after_request
+def compress_json(response):
+    """gzip JSON bodies, streamed or not, for clients that accept it"""
+    if response.mimetype != 'application/json' or response.status_code in (204, 304) \
+            or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    if response.is_streamed:
+        response.response = json_stream.gzip_chunks(response.response)
+    else:
+        body = response.get_data()
+        if len(body) < json_stream.MIN_GZIP_SIZE:
+            return response
+        response.set_data(json_stream.gzip_body(body))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.teardown_request
+def finish_failed_request(error):
+    timer = g.pop('request_timer', None)
+    if timer is not None:  # after_request never ran
+        route = request.url_rule.rule if request.url_rule is not None else 'other'
+        timer.finish(route, request.method, 500)
+
+def stream_json(chunks):
+    """Stream an incrementally encoded JSON body (sent chunked by the server)"""
+    return Response(stream_with_context(chunks), mimetype='application/json')
+
+def versioned_response(*tables):
+    """ETag a view's responses with the change counters of the tables it reads.
+
+    A matching If-None-Match is answered 304 without running the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            counters = table_versions.versions(get_db(), tables)
+            if counters is None:  # database without table_versions
+                return view(*args, **kwargs)
+            g.table_versions = counters  # part of cached_response's key
+            etag = table_versions.list_etag(counters, request.path,
+                                            request.query_string.decode())
+            if table_versions.etag_matches(request.headers.get('If-None-Match'), etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
+
+def cached_response(view):
+    """Serve a view from post_cache, with an ETag clients can revalidate.
+
+    Only complete 200 responses are stored; streamed and error responses
+    pass straight through.  The ETag is weak because compress_json may send
+    the same body gzip-compressed or not.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               g.get('table_versions'))
+        entry = post_cache.get(key)
+        status = 'HIT'
+        if entry is None:
+            generation = post_cache.generation
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = post_cache.put(key, response.get_data(), response.mimetype, generation)
+            status = 'MISS'
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag, weak=True)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'no-cache'  # always revalidate
+        response.headers['X-Cache'] = status
+        return response.make_conditional(request)
+    return wrapper
 
 # Routes
 @app.route('/')
@@ -35,66 +206,78 @@ def home():
     })
 
 @app.route('/api/users', methods=['GET'])
+@versioned_response('users')
 def get_users():
-    """Get all users"""
-    db = get_db()
-    users = db.execute(
-        'SELECT id, email, name, created_at FROM users ORDER BY created_at DESC'
-    ).fetchall()
+    """Get users, newest first, one page at a time (?limit=&after=&fields=, or ?all=1)"""
+    try:
+        page = listings.parse_page(request.args)
+        fields = listings.parse_fields(request.args, listings.USER_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'users': [dict(user) for user in users]
-    })
+    if page.unpaginated:
+        return stream_json(json_stream.encode_list(
+            'users', listings.stream_users(get_db(), fields)))
+    users, next_cursor = listings.list_users(get_db(), page, fields)
+    return jsonify(listings.list_response('users', users, next_cursor, page))
 
 @app.route('/api/posts', methods=['GET'])
+@versioned_response('posts', 'users')
+@cached_response
 def get_posts():
-    """Get all posts with author information"""
-    db = get_db()
-    posts = db.execute('''
-        SELECT p.id, p.title, p.content, p.published, p.created_at,
-               u.name as author_name, u.email as author_email
-        FROM posts p
-        LEFT JOIN users u ON p.author_id = u.id
-        ORDER BY p.created_at DESC
-    ''').fetchall()
+    """Get posts with author information, one page at a time"""
+    try:
+        page = listings.parse_page(request.args)
+        fields = listings.parse_fields(request.args, listings.POST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'posts': [dict(post) for post in posts]
-    })
+    if page.unpaginated:
+        return stream_json(json_stream.encode_list(
+            'posts', listings.stream_posts(get_db(), fields=fields)))
+    posts, next_cursor = listings.list_posts(get_db(), page, fields=fields)
+    return jsonify(listings.list_response('posts', posts, next_cursor, page))
 
 @app.route('/api/posts/published', methods=['GET'])
+@versioned_response('posts', 'users')
+@cached_response
 def get_published_posts():
-    """Get only published posts"""
-    db = get_db()
-    posts = db.execute('''
-        SELECT p.id, p.title, p.content, p.created_at,
-               u.name as author_name, u.email as author_email
-        FROM posts p
-        LEFT JOIN users u ON p.author_id = u.id
-        WHERE p.published = 1
-        ORDER BY p.created_at DESC
-    ''').fetchall()
+    """Get only published posts, one page at a time"""
+    try:
+        page = listings.parse_page(request.args)
+        fields = listings.parse_fields(request.args, listings.PUBLISHED_POST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'posts': [dict(post) for post in posts]
-    })
+    if page.unpaginated:
+        return stream_json(json_stream.encode_list(
+            'posts', listings.stream_posts(get_db(), published_only=True, fields=fields)))
+    posts, next_cursor = listings.list_posts(get_db(), page, published_only=True, fields=fields)
+    return jsonify(listings.list_response('posts', posts, next_cursor, page))
+
+@app.route('/api/posts/search', methods=['GET'])
+@versioned_response('posts', 'users')
+@cached_response
+def search_posts():
+    """Full-text search over post titles and content (?q=&limit=&offset=&published=)"""
+    body, status = search.search_response(get_db(), request.args)
+    return jsonify(body), status
 
 @app.route('/api/posts/<int:post_id>', methods=['GET'])
+@versioned_response('posts', 'users')
+@cached_response
 def get_post(post_id):
-    """Get a specific post by ID"""
-    db = get_db()
-    post = db.execute('''
-        SELECT p.id, p.title, p.content, p.published, p.created_at,
-               u.name as author_name, u.email as author_email
-        FROM posts p
-        LEFT JOIN users u ON p.author_id = u.id
-        WHERE p.id = ?
-    ''', (post_id,)).fetchone()
+    """Get a specific post by ID (?fields= to pick columns)"""
+    try:
+        fields = listings.parse_fields(request.args, listings.POST_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    post = listings.get_post(get_db(), post_id, fields)
     if post is None:
         return jsonify({'error': 'Post not found'}), 404
     
-    return jsonify({'post': dict(post)})
+    return jsonify({'post': post})
 
 @app.route('/api/posts', methods=['POST'])
 def create_post():
@@ -115,6 +298,7 @@ def create_post():
         (title, content, author_id, published)
     )
     db.commit()
+    post_cache.invalidate()
     
     return jsonify({
         'message': 'Post created successfully',
@@ -159,6 +343,7 @@ def update_post(post_id):
     query = f"UPDATE posts SET {', '.join(fields)} WHERE id = ?"
     db.execute(query, values)
     db.commit()
+    post_cache.invalidate()
     
     return jsonify({'message': 'Post updated successfully'})
 
@@ -174,9 +359,25 @@ def delete_post(post_id):
     
     db.execute('DELETE FROM posts WHERE id = ?', (post_id,))
     db.commit()
+    post_cache.invalidate()
     
     return jsonify({'message': 'Post deleted successfully'})
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this process"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admission/stats', methods=['GET'])
+def get_admission_stats():
+    """In-flight, queued and shed request counts"""
+    return jsonify(admission_control.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit and miss counters for the post response cache"""
+    return jsonify(post_cache.stats())
+
 if __name__ == '__main__':
     # Check if database exists
     if not os.path.exists(DATABASE):
@@ -189,9 +390,13 @@ if __name__ == '__main__':
     print("  GET    /api/users - All users")
     print("  GET    /api/posts - All posts")
     print("  GET    /api/posts/published - Published posts only")
+    print("  GET    /api/posts/search?q= - Full-text post search")
     print("  GET    /api/posts/<id> - Specific post")
     print("  POST   /api/posts - Create new post")
     print("  PUT    /api/posts/<id> - Update post")
     print("  DELETE /api/posts/<id> - Delete post")
+    print("  GET    /api/cache/stats - Post response cache counters")
+    print("  GET    /api/admission/stats - In-flight, queued and shed request counts")
+    print("  GET    /metrics - Prometheus metrics")
     
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
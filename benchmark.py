@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Load-testing harness for simple_server.py and app.py.
+
+Generates a database of the requested size in a scratch directory, starts
+one of the servers against it, drives request mixes from a pool of
+keep-alive client threads and prints the results as JSON:
+
+  python3 benchmark.py --server simple --server-args "--mode asyncio" \\
+      --users 10000 --posts 50000 --votes 2000000 --output before.json
+
+Scenarios for simple_server.py:
+
+  page-load   listeners opening /radio: page, stylesheet, now playing,
+              current track rating and the recently played batch lookup
+  vote-storm  everyone voting on the current track right after a change
+  polling     listeners refreshing now playing and ratings with think time
+
+Scenarios for app.py:
+
+  page-load   post feed, published feed, single posts and the user list
+  vote-storm  a burst of post creation and edits
+  polling     clients revalidating the feed with If-None-Match
+
+Each scenario reports throughput, p50/p95/p99 latency and the error rate
+(transport failures and 5xx/4xx responses other than 404).
+"""
+import argparse
+import http.client
+import http.server
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import ratings  # noqa: E402
+
+STATIC_FILES = ('index.html', 'radio.html', 'radio.css', 'index.css',
+                'RadioCalicoLogoTM.png', 'RadioCalicoLayout.png')
+SCENARIOS = ('page-load', 'vote-storm', 'polling')
+
+
+# Dataset
+
+def generate_database(path, users, posts, songs, listeners, votes, seed=1):
+    """Create database.db at path with the requested number of rows"""
+    rng = random.Random(seed)
+    subprocess.run([sys.executable, os.path.join(HERE, 'create_database.py')],
+                   cwd=os.path.dirname(path), check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    now = int(time.time())
+
+    def timestamp(max_age):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.randrange(max_age)))
+
+    conn.executemany(
+        'INSERT INTO users (email, password_hash, name, created_at) VALUES (?, ?, ?, ?)',
+        ((f'user{i}@example.com', 'hashed_password', f'User {i}', timestamp(86400 * 365))
+         for i in range(users)))
+    total_users = users + 2
+    conn.executemany(
+        'INSERT INTO posts (title, content, author_id, published, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((f'Post {i}', 'Lorem ipsum dolor sit amet. ' * rng.randint(1, 20),
+          rng.randint(1, total_users), rng.random() < 0.7, timestamp(86400 * 365))
+         for i in range(posts)))
+    conn.commit()
+
+    ratings.create_normalized_schema(conn)
+    ratings.set_meta(conn, 'ratings_storage', ratings.NORMALIZED)
+    # Bulk load without the count triggers, then compute the counts once
+    triggers = conn.execute("SELECT name FROM sqlite_master "
+                            "WHERE type = 'trigger' AND tbl_name = 'song_votes'").fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.executemany('INSERT INTO songs (id, title, artist, album) VALUES (?, ?, ?, ?)',
+                     ((i, f'Song {i}', f'Artist {i % 997}', f'Album {i % 3001}')
+                      for i in range(1, songs + 1)))
+    conn.executemany('INSERT INTO listeners (id, identifier) VALUES (?, ?)',
+                     ((i, f'listener-{i:016x}') for i in range(1, listeners + 1)))
+    conn.executemany(
+        'INSERT INTO song_votes (song_id, listener_id, rating, created_at) VALUES (?, ?, ?, ?)',
+        ((song, listener, 1 if rng.random() < 0.7 else -1, timestamp(86400 * 30))
+         for song, listener in vote_pairs(rng, songs, listeners, votes)))
+    ratings.rebuild_totals(conn)
+    ratings.create_normalized_schema(conn)  # puts the triggers back
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def vote_pairs(rng, songs, listeners, votes):
+    """Distinct (song, listener) pairs with a long-tailed song popularity"""
+    weights = [1 / rank for rank in range(1, songs + 1)]
+    scale = votes / sum(weights)
+    for song, weight in enumerate(weights, 1):
+        count = min(listeners, round(weight * scale))
+        start = rng.randrange(listeners)
+        for offset in range(count):
+            yield song, (start + offset) % listeners + 1
+
+
+# Servers
+
+class MetadataHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the station metadata feed"""
+    track = {}
+
+    def do_GET(self):
+        body = json.dumps(self.track).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metadata_stub(songs):
+    MetadataHandler.track = {'title': 'Song 1', 'artist': 'Artist 1', 'album': 'Album 1'}
+    for i in range(1, 6):
+        song = min(i + 1, songs)
+        MetadataHandler.track[f'prev_title_{i}'] = f'Song {song}'
+        MetadataHandler.track[f'prev_artist_{i}'] = f'Artist {song % 997}'
+    stub = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MetadataHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    return stub
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, workdir, port, extra_args, metadata_url):
+    if kind == 'simple':
+        command = [sys.executable, os.path.join(HERE, 'simple_server.py'), '--port', str(port),
+                   '--metadata-url', metadata_url, '--metadata-interval', '1',
+                   '--rollup-interval', '0']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', os.path.join(HERE, 'app.py'),
+                   'run', '--port', str(port), '--with-threads']
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command + extra_args, cwd=workdir, stdout=log,
+                               stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}; see {log.name}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            time.sleep(0.5)  # let pollers and caches warm up
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('server did not start listening within 30 seconds')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# Request mixes; each returns a list of (method, path, body, headers)
+
+def simple_mix(scenario, rng, state):
+    if scenario == 'page-load':
+        recent = [{'title': f'Song {i}', 'artist': f'Artist {i % 997}'} for i in range(2, 7)]
+        return [
+            ('GET', '/radio', None, {}),
+            ('GET', '/radio.css', None, {}),
+            ('GET', '/api/now-playing', None, {}),
+            ('GET', '/api/ratings/song?title=Song%201&artist=Artist%201', None, {}),
+            ('POST', '/api/ratings/batch', {'songs': recent}, {}),
+        ]
+    if scenario == 'vote-storm':
+        listener = rng.randrange(state['listeners'] * 4)
+        vote = {'title': 'Song 1', 'artist': 'Artist 1', 'album': 'Album 1',
+                'rating': rng.choice((1, 1, 1, -1)),
+                'browser_fingerprint': f'bench-{listener}'}
+        # Spread listeners over addresses so the per-IP vote limit sees many clients
+        ip = f'10.{listener >> 16 & 255}.{listener >> 8 & 255}.{listener & 255}'
+        return [('POST', '/api/ratings', vote, {'X-Forwarded-For': ip})]
+    song = rng.randint(1, min(state['songs'], 50))
+    return [
+        ('GET', '/api/now-playing', None, {}),
+        ('GET', f'/api/ratings/song?title=Song%20{song}&artist=Artist%20{song % 997}', None, {}),
+    ]
+
+
+def flask_mix(scenario, rng, state):
+    post_id = rng.randint(1, max(state['posts'], 1))
+    if scenario == 'page-load':
+        return [
+            ('GET', '/api/posts', None, {}),
+            ('GET', '/api/posts/published', None, {}),
+            ('GET', f'/api/posts/{post_id}', None, {}),
+            ('GET', '/api/users', None, {}),
+        ]
+    if scenario == 'vote-storm':
+        if rng.random() < 0.5:
+            return [('POST', '/api/posts', {'title': 'Benchmark post', 'content': 'x' * 200,
+                                            'author_id': 1, 'published': 1}, {})]
+        return [('PUT', f'/api/posts/{post_id}', {'title': f'Edited {rng.random()}'}, {})]
+    etag = state['etags'].get('/api/posts')
+    return [('GET', '/api/posts', None, {'If-None-Match': etag} if etag else {})]
+
+
+# Load generation
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, status, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 'error' or (isinstance(status, int) and status >= 400 and status != 404):
+                self.errors += 1
+
+
+def client_loop(port, mix, scenario, state, recorder, stop_at, think, seed):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.monotonic() < stop_at:
+        for method, path, body, headers in mix(scenario, rng, state):
+            payload = json.dumps(body).encode() if body is not None else None
+            if payload is not None:
+                headers = dict(headers, **{'Content-Type': 'application/json'})
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader('ETag'):
+                    state['etags'][path] = response.getheader('ETag')
+                if response.getheader('Connection', '').lower() == 'close' or \
+                        response.version == 10:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                status = 'error'
+                conn.close()
+            recorder.record(status, time.perf_counter() - started)
+        if think:
+            time.sleep(rng.uniform(0.5, 1.5) * think)
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(port, kind, scenario, clients, duration, think, state):
+    mix = simple_mix if kind == 'simple' else flask_mix
+    recorder = Recorder()
+    stop_at = time.monotonic() + duration
+    threads = [threading.Thread(target=client_loop,
+                                args=(port, mix, scenario, state, recorder, stop_at, think, i))
+               for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = sorted(recorder.latencies)
+    total = len(latencies)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'clients': clients,
+        'duration_s': round(elapsed, 3),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 1) if elapsed else 0,
+        'errors': recorder.errors,
+        'error_rate': round(recorder.errors / total, 5) if total else None,
+        'status_counts': {str(status): count for status, count in sorted(
+            recorder.statuses.items(), key=lambda item: str(item[0]))},
+        'latency_ms': {
+            'mean': ms(sum(latencies) / total) if total else None,
+            'p50': ms(percentile(latencies, 0.50)),
+            'p95': ms(percentile(latencies, 0.95)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark simple_server.py or app.py')
+    parser.add_argument('--server', choices=('simple', 'flask'), default='simple')
+    parser.add_argument('--server-args', default='',
+                        help='Extra arguments for the server, e.g. "--mode asyncio --workers 4"')
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent client connections')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds per scenario')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='Mean think time between polls in the polling scenario')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--songs', type=int, default=5000)
+    parser.add_argument('--listeners', type=int, default=20000)
+    parser.add_argument('--votes', type=int, default=200000)
+    parser.add_argument('--database', help='Reuse this database file instead of generating one '
+                                           '(it is copied, never modified)')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='radiocalico-bench-')
+    db_path = os.path.join(workdir, 'database.db')
+    for name in STATIC_FILES:
+        if os.path.exists(os.path.join(HERE, name)):
+            shutil.copy(os.path.join(HERE, name), workdir)
+
+    started = time.perf_counter()
+    if args.database:
+        shutil.copy(args.database, db_path)
+    else:
+        print(f"Generating database in {workdir}...", file=sys.stderr)
+        generate_database(db_path, args.users, args.posts, args.songs, args.listeners, args.votes)
+    generated_in = time.perf_counter() - started
+
+    stub = start_metadata_stub(args.songs)
+    port = free_port()
+    process = start_server(args.server, workdir, port, args.server_args.split(),
+                           f'http://127.0.0.1:{stub.server_port}/metadata.json')
+    state = {'songs': args.songs, 'posts': args.posts, 'listeners': args.listeners, 'etags': {}}
+    results = {}
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())  # when the load begins
+    try:
+        for scenario in (SCENARIOS if args.scenario == 'all' else (args.scenario,)):
+            print(f"Running {scenario} for {args.duration:g}s with {args.clients} clients...",
+                  file=sys.stderr)
+            think = args.poll_interval if scenario == 'polling' else 0
+            results[scenario] = run_scenario(port, args.server, scenario, args.clients,
+                                             args.duration, think, state)
+    finally:
+        stop_server(process)
+        stub.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'server': args.server,
+        'server_args': args.server_args,
+        'revision': git_revision(),
+        'started_at': started_at,
+        'python': sys.version.split()[0],
+        'dataset': {
+            'users': args.users, 'posts': args.posts, 'songs': args.songs,
+            'listeners': args.listeners, 'votes': args.votes,
+            'source': args.database or 'generated',
+            'generated_in_s': round(generated_in, 2),
+        },
+        'scenarios': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Stream users, posts and song ratings between database.db and CSV/JSONL files.
+
+  python3 bulk_io.py export ratings votes.csv
+  python3 bulk_io.py import ratings votes.csv --defer-indexes
+  python3 bulk_io.py export posts posts.jsonl --format jsonl
+
+Exports read the table in primary key order, one keyset chunk at a time,
+so memory use stays flat however large the table is.  Imports insert with
+executemany, one transaction per chunk, and upsert on the natural key so a
+file can be loaded twice without duplicating rows.
+
+Both directions record their position in a <file>.progress sidecar after
+every chunk; run the same command with --resume to continue an
+interrupted transfer.  --defer-indexes drops a table's secondary indexes
+and triggers for the duration of an import and rebuilds them (and the
+materialized rating counts or the post search index) once at the end.
+
+Ratings are exported as title, artist, album, user_identifier, rating and
+created_at whichever rating storage the database uses, including votes
+that rollups.py moved to song_votes_archive, and imported into the
+storage it uses.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import db_pool
+import ratings
+import search
+import table_versions
+
+DEFAULT_CHUNK = 50000
+
+TABLES = {
+    'users': ['id', 'email', 'password_hash', 'name', 'created_at', 'updated_at'],
+    'posts': ['id', 'title', 'content', 'author_id', 'published', 'created_at', 'updated_at'],
+    'ratings': ['title', 'artist', 'album', 'user_identifier', 'rating', 'created_at'],
+}
+
+csv.field_size_limit(sys.maxsize)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)  # explicit transactions
+    for name, value in db_pool.PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    conn.execute('PRAGMA cache_size = -200000')
+    return conn
+
+
+# Progress sidecar
+
+def progress_path(path):
+    return path + '.progress'
+
+
+def load_progress(path, resume):
+    if resume and os.path.exists(progress_path(path)):
+        with open(progress_path(path)) as f:
+            return json.load(f)
+    return None
+
+
+def save_progress(path, state):
+    tmp = progress_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, progress_path(path))
+
+
+def report(verb, rows, started):
+    rate = rows / max(time.monotonic() - started, 1e-6)
+    print(f"  {verb} {rows} rows ({rate:.0f}/s)", file=sys.stderr)
+
+
+# Export
+
+def export_query(conn, table):
+    """SQL selecting one keyset chunk, and the number of key columns it starts with"""
+    if table != 'ratings':
+        columns = ', '.join(TABLES[table])
+        return f'SELECT id, {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?', 1
+    if ratings.detect_storage(conn) == ratings.NORMALIZED:
+        votes = 'song_votes'
+        if ratings.detect_vote_archive(conn):
+            # Votes moved out by rollups.py; a pair in both tables is exported once
+            votes = '''(SELECT * FROM (SELECT song_id, listener_id, rating, created_at
+                                       FROM song_votes WHERE (song_id, listener_id) > (?1, ?2)
+                                       ORDER BY song_id, listener_id LIMIT ?3)
+                        UNION ALL
+                        SELECT * FROM (SELECT song_id, listener_id, rating, created_at
+                                       FROM song_votes_archive a
+                                       WHERE (song_id, listener_id) > (?1, ?2)
+                                         AND NOT EXISTS (SELECT 1 FROM song_votes h
+                                                         WHERE h.song_id = a.song_id
+                                                           AND h.listener_id = a.listener_id)
+                                       ORDER BY song_id, listener_id LIMIT ?3))'''
+        return f'''SELECT v.song_id, v.listener_id, s.title, s.artist, s.album,
+                          l.identifier, v.rating, v.created_at
+                   FROM {votes} v
+                   JOIN songs s ON s.id = v.song_id
+                   JOIN listeners l ON l.id = v.listener_id
+                   WHERE (v.song_id, v.listener_id) > (?1, ?2)
+                   ORDER BY v.song_id, v.listener_id LIMIT ?3''', 2
+    return '''SELECT id, song_title, song_artist, song_album, user_identifier, rating, created_at
+              FROM song_ratings WHERE id > ? ORDER BY id LIMIT ?''', 1
+
+
+def export_table(conn, table, path, fmt, chunk, resume):
+    sql, key_columns = export_query(conn, table)
+    progress = load_progress(path, resume)
+    if progress:
+        last_key, rows = progress['last_key'], progress['rows']
+        out = open(path, 'r+', newline='', encoding='utf-8')
+        out.truncate(progress['bytes'])  # drop anything written after the last checkpoint
+        out.seek(progress['bytes'])
+        print(f"Resuming export after {rows} rows", file=sys.stderr)
+    else:
+        last_key, rows = [0] * key_columns, 0
+        out = open(path, 'w', newline='', encoding='utf-8')
+    columns = TABLES[table]
+    writer = csv.writer(out) if fmt == 'csv' else None
+    if writer is not None and not progress:
+        writer.writerow(columns)
+    started = time.monotonic()
+    with out:
+        while True:
+            batch = conn.execute(sql, (*last_key, chunk)).fetchall()
+            if not batch:
+                break
+            for row in batch:
+                values = row[key_columns:]
+                if writer is not None:
+                    writer.writerow(values)
+                else:
+                    out.write(json.dumps(dict(zip(columns, values))) + '\n')
+            last_key = list(batch[-1][:key_columns])
+            rows += len(batch)
+            out.flush()
+            save_progress(path, {'last_key': last_key, 'rows': rows, 'bytes': out.tell()})
+            report('exported', rows, started)
+    os.remove(progress_path(path))
+    print(f"Exported {rows} {table} rows to {path}")
+
+
+# Import
+
+def read_records(path, fmt, columns):
+    """Yield tuples in column order from a CSV (with header) or JSONL file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield tuple(record.get(column) or None for column in columns)
+        else:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield tuple(record.get(column) for column in columns)
+
+
+def chunks(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+UPSERTS = {
+    'users': '''INSERT INTO users (id, email, password_hash, name, created_at, updated_at)
+                VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+                ON CONFLICT (id) DO UPDATE SET
+                    email = excluded.email, password_hash = excluded.password_hash,
+                    name = excluded.name, created_at = excluded.created_at,
+                    updated_at = excluded.updated_at''',
+    'posts': '''INSERT INTO posts (id, title, content, author_id, published, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP))
+                ON CONFLICT (id) DO UPDATE SET
+                    title = excluded.title, content = excluded.content,
+                    author_id = excluded.author_id, published = excluded.published,
+                    created_at = excluded.created_at, updated_at = excluded.updated_at''',
+}
+
+
+def import_ratings_chunk(conn, batch, storage):
+    """Load one chunk of ratings with set-based statements from a temp table"""
+    conn.execute('DELETE FROM temp.import_votes')
+    conn.executemany('INSERT INTO temp.import_votes VALUES (?, ?, ?, ?, ?, ?)', batch)
+    if storage == ratings.LEGACY:
+        conn.execute('''
+            INSERT INTO song_ratings (song_title, song_artist, song_album, user_identifier,
+                                      rating, created_at)
+            SELECT title, artist, album, user_identifier, rating,
+                   COALESCE(created_at, CURRENT_TIMESTAMP)
+            FROM temp.import_votes WHERE true
+            ON CONFLICT (song_title, song_artist, user_identifier) DO UPDATE
+            SET rating = excluded.rating, created_at = excluded.created_at''')
+        return
+    conn.execute('''
+        INSERT INTO songs (title, artist, album)
+        SELECT title, artist, MAX(album) FROM temp.import_votes GROUP BY title, artist
+        ON CONFLICT DO NOTHING''')
+    conn.execute('''
+        INSERT INTO listeners (identifier)
+        SELECT DISTINCT user_identifier FROM temp.import_votes WHERE true
+        ON CONFLICT DO NOTHING''')
+    conn.execute('''
+        INSERT INTO song_votes (song_id, listener_id, rating, created_at)
+        SELECT s.id, l.id, i.rating, COALESCE(i.created_at, CURRENT_TIMESTAMP)
+        FROM temp.import_votes i
+        JOIN songs s ON s.title = i.title AND s.artist = i.artist
+        JOIN listeners l ON l.identifier = i.user_identifier
+        WHERE true
+        ON CONFLICT (song_id, listener_id) DO UPDATE
+        SET rating = excluded.rating, created_at = excluded.created_at''')
+
+
+def deferrable(conn, table):
+    """CREATE statements of the secondary indexes and triggers on table"""
+    return [sql for (sql,) in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+        "AND sql IS NOT NULL ORDER BY type", (table,))]
+
+
+def drop_deferred(conn, table):
+    for kind, name in conn.execute(
+            "SELECT type, name FROM sqlite_master WHERE tbl_name = ? "
+            "AND type IN ('index', 'trigger') AND sql IS NOT NULL", (table,)).fetchall():
+        conn.execute(f'DROP {kind.upper()} {name}')
+
+
+def import_table(conn, table, path, fmt, chunk, resume, defer_indexes):
+    storage = ratings.detect_storage(conn)
+    if table == 'ratings':
+        target = 'song_votes' if storage == ratings.NORMALIZED else 'song_ratings'
+        conn.execute('''CREATE TEMP TABLE IF NOT EXISTS import_votes (
+            title TEXT NOT NULL, artist TEXT NOT NULL, album TEXT,
+            user_identifier TEXT NOT NULL, rating INTEGER NOT NULL, created_at TEXT)''')
+    else:
+        target = table
+
+    progress = load_progress(path, resume) or {}
+    deferred = progress.get('deferred')
+    if defer_indexes and deferred is None:
+        deferred = deferrable(conn, target)
+        conn.execute('BEGIN IMMEDIATE')
+        drop_deferred(conn, target)
+        conn.execute('COMMIT')
+    skip = progress.get('rows', 0)
+    if skip:
+        print(f"Resuming import after {skip} rows", file=sys.stderr)
+
+    records = read_records(path, fmt, TABLES[table])
+    for _ in range(skip):
+        next(records, None)
+    rows = skip
+    started = time.monotonic()
+    for batch in chunks(records, chunk):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if table == 'ratings':
+                import_ratings_chunk(conn, batch, storage)
+            else:
+                conn.executemany(UPSERTS[table], batch)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        rows += len(batch)
+        save_progress(path, {'rows': rows, 'deferred': deferred})
+        report('imported', rows, started)
+
+    if deferred:
+        print(f"Rebuilding {len(deferred)} indexes and triggers on {target}...", file=sys.stderr)
+        conn.execute('BEGIN IMMEDIATE')
+        for statement in deferred:
+            conn.execute(statement)
+        if target == 'song_votes':
+            ratings.rebuild_totals(conn)
+        elif target == 'posts' and search.has_search_index(conn):
+            search.rebuild_search_index(conn)  # its triggers were dropped too
+        if target in table_versions.TRACKED_TABLES and table_versions.has_version_tracking(conn):
+            table_versions.bump(conn, target)  # so are the change counter's
+        conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    os.remove(progress_path(path))
+    print(f"Imported {rows} {table} rows from {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk CSV/JSONL import and export')
+    parser.add_argument('direction', choices=('import', 'export'))
+    parser.add_argument('table', choices=sorted(TABLES))
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='Defaults to the file extension, else csv')
+    parser.add_argument('--database', default='database.db')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK,
+                        help='Rows per transaction / export query')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the <file>.progress checkpoint')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='Drop secondary indexes and triggers while importing')
+    args = parser.parse_args()
+    fmt = args.format or ('jsonl' if args.file.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    conn = connect(args.database)
+    try:
+        if args.direction == 'export':
+            export_table(conn, args.table, args.file, fmt, args.chunk, args.resume)
+        else:
+            import_table(conn, args.table, args.file, fmt, args.chunk, args.resume,
+                         args.defer_indexes)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
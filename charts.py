@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Top rated song charts for /api/charts.
+
+Vote counts per song and hour are kept in song_rating_hourly by triggers on
+song_votes (see ratings.py), so every vote updates its hour bucket as it is
+written.  A chart sums the buckets in its window - the last hour, day or
+week - or reads song_rating_totals for all time, and ranks songs by the
+Wilson score lower bound of their thumbs up share: a song needs both a high
+share and enough votes to rank well.
+
+The month chart reaches past the hour buckets kept by rollups.py, so it
+adds whole days from song_rating_daily to the hour buckets in its window.
+
+Ranked charts are kept in memory and recomputed from the buckets at most
+once per refresh interval, so serving one is a slice of a ready list.
+Rankings are not maintained on the write path: an in-memory top list
+would differ between prefork workers.  A rebuild instead reads one row
+per song and bucket in its window (one per rated song for 'all'), so its
+cost follows the number of songs voted on, not the number of votes.
+"""
+import heapq
+import math
+import threading
+import time
+
+WINDOWS = {'hour': 1, 'day': 24, 'week': 24 * 7, 'month': 24 * 30, 'all': None}  # window -> hours
+HOURLY_WINDOWS = ('hour', 'day', 'week')  # always within the hour buckets kept
+DEFAULT_WINDOW = 'day'
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+DEFAULT_REFRESH = 10.0
+Z = 1.96  # 95% confidence
+
+
+def wilson_lower_bound(thumbs_up, thumbs_down, z=Z):
+    """Lower bound of the Wilson score interval for the thumbs up share"""
+    n = thumbs_up + thumbs_down
+    if n <= 0:
+        return 0.0
+    share = thumbs_up / n
+    spread = z * math.sqrt((share * (1 - share) + z * z / (4 * n)) / n)
+    return (share + z * z / (2 * n) - spread) / (1 + z * z / n)
+
+
+def current_hour():
+    return int(time.time()) // 3600
+
+
+class ChartBoard:
+    def __init__(self, refresh=DEFAULT_REFRESH, size=MAX_LIMIT):
+        self.refresh = refresh
+        self.size = size
+        self._charts = {}  # window -> (computed_at, [entry, ...])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.rebuilds = 0
+
+    def top(self, conn, window, limit=DEFAULT_LIMIT):
+        """Return the best `limit` entries of a window's chart.
+
+        Entries are dicts with rank, song, ratings and score, best first.
+        """
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown chart window: {window}")
+        cached = self._charts.get(window)
+        if cached is None or time.monotonic() - cached[0] > self.refresh:
+            with self._lock:
+                cached = self._charts.get(window)
+                # Another thread may have rebuilt it while this one waited
+                if cached is None or time.monotonic() - cached[0] > self.refresh:
+                    cached = (time.monotonic(), self._rank(conn, window))
+                    self._charts[window] = cached
+                    self.rebuilds += 1
+                    return cached[1][:limit]
+        with self._lock:
+            self.hits += 1
+        return cached[1][:limit]
+
+    def invalidate(self):
+        with self._lock:
+            self._charts.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'windows': sorted(self._charts),
+                'hits': self.hits,
+                'rebuilds': self.rebuilds,
+            }
+
+    def _rank(self, conn, window):
+        hours = WINDOWS[window]
+        if hours is None:
+            rows = conn.execute(
+                '''SELECT s.title, s.artist, s.album, t.thumbs_up, t.thumbs_down
+                   FROM song_rating_totals t JOIN songs s ON s.id = t.song_id
+                   WHERE t.thumbs_up > 0'''
+            )
+        elif window in HOURLY_WINDOWS:
+            rows = conn.execute(
+                '''SELECT s.title, s.artist, s.album, h.up, h.down
+                   FROM (SELECT song_id, SUM(thumbs_up) AS up, SUM(thumbs_down) AS down
+                         FROM song_rating_hourly WHERE hour > ?
+                         GROUP BY song_id) h
+                   JOIN songs s ON s.id = h.song_id
+                   WHERE h.up > 0''',
+                (current_hour() - hours,)
+            )
+        else:
+            # Days hold only hours before the rollup watermark, so the two never overlap
+            start = current_hour() - hours
+            rows = conn.execute(
+                '''SELECT s.title, s.artist, s.album, h.up, h.down
+                   FROM (SELECT song_id, SUM(thumbs_up) AS up, SUM(thumbs_down) AS down
+                         FROM (SELECT song_id, thumbs_up, thumbs_down
+                               FROM song_rating_hourly WHERE hour > ?
+                               UNION ALL
+                               SELECT song_id, thumbs_up, thumbs_down
+                               FROM song_rating_daily WHERE day > ?)
+                         GROUP BY song_id) h
+                   JOIN songs s ON s.id = h.song_id
+                   WHERE h.up > 0''',
+                (start, start // 24)
+            )
+        scored = ((wilson_lower_bound(up, down), up, title, artist, album, down)
+                  for title, artist, album, up, down in rows)
+        best = heapq.nlargest(self.size, scored, key=lambda entry: entry[:2])
+        return [
+            {
+                'rank': rank,
+                'song': {'title': title, 'artist': artist, 'album': album},
+                'ratings': {'thumbs_up': up, 'thumbs_down': down, 'total': up + down},
+                'score': round(score, 4),
+            }
+            for rank, (score, up, title, artist, album, down) in enumerate(best, 1)
+        ]
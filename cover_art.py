@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""Album art proxy for simple_server.py.
+
+The station publishes the current track's artwork at one fixed URL.
+CoverArt fetches it once per track (and otherwise only revalidates it with
+a conditional request every `refresh` seconds), stores the image under a
+hash of its content and, when the optional Pillow package is installed,
+renders a few fixed-size JPEG thumbnails of it once.  Every variant then
+has a URL that can never change meaning, /api/cover/<hash>-<size>.jpg, so
+browsers may cache it forever and a track change costs one origin fetch
+for the whole server rather than one per listener.
+
+Requests never wait for the origin: current() answers from what has been
+fetched, and a changed track or an expired check wakes a background
+thread that does the fetch.  The now-playing poller also calls update()
+on a track change, so the new cover is usually ready before the change
+is announced.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, namedtuple
+
+try:
+    from PIL import Image
+except ImportError:  # optional: only the original image is served without it
+    Image = None
+
+DEFAULT_COVER_URL = 'https://d3d4yli4hf5bmh.cloudfront.net/cover.jpg'
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'radiocalico-covers')
+DEFAULT_SIZES = (100, 300, 600)
+DEFAULT_REFRESH = 15.0
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MAX_COVERS = 200    # distinct images kept on disk
+MEMORY_ENTRIES = 64         # variants kept in memory
+THUMBNAIL_QUALITY = 85
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+CONTENT_TYPES = {ext: content_type for content_type, ext in EXTENSIONS.items()}
+
+_VARIANT = re.compile(r'^([0-9a-f]{32})(?:-(\d+))?(\.[a-z]+)$')
+
+Variant = namedtuple('Variant', 'body content_type etag')
+
+
+def _sniff_type(body, fallback):
+    if body.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if body.startswith(b'\x89PNG'):
+        return 'image/png'
+    if body[:4] == b'RIFF' and body[8:12] == b'WEBP':
+        return 'image/webp'
+    if body.startswith(b'GIF8'):
+        return 'image/gif'
+    return fallback
+
+
+class CoverArt:
+    def __init__(self, url=DEFAULT_COVER_URL, cache_dir=DEFAULT_CACHE_DIR,
+                 sizes=DEFAULT_SIZES, refresh=DEFAULT_REFRESH, timeout=DEFAULT_TIMEOUT,
+                 max_covers=DEFAULT_MAX_COVERS):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.sizes = tuple(sorted(sizes)) if Image is not None else ()
+        self.refresh = refresh
+        self.timeout = timeout
+        self.max_covers = max_covers
+        self.track = None           # track the current cover was fetched for
+        self.digest = None          # content hash of the current cover
+        self.extension = None
+        self.checked_at = 0.0
+        self._etag = None
+        self._last_modified = None
+        self._fetch_lock = threading.Lock()  # one origin fetch at a time
+        self._lock = threading.Lock()
+        self._wanted = None                  # track the refresher should fetch for
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._memory = OrderedDict()          # file name -> Variant
+        self.fetches = 0
+        self.not_modified = 0
+        self.new_covers = 0
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='cover-art', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # Fetches only when current() asks, so an idle server leaves the origin alone
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            self.update(self._wanted)
+
+    def current(self, track=None):
+        """URLs of the cover for track, or None until it has been fetched.
+
+        Never blocks: if the track changed or the last check has expired,
+        the background thread is asked to fetch it.
+        """
+        with self._lock:
+            digest, extension, fetched_for = self.digest, self.extension, self.track
+        if not self._fresh(track):
+            self._wanted = track
+            self._wake.set()
+        if digest is None or fetched_for != track:
+            return None
+        return self.urls(digest, extension)
+
+    def update(self, track=None):
+        """Fetch or revalidate the cover for track unless it is fresh (blocks)"""
+        self._wanted = track
+        if not self._fresh(track):
+            with self._fetch_lock:
+                if not self._fresh(track):  # another thread may have fetched it meanwhile
+                    self._check(track)
+
+    def _fresh(self, track):
+        return (self.digest is not None and track == self.track
+                and time.monotonic() - self.checked_at < self.refresh)
+
+    def urls(self, digest, extension):
+        return {
+            'original': f'/api/cover/{digest}{extension}',
+            'sizes': {str(size): f'/api/cover/{digest}-{size}.jpg' for size in self.sizes},
+        }
+
+    def _check(self, track):
+        """Fetch the cover, or confirm it is unchanged, and store new images"""
+        request = urllib.request.Request(self.url)
+        if track == self.track and self.digest is not None:
+            # Same track: a conditional request is enough
+            if self._etag:
+                request.add_header('If-None-Match', self._etag)
+            if self._last_modified:
+                request.add_header('If-Modified-Since', self._last_modified)
+        self.fetches += 1
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                content_type = _sniff_type(body, response.headers.get_content_type())
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+            extension = EXTENSIONS.get(content_type)
+            if extension is None:
+                self.errors += 1
+                return
+            digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+            if not os.path.exists(self._path(f'{digest}{extension}')):
+                self._store(digest, extension, body)
+                self.new_covers += 1
+            with self._lock:
+                self.digest, self.extension, self.track = digest, extension, track
+            self._etag, self._last_modified = etag, last_modified
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                self.not_modified += 1
+            else:
+                self.errors += 1
+        except (urllib.error.URLError, OSError):
+            self.errors += 1
+        finally:
+            # Errors keep the last cover until the next check instead of
+            # sending every request to the origin
+            with self._lock:
+                self.track = track
+                self.checked_at = time.monotonic()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _write(self, name, body):
+        tmp = self._path(f'{name}.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, self._path(name))
+
+    def _store(self, digest, extension, body):
+        """Write the original and its thumbnails, then prune old covers"""
+        for size in self.sizes:
+            self._write(f'{digest}-{size}.jpg', self._thumbnail(body, size))
+        self._write(f'{digest}{extension}', body)  # last, so its presence means complete
+        self._prune()
+
+    def _thumbnail(self, body, size):
+        with Image.open(io.BytesIO(body)) as image:
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+            return out.getvalue()
+
+    def _prune(self):
+        """Remove the least recently stored covers beyond max_covers"""
+        originals = []
+        with os.scandir(self.cache_dir) as scan:
+            for item in scan:
+                match = _VARIANT.match(item.name)
+                if match and match.group(2) is None:
+                    originals.append((item.stat().st_mtime, match.group(1)))
+        originals.sort(reverse=True)
+        for _, digest in originals[self.max_covers:]:
+            if digest == self.digest:
+                continue
+            with os.scandir(self.cache_dir) as scan:
+                for item in scan:
+                    if item.name.startswith(digest):
+                        try:
+                            os.remove(item.path)
+                        except OSError:
+                            pass
+
+    def variant(self, name):
+        """Variant for a hashed file name like <hash>-300.jpg, or None"""
+        match = _VARIANT.match(name)
+        if match is None:
+            return None
+        with self._lock:
+            cached = self._memory.get(name)
+            if cached is not None:
+                self._memory.move_to_end(name)
+                self.hits += 1
+                return cached
+        try:
+            with open(self._path(name), 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        cached = Variant(body, CONTENT_TYPES.get(match.group(3), 'application/octet-stream'),
+                         f'"{name}"')
+        with self._lock:
+            self.misses += 1
+            self._memory[name] = cached
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+        return cached
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'current': self.digest,
+            'sizes': list(self.sizes),
+            'thumbnails': Image is not None,
+            'fetches': self.fetches,
+            'not_modified': self.not_modified,
+            'new_covers': self.new_covers,
+            'errors': self.errors,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -2,6 +2,9 @@
 import sqlite3
 import os
 
+import search
+import table_versions
+
 # Create database connection
 db_path = 'database.db'
 conn = sqlite3.connect(db_path)
@@ -35,6 +38,18 @@ CREATE TABLE posts (
 )
 ''')
 
+# Indexes for keyset pagination of the user and post lists
+cursor.execute('CREATE INDEX idx_users_created ON users (created_at, id)')
+cursor.execute('CREATE INDEX idx_posts_created ON posts (created_at, id)')
+cursor.execute('CREATE INDEX idx_posts_published_created ON posts (published, created_at, id)')
+cursor.execute('CREATE INDEX idx_posts_author ON posts (author_id)')
+
+# Full-text index over post titles and content, kept current by triggers
+search.create_search_index(conn)
+
+# Change counters for users and posts, behind the list endpoints' ETags
+table_versions.create_version_tracking(conn)
+
 print("Inserting sample data...")
 
 # Insert sample users
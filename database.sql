@@ -23,6 +23,67 @@ CREATE TABLE posts (
     FOREIGN KEY (author_id) REFERENCES users(id)
 );
 
+-- Indexes for keyset pagination of the user and post lists
+CREATE INDEX idx_users_created ON users (created_at, id);
+CREATE INDEX idx_posts_created ON posts (created_at, id);
+CREATE INDEX idx_posts_published_created ON posts (published, created_at, id);
+CREATE INDEX idx_posts_author ON posts (author_id);
+
+-- Full-text index over post titles and content, kept current by triggers
+CREATE VIRTUAL TABLE posts_fts USING fts5(
+    title, content,
+    content = 'posts', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2',
+    prefix = '3'
+);
+
+CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+END;
+
+CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content)
+    VALUES ('delete', old.id, old.title, old.content);
+END;
+
+CREATE TRIGGER posts_fts_update AFTER UPDATE OF id, title, content ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title, content)
+    VALUES ('delete', old.id, old.title, old.content);
+    INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+END;
+
+-- Change counters for users and posts, behind the list endpoints' ETags
+CREATE TABLE table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT INTO table_versions (name) VALUES ('users'), ('posts');
+
+CREATE TRIGGER users_version_insert AFTER INSERT ON users BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+END;
+
+CREATE TRIGGER users_version_update AFTER UPDATE ON users BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+END;
+
+CREATE TRIGGER users_version_delete AFTER DELETE ON users BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+END;
+
+CREATE TRIGGER posts_version_insert AFTER INSERT ON posts BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER posts_version_update AFTER UPDATE ON posts BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
+CREATE TRIGGER posts_version_delete AFTER DELETE ON posts BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE name = 'posts';
+END;
+
 -- Insert sample data
 INSERT INTO users (email, password_hash, name) VALUES 
     ('admin@example.com', 'hashed_password', 'Admin User'),
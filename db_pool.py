@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Shared SQLite connection pool for simple_server.py and app.py.
+
+Each thread (and, after a fork, each worker process) keeps one long-lived
+connection instead of reconnecting per request.  A thread's connection is
+closed when the thread exits, so servers that start a thread per request
+(Flask's dev server, ThreadingHTTPServer) do not leak one per request.
+Connections are opened in WAL mode so readers never block the rating
+writer, with a busy timeout so a burst of votes waits for the write lock
+instead of failing with "database is locked", and with a larger prepared
+statement cache.
+"""
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+DATABASE = 'database.db'
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',     # safe with WAL, avoids an fsync per commit
+    'cache_size': -20000,        # ~20 MB page cache per connection
+    'mmap_size': 268435456,      # 256 MB memory-mapped reads
+    'busy_timeout': 5000,        # ms to wait for a lock before erroring
+    'temp_store': 'MEMORY',
+}
+
+CACHED_STATEMENTS = 256
+
+_pools = {}
+_pools_lock = threading.Lock()
+_factory = sqlite3.Connection
+_connect_hooks = []
+
+
+class _ThreadConnection:
+    """Holds a thread's connection and closes it when the thread's locals are freed"""
+    __slots__ = ('conn', 'pid', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pid = os.getpid()
+
+    def __del__(self):
+        if os.getpid() == self.pid:  # never close a connection inherited across fork()
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class ConnectionPool:
+    """Per-thread SQLite connections with tuned pragmas"""
+
+    def __init__(self, path=DATABASE, cached_statements=CACHED_STATEMENTS,
+                 factory=sqlite3.Connection, **pragmas):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self.pragmas = dict(PRAGMAS, **pragmas)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._connections = weakref.WeakSet()  # of _ThreadConnection, for close_all
+
+    def connect(self):
+        """Open a new connection with the pool's settings applied"""
+        conn = sqlite3.connect(self.path, cached_statements=self.cached_statements,
+                               check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        setup = getattr(conn, 'pool_setup', None)
+        if setup is not None:
+            setup(self)  # lets an instrumented factory adjust the settings
+        for hook in _connect_hooks:
+            hook(conn)
+        return conn
+
+    def connection(self):
+        """Return the calling thread's connection, opening it if needed"""
+        if os.getpid() != self._pid:
+            # Connections must never be shared across fork(); start over
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset()
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = _ThreadConnection(self.connect())
+            with self._lock:
+                self._connections.add(held)
+        return held.conn
+
+    def release(self):
+        """Roll back anything the current request left uncommitted"""
+        held = getattr(self._local, 'held', None)
+        if held is not None and held.conn.in_transaction:
+            held.conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """Yield the thread's connection; commit on success, roll back on error"""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        with self._lock:
+            for held in list(self._connections):
+                held.conn.close()
+            self._connections = weakref.WeakSet()
+            self._local = threading.local()
+
+
+def set_connection_factory(factory):
+    """Use factory (a sqlite3.Connection subclass) for connections opened from now on"""
+    global _factory
+    with _pools_lock:
+        _factory = factory
+        for pool in _pools.values():
+            pool.factory = factory
+
+
+def add_connect_hook(hook):
+    """Call hook(conn) on every connection opened from now on"""
+    with _pools_lock:
+        if hook not in _connect_hooks:
+            _connect_hooks.append(hook)
+
+
+def get_pool(path=DATABASE):
+    """Return the process-wide pool for a database file"""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path, factory=_factory)
+    return pool
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Server-Sent Events broker for /api/events.
+
+Event stream connections are handed over to the asyncio engine's event
+loop once their response headers are sent, so an idle listener costs one
+small coroutine rather than a thread.  Other threads publish through
+call_soon_threadsafe.  Rating updates are coalesced per song: however many
+votes arrive, each song produces at most one ratings_updated event per
+interval, carrying its latest counts.
+"""
+import asyncio
+import json
+import time
+
+DEFAULT_RATING_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15.0
+RETRY_MS = 3000
+MAX_CLIENT_BUFFER = 256 * 1024  # clients this far behind are dropped
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+class EventBroker:
+    def __init__(self, rating_interval=DEFAULT_RATING_INTERVAL):
+        self.rating_interval = rating_interval
+        self.loop = None
+        self.clients = set()
+        self.sent = 0
+        self.dropped = 0
+        self._pending_ratings = {}   # song -> latest payload not yet sent
+        self._rating_timers = {}     # song -> scheduled flush
+        self._last_rating_sent = {}  # song -> loop time of last event
+
+    def preamble(self, initial_events=()):
+        """Bytes to send right after the headers of a new stream"""
+        out = f'retry: {RETRY_MS}\n\n'.encode()
+        for event, data in initial_events:
+            out += format_event(event, data)
+        return out
+
+    async def hold(self, reader, writer):
+        """Keep one client connection until it goes away (runs on the loop)"""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.create_task(self._heartbeat())
+        self.clients.add(writer)
+        try:
+            while await reader.read(1024):
+                pass  # clients do not send anything; EOF means they left
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+
+    def publish(self, event, data):
+        """Send an event to every client; safe to call from any thread"""
+        if self.loop is None or not self.clients:
+            return
+        payload = format_event(event, data)
+        try:
+            self.loop.call_soon_threadsafe(self._broadcast, payload)
+        except RuntimeError:
+            pass  # loop already closed during shutdown
+
+    def publish_rating(self, song, data):
+        """Queue a ratings_updated event for song, coalesced per interval"""
+        if self.loop is None or not self.clients:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._rating_changed, song, data)
+        except RuntimeError:
+            pass
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'pending_ratings': len(self._pending_ratings),
+        }
+
+    def _rating_changed(self, song, data):
+        self._pending_ratings[song] = data
+        if song in self._rating_timers:
+            return
+        last = self._last_rating_sent.get(song)
+        delay = 0 if last is None else max(0.0, last + self.rating_interval - self.loop.time())
+        self._rating_timers[song] = self.loop.call_later(delay, self._flush_rating, song)
+
+    def _flush_rating(self, song):
+        self._rating_timers.pop(song, None)
+        data = self._pending_ratings.pop(song, None)
+        if data is None:
+            return
+        self._last_rating_sent[song] = self.loop.time()
+        if len(self._last_rating_sent) > 10000:
+            cutoff = self.loop.time() - self.rating_interval
+            self._last_rating_sent = {key: sent for key, sent in self._last_rating_sent.items()
+                                      if sent > cutoff}
+        self._broadcast(format_event('ratings_updated', data))
+
+    def _broadcast(self, payload):
+        for writer in list(self.clients):
+            transport = writer.transport
+            if transport.is_closing() or transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                self.clients.discard(writer)
+                self.dropped += 1
+                transport.abort()
+                continue
+            writer.write(payload)
+            self.sent += 1
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self._broadcast(f': keepalive {int(time.time())}\n\n'.encode())
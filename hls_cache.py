@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Edge cache for the station's HLS stream.
+
+With --hls-origin set, simple_server.py answers /hls/<path> itself:
+playlists and media segments are fetched from the origin once and handed
+to every local listener from memory, or from a shared on-disk cache when
+memory has evicted them (or another worker fetched them).  Concurrent
+misses for the same path wait for a single upstream fetch instead of each
+making their own.
+
+Lifetimes follow the playlist's EXT-X-TARGETDURATION: a media playlist is
+reused for half a target duration, which is how often players reload it,
+and segments, which never change once published, are kept for as long as
+a live playlist lists them.  Playlists are revalidated with conditional
+requests, and absolute URIs pointing back at the origin are rewritten to
+relative ones so players keep coming here.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, namedtuple
+
+DEFAULT_ORIGIN = 'https://d3d4yli4hf5bmh.cloudfront.net/hls'
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'radiocalico-hls')
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_TARGET_DURATION = 6.0  # until a media playlist says otherwise
+MASTER_TTL = 60.0              # playlists without a target duration list variants
+MIN_SEGMENT_WINDOW = 3         # keep segments for at least this many target durations
+SWEEP_INTERVAL = 30.0
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.aac': 'audio/aac',
+    '.m4s': 'audio/mp4',
+    '.mp4': 'audio/mp4',
+    '.m4a': 'audio/mp4',
+    '.flac': 'audio/flac',
+    '.vtt': 'text/vtt',
+    '.key': 'application/octet-stream',
+}
+
+_SAFE_PATH = re.compile(r'^[A-Za-z0-9_\-][A-Za-z0-9_.\-/]*$')
+_TARGET_DURATION = re.compile(r'^#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)', re.M)
+_SEGMENT = re.compile(r'^[^#\s]', re.M)
+
+Entry = namedtuple('Entry', 'body content_type etag fetched_at ttl validators')
+
+
+class UpstreamError(Exception):
+    """The origin could not supply a path; status is the HTTP status to send"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def is_playlist(path):
+    return path.endswith('.m3u8')
+
+
+def valid_path(path):
+    return bool(_SAFE_PATH.match(path)) and '..' not in path.split('/')
+
+
+class _Fetch:
+    """One in-progress upstream fetch that other requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class HlsCache:
+    def __init__(self, origin=DEFAULT_ORIGIN, cache_dir=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_MAX_BYTES, max_disk_bytes=DEFAULT_MAX_DISK_BYTES,
+                 timeout=DEFAULT_TIMEOUT):
+        self.origin = origin.rstrip('/')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        self.target_duration = DEFAULT_TARGET_DURATION
+        self.segment_window = MIN_SEGMENT_WINDOW
+        self._entries = OrderedDict()  # path -> Entry, least recently used first
+        self._bytes = 0
+        self._inflight = {}            # path -> _Fetch
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.revalidated = 0
+        self.upstream_errors = 0
+        self.origin_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def segment_ttl(self):
+        return self.target_duration * max(self.segment_window, MIN_SEGMENT_WINDOW)
+
+    def get(self, path):
+        """Entry for path, fetching it from the origin at most once at a time"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - entry.fetched_at < entry.ttl:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            fetch = self._inflight.get(path)
+            leader = fetch is None
+            if leader:
+                fetch = self._inflight[path] = _Fetch()
+            else:
+                self.collapsed += 1
+        if not leader:
+            fetch.done.wait(self.timeout * 2)
+            if fetch.error is not None:
+                raise fetch.error
+            if fetch.entry is None:
+                raise UpstreamError(504, f'Upstream fetch for {path} did not complete')
+            return fetch.entry
+
+        try:
+            fetch.entry = self._load(path, entry)
+            return fetch.entry
+        except UpstreamError as e:
+            fetch.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[path]
+            fetch.done.set()
+
+    def _load(self, path, stale):
+        """Fill path from disk or the origin (called by one thread per path)"""
+        if not is_playlist(path):
+            entry = self._read_disk(path)
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._store(path, entry)
+                return entry
+        with self._lock:
+            self.misses += 1
+        entry = self._fetch(path, stale)
+        self._store(path, entry)
+        if not is_playlist(path):
+            self._write_disk(path, entry)
+        return entry
+
+    def _fetch(self, path, stale):
+        request = urllib.request.Request(f'{self.origin}/{path}')
+        validators = stale.validators if stale is not None and is_playlist(path) else {}
+        for header, value in validators.items():
+            request.add_header(header, value)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                content_type = response.headers.get('Content-Type')
+                validators = {name: response.headers[header] for name, header in
+                              (('If-None-Match', 'ETag'),
+                               ('If-Modified-Since', 'Last-Modified'))
+                              if response.headers.get(header)}
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and stale is not None:
+                with self._lock:
+                    self.revalidated += 1
+                return stale._replace(fetched_at=time.time(), ttl=self._ttl(path, stale.body))
+            with self._lock:
+                self.upstream_errors += 1
+            raise UpstreamError(404 if e.code == 404 else 502, f'Origin returned {e.code}')
+        except (urllib.error.URLError, OSError) as e:
+            with self._lock:
+                self.upstream_errors += 1
+            raise UpstreamError(502, f'Origin unreachable: {e}')
+        with self._lock:
+            self.origin_bytes += len(body)
+        if is_playlist(path):
+            body = self._rewrite(body)
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1].lower()) or content_type
+        return Entry(body, content_type or 'application/octet-stream',
+                     hashlib.blake2b(body, digest_size=12).hexdigest(),
+                     time.time(), self._ttl(path, body), validators)
+
+    def _ttl(self, path, body):
+        """Seconds an entry stays fresh; media playlists also update the segment TTL"""
+        if not is_playlist(path):
+            return self.segment_ttl()
+        text = body.decode('utf-8', 'replace')
+        match = _TARGET_DURATION.search(text)
+        if match is None:
+            return MASTER_TTL
+        self.target_duration = float(match.group(1))
+        self.segment_window = len(_SEGMENT.findall(text))
+        return self.target_duration / 2
+
+    def _rewrite(self, body):
+        """Make absolute URIs that point at the origin relative to it"""
+        prefix = (self.origin + '/').encode()
+        if prefix not in body:
+            return body
+        return body.replace(b'URI="' + prefix, b'URI="').replace(b'\n' + prefix, b'\n')
+
+    def _store(self, path, entry):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[path] = entry
+            self._bytes += len(entry.body)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+
+    # On-disk segment cache, shared by every worker using the same directory
+
+    def _disk_path(self, path):
+        digest = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.seg')
+
+    def _read_disk(self, path):
+        if not self.cache_dir:
+            return None
+        disk_path = self._disk_path(path)
+        try:
+            stat = os.stat(disk_path)
+            ttl = self.segment_ttl()
+            if time.time() - stat.st_mtime >= ttl:
+                return None
+            with open(disk_path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1].lower(),
+                                         'application/octet-stream')
+        return Entry(body, content_type, hashlib.blake2b(body, digest_size=12).hexdigest(),
+                     stat.st_mtime, ttl, {})
+
+    def _write_disk(self, path, entry):
+        if not self.cache_dir:
+            return
+        disk_path = self._disk_path(path)
+        tmp = f'{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(entry.body)
+            os.replace(tmp, disk_path)
+        except OSError:
+            return  # the disk cache is an optimization; serve from memory regardless
+        if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = time.monotonic()
+            self.sweep_disk()
+
+    def sweep_disk(self):
+        """Delete expired segment files, then the oldest ones beyond max_disk_bytes"""
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as scan:
+                for item in scan:
+                    if item.name.endswith('.seg'):
+                        stat = item.stat()
+                        files.append((stat.st_mtime, stat.st_size, item.path))
+        except OSError:
+            return
+        files.sort()
+        cutoff = time.time() - self.segment_ttl()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, file_path in files:
+            if mtime >= cutoff and total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    def disk_usage(self):
+        if not self.cache_dir:
+            return 0
+        try:
+            with os.scandir(self.cache_dir) as scan:
+                return sum(item.stat().st_size for item in scan if item.name.endswith('.seg'))
+        except OSError:
+            return 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.disk_hits + self.misses + self.collapsed
+            stats = {
+                'origin': self.origin,
+                'entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'collapsed': self.collapsed,
+                'revalidated': self.revalidated,
+                'upstream_errors': self.upstream_errors,
+                'origin_bytes': self.origin_bytes,
+                'hit_rate': round(1 - self.misses / requests, 4) if requests else None,
+                'target_duration': self.target_duration,
+                'segment_ttl': self.segment_ttl(),
+            }
+        stats['disk_bytes'] = self.disk_usage()
+        return stats
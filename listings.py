@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""User and post list queries shared by simple_server.py and app.py.
+
+Lists are paginated by keyset: rows are ordered by (created_at, id)
+descending and the next page starts strictly after the last row returned,
+so every page is an index range scan no matter how deep the client pages.
+The position is handed to clients as an opaque cursor string.  Old
+clients can still ask for the whole list with ?all=1.
+
+?fields=title,created_at selects only the named columns (the cursor's
+columns are still read, then dropped), and posts are only joined to users
+when an author field is asked for.
+"""
+import base64
+import json
+from urllib.parse import parse_qs
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+# Field name -> column, in response order
+USER_FIELDS = {
+    'id': 'u.id',
+    'email': 'u.email',
+    'name': 'u.name',
+    'created_at': 'u.created_at',
+}
+
+POST_FIELDS = {
+    'id': 'p.id',
+    'title': 'p.title',
+    'content': 'p.content',
+    'published': 'p.published',
+    'created_at': 'p.created_at',
+    'author_name': 'u.name',
+    'author_email': 'u.email',
+}
+
+PUBLISHED_POST_FIELDS = {name: column for name, column in POST_FIELDS.items()
+                         if name != 'published'}
+
+AUTHOR_FIELDS = ('author_name', 'author_email')
+KEY_FIELDS = ('created_at', 'id')  # needed to build the next cursor
+
+
+class Page:
+    """Requested page: a row limit and the position to continue after"""
+
+    def __init__(self, limit=DEFAULT_LIMIT, after=None, unpaginated=False):
+        self.limit = limit
+        self.after = after  # (created_at, id) of the previous page's last row
+        self.unpaginated = unpaginated
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(row_id, int) or not isinstance(created_at, (str, type(None))):
+        raise ValueError('Invalid cursor')
+    return created_at, row_id
+
+
+def parse_page(params):
+    """Build a Page from query parameters (any mapping with .get)"""
+    if params.get('all', '').lower() in TRUE_VALUES:
+        return Page(unpaginated=True)
+    limit = params.get('limit')
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        limit = min(limit, MAX_LIMIT)
+    else:
+        limit = DEFAULT_LIMIT
+    after = params.get('after')
+    return Page(limit=limit, after=decode_cursor(after) if after else None)
+
+
+def parse_fields(params, available):
+    """Field names requested with ?fields=a,b (in response order), or None for all"""
+    value = params.get('fields')
+    if not value:
+        return None
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = sorted(names - set(available))
+    if unknown or not names:
+        raise ValueError('fields must be a comma-separated list of: ' + ', '.join(available))
+    return tuple(name for name in available if name in names)
+
+
+def query_params(query_string):
+    """First value of each parameter in a raw query string"""
+    return {name: values[0] for name, values in parse_qs(query_string).items()}
+
+
+def _select(select, where, params, alias, page):
+    """Add keyset filtering and ordering to a select; return (sql, params)"""
+    clauses = list(where)
+    params = list(params)
+    if page.after is not None and not page.unpaginated:
+        clauses.append(f'({alias}.created_at, {alias}.id) < (?, ?)')
+        params.extend(page.after)
+    sql = select
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += f' ORDER BY {alias}.created_at DESC, {alias}.id DESC'
+    return sql, params
+
+
+def _paginate(conn, select, where, params, alias, page, hidden=()):
+    """Run select with keyset pagination; return (rows, next_cursor)"""
+    sql, params = _select(select, where, params, alias, page)
+    if page.unpaginated:
+        return [dict(row) for row in conn.execute(sql, params)], None
+    sql += ' LIMIT ?'
+    params.append(page.limit + 1)
+    rows = [dict(row) for row in conn.execute(sql, params)]
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    for name in hidden:
+        for row in rows:
+            del row[name]
+    return rows, next_cursor
+
+
+def _projection(available, fields, paginated):
+    """(select list, hidden field names) for the requested fields"""
+    names = list(fields or available)
+    hidden = [name for name in KEY_FIELDS if paginated and name not in names]
+    return ', '.join(f'{available[name]} AS {name}' for name in names + hidden), hidden
+
+
+def _users_select(fields, paginated):
+    columns, hidden = _projection(USER_FIELDS, fields, paginated)
+    return f'SELECT {columns} FROM users u', hidden
+
+
+def _posts_select(published_only, fields, paginated):
+    available = PUBLISHED_POST_FIELDS if published_only else POST_FIELDS
+    columns, hidden = _projection(available, fields, paginated)
+    select = f'SELECT {columns} FROM posts p'
+    if fields is None or any(name in AUTHOR_FIELDS for name in fields):
+        select += ' LEFT JOIN users u ON p.author_id = u.id'
+    where = ['p.published = 1'] if published_only else []
+    return select, where, hidden
+
+
+def list_users(conn, page, fields=None):
+    select, hidden = _users_select(fields, not page.unpaginated)
+    return _paginate(conn, select, [], [], 'u', page, hidden)
+
+
+def list_posts(conn, page, published_only=False, fields=None):
+    select, where, hidden = _posts_select(published_only, fields, not page.unpaginated)
+    return _paginate(conn, select, where, [], 'p', page, hidden)
+
+
+def stream_users(conn, fields=None):
+    """Cursor over every user, newest first, for streaming exports"""
+    select, _ = _users_select(fields, False)
+    sql, params = _select(select, [], [], 'u', Page(unpaginated=True))
+    return conn.execute(sql, params)
+
+
+def stream_posts(conn, published_only=False, fields=None):
+    """Cursor over every post, newest first, for streaming exports"""
+    select, where, _ = _posts_select(published_only, fields, False)
+    sql, params = _select(select, where, [], 'p', Page(unpaginated=True))
+    return conn.execute(sql, params)
+
+
+def get_post(conn, post_id, fields=None):
+    """One post as a dict, or None"""
+    select, _, _ = _posts_select(False, fields, False)
+    row = conn.execute(select + ' WHERE p.id = ?', (post_id,)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def list_response(key, rows, next_cursor, page):
+    """JSON body for a list endpoint; unpaginated responses keep the old shape"""
+    body = {key: rows}
+    if not page.unpaginated:
+        body['next_cursor'] = next_cursor
+    return body
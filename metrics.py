@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Request and SQLite instrumentation shared by simple_server.py and app.py.
+
+Collects, per process:
+
+  http_requests_total               requests by route, method and status
+  http_request_duration_seconds     latency histogram by route and method
+  http_response_size_bytes          response size histogram by route
+  http_requests_in_flight           requests currently being handled
+  http_requests_queued              requests waiting for admission
+  http_requests_shed_total          requests answered 503 under load, by reason
+  sqlite_statement_duration_seconds execution time by statement kind and table
+  sqlite_busy_retries_total         statements retried while the database was locked
+  sqlite_lock_wait_seconds          time spent waiting for locks before running
+  sqlite_busy_errors_total          statements that gave up waiting
+  rating_votes_rejected_total       votes turned away by the rate limiter, by reason
+
+and renders them in the Prometheus text format for /metrics.
+
+Counters are always exact.  Histograms can be sampled with
+configure(sample_rate=...) so the hot paths only pay for timing a
+fraction of observations; their _count then reflects the sampled ones.
+"""
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from random import random
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+               0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUSY_SLICE_MS = 50  # SQLite waits this long per attempt; the rest is retried here
+
+
+class Metric:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _label_text(self, values, extra=''):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [f'{self.name}{self._label_text(labels)} {value}'
+                    for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            entry[index] += 1
+            entry[-1] += value
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            items = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        for labels, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{self._label_text(labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._label_text(labels)} {entry[-1]:.6f}')
+            lines.append(f'{self.name}_count{self._label_text(labels)} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+requests_total = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests handled', ('route', 'method', 'status')))
+request_duration = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time to handle a request', ('route', 'method')))
+response_size = REGISTRY.register(Histogram(
+    'http_response_size_bytes', 'Response body size', ('route',), SIZE_BUCKETS))
+in_flight = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'Requests currently being handled'))
+requests_queued = REGISTRY.register(Gauge(
+    'http_requests_queued', 'Requests waiting for admission'))
+requests_shed = REGISTRY.register(Counter(
+    'http_requests_shed_total', 'Requests turned away with 503 while overloaded', ('reason',)))
+statement_duration = REGISTRY.register(Histogram(
+    'sqlite_statement_duration_seconds', 'SQLite statement execution time',
+    ('statement',), SQL_BUCKETS))
+busy_retries = REGISTRY.register(Counter(
+    'sqlite_busy_retries_total', 'Statement attempts that found the database locked',
+    ('statement',)))
+lock_wait = REGISTRY.register(Histogram(
+    'sqlite_lock_wait_seconds', 'Time statements waited for a lock before running',
+    ('statement',), LATENCY_BUCKETS))
+busy_errors = REGISTRY.register(Counter(
+    'sqlite_busy_errors_total', 'Statements that gave up waiting for a lock',
+    ('statement',)))
+votes_rejected = REGISTRY.register(Counter(
+    'rating_votes_rejected_total', 'Votes rejected by the rate limiter or deduplicated',
+    ('reason',)))
+
+_sample_rate = 1.0
+
+
+def configure(sample_rate=1.0):
+    """Time this fraction of requests and statements (0 turns timing off)"""
+    global _sample_rate
+    _sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+
+def sampled():
+    """True when this observation should be timed"""
+    return _sample_rate >= 1.0 or (_sample_rate > 0.0 and random() < _sample_rate)
+
+
+class RequestTimer:
+    """Times one request; start() once it is parsed, finish() when it is done"""
+    __slots__ = ('started',)
+
+    def __init__(self):
+        self.started = None
+
+    def start(self):
+        in_flight.inc()
+        self.started = time.perf_counter() if sampled() else 0.0
+
+    def finish(self, route, method, status, size=None):
+        in_flight.dec()
+        requests_total.inc(route, method, str(status))
+        if self.started:
+            request_duration.observe(time.perf_counter() - self.started, route, method)
+            if size is not None:
+                response_size.observe(size, route)
+        self.started = None
+
+
+# SQLite
+
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|INDEX\s+\w+\s+ON)\s+([A-Za-z_]\w*)', re.I)
+_CTE = re.compile(r'(?:\bWITH|,)\s*([A-Za-z_]\w*)\s*(?:\([^)]*\))?\s+AS\s*\(', re.I)
+_names = {}
+
+
+def statement_name(sql):
+    """Low-cardinality label for a statement, e.g. 'SELECT song_rating_totals'"""
+    name = _names.get(sql)
+    if name is None:
+        words = sql.split(None, 1)
+        verb = words[0].upper() if words else ''
+        ctes = {cte.lower() for cte in _CTE.findall(sql)}
+        if verb == 'WITH':
+            main = re.search(r'\)\s*(SELECT|INSERT|UPDATE|DELETE)\b', sql, re.I)
+            verb = main.group(1).upper() if main else verb
+        table = next((match for match in _TABLE.findall(sql) if match.lower() not in ctes), '')
+        name = f'{verb} {table}'.strip()
+        if len(_names) > 2000:
+            _names.clear()  # batch queries vary in length; keep the memo bounded
+        _names[sql] = name
+    return name
+
+
+def _is_busy(error):
+    """True for lock errors that are worth retrying"""
+    code = getattr(error, 'sqlite_errorcode', None) or 0
+    if code == sqlite3.SQLITE_BUSY_SNAPSHOT:
+        return False  # the transaction's snapshot is stale; only a rollback helps
+    return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def _timed(run, sql, budget, can_retry=None):
+    """Run a statement, retrying while the database is locked, and time it.
+
+    can_retry() is asked before each retry; it returns False once a failed
+    attempt has already applied part of its work.
+    """
+    name = None
+    waited_from = None
+    while True:
+        timed = sampled()
+        started = time.perf_counter() if timed or waited_from is not None else 0.0
+        try:
+            result = run()
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            name = name or statement_name(sql)
+            if waited_from is None:
+                # SQLite already waited one slice before reporting the lock
+                waited_from = started or time.perf_counter() - BUSY_SLICE_MS / 1000
+            if time.perf_counter() - waited_from >= budget or \
+                    (can_retry is not None and not can_retry()):
+                busy_errors.inc(name)
+                raise
+            busy_retries.inc(name)
+            continue
+        if timed:
+            name = name or statement_name(sql)
+            statement_duration.observe(time.perf_counter() - started, name)
+        if waited_from is not None:
+            lock_wait.observe(started - waited_from, name)
+        return result
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed(lambda: super(InstrumentedCursor, self).execute(sql, parameters),
+                      sql, self.connection.busy_budget)
+
+    def executemany(self, sql, seq_of_parameters):
+        # A retry must see every row again, and only if no row was applied yet
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        changes = self.connection.total_changes
+        return _timed(lambda: super(InstrumentedCursor, self).executemany(sql, seq_of_parameters),
+                      sql, self.connection.busy_budget,
+                      lambda: self.connection.total_changes == changes)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times statements and counts lock retries.
+
+    SQLite itself only waits BUSY_SLICE_MS for a lock; the remainder of the
+    pool's busy_timeout is spent in retries here, so each one is counted.
+    """
+    busy_budget = 5.0
+
+    def pool_setup(self, pool):
+        self.busy_budget = int(pool.pragmas.get('busy_timeout', 5000)) / 1000
+        super().execute(f'PRAGMA busy_timeout = {BUSY_SLICE_MS}')
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        if self.in_transaction:
+            _timed(super().commit, 'COMMIT', self.busy_budget)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Online migration of song_ratings to the normalized songs/listeners/song_votes layout.
+
+Safe to run against a live database.db:
+
+  1. creates the normalized tables and installs triggers on song_ratings so
+     every vote the running servers write is mirrored into song_votes
+  2. copies existing rows over in small chunks, each in its own short
+     transaction, remembering its position in schema_meta so an interrupted
+     run resumes where it stopped
+  3. checks the row counts match and records ratings_storage = normalized
+
+Servers keep using song_ratings (mirrored by the triggers) until they are
+restarted, after which they read and write the normalized tables.  Once
+every server has been restarted, run with --finalize to drop the mirroring
+triggers.
+
+Usage:
+  python3 migrate_songs.py [--database database.db] [--chunk 5000] [--pause 0.05]
+  python3 migrate_songs.py --finalize [--drop-legacy]
+"""
+import argparse
+import sqlite3
+import sys
+import time
+
+import ratings
+
+MIRROR_VOTE = '''
+    INSERT INTO songs (title, artist, album)
+    VALUES (new.song_title, new.song_artist, new.song_album)
+    ON CONFLICT DO NOTHING;
+    INSERT INTO listeners (identifier) VALUES (new.user_identifier)
+    ON CONFLICT DO NOTHING;
+    INSERT INTO song_votes (song_id, listener_id, rating, created_at)
+    SELECT s.id, l.id, new.rating, new.created_at
+    FROM songs s, listeners l
+    WHERE s.title = new.song_title AND s.artist = new.song_artist
+      AND l.identifier = new.user_identifier
+    ON CONFLICT (song_id, listener_id) DO UPDATE
+    SET rating = excluded.rating, created_at = excluded.created_at;
+'''
+
+TRIGGERS = {
+    'song_ratings_mirror_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS song_ratings_mirror_insert
+        AFTER INSERT ON song_ratings
+        BEGIN {MIRROR_VOTE} END''',
+    'song_ratings_mirror_update': f'''
+        CREATE TRIGGER IF NOT EXISTS song_ratings_mirror_update
+        AFTER UPDATE ON song_ratings
+        BEGIN {MIRROR_VOTE} END''',
+    'song_ratings_mirror_delete': '''
+        CREATE TRIGGER IF NOT EXISTS song_ratings_mirror_delete
+        AFTER DELETE ON song_ratings
+        BEGIN
+            DELETE FROM song_votes
+            WHERE song_id = (SELECT id FROM songs
+                             WHERE title = old.song_title AND artist = old.song_artist)
+              AND listener_id = (SELECT id FROM listeners
+                                 WHERE identifier = old.user_identifier);
+        END''',
+}
+
+PROGRESS_KEY = 'songs_migration_last_id'
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)  # explicit transactions
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA busy_timeout = 10000')
+    return conn
+
+
+def prepare(conn):
+    """Create the normalized tables and the mirroring triggers"""
+    conn.execute('BEGIN IMMEDIATE')
+    ratings.create_normalized_schema(conn)
+    for statement in TRIGGERS.values():
+        conn.execute(statement)
+    conn.execute('COMMIT')
+
+
+def copy_chunk(conn, low, high):
+    """Copy song_ratings rows with low < id <= high; newer mirrored votes win"""
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('''
+        INSERT INTO songs (title, artist, album)
+        SELECT song_title, song_artist, MAX(song_album) FROM song_ratings
+        WHERE id > ? AND id <= ?
+        GROUP BY song_title, song_artist
+        ON CONFLICT DO NOTHING''', (low, high))
+    conn.execute('''
+        INSERT INTO listeners (identifier)
+        SELECT DISTINCT user_identifier FROM song_ratings
+        WHERE id > ? AND id <= ?
+        ON CONFLICT DO NOTHING''', (low, high))
+    copied = conn.execute('''
+        INSERT INTO song_votes (song_id, listener_id, rating, created_at)
+        SELECT s.id, l.id, r.rating, r.created_at
+        FROM song_ratings r
+        JOIN songs s ON s.title = r.song_title AND s.artist = r.song_artist
+        JOIN listeners l ON l.identifier = r.user_identifier
+        WHERE r.id > ? AND r.id <= ?
+        ON CONFLICT DO NOTHING''', (low, high)).rowcount
+    ratings.set_meta(conn, PROGRESS_KEY, high)
+    conn.execute('COMMIT')
+    return copied
+
+
+def migrate(conn, chunk, pause):
+    if ratings.detect_storage(conn) == ratings.NORMALIZED:
+        print("Ratings already use normalized storage.")
+        return True
+    prepare(conn)
+    # Rows above max_id were written after the triggers existed
+    max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM song_ratings').fetchone()[0]
+    last_id = int(ratings.get_meta(conn, PROGRESS_KEY, 0))
+    if last_id:
+        print(f"Resuming after song_ratings id {last_id}")
+    started = time.monotonic()
+    copied = 0
+    while last_id < max_id:
+        high = min(last_id + chunk, max_id)
+        copied += copy_chunk(conn, last_id, high)
+        last_id = high
+        rate = copied / max(time.monotonic() - started, 1e-6)
+        print(f"  copied through id {last_id}/{max_id} ({copied} votes, {rate:.0f}/s)")
+        if pause:
+            time.sleep(pause)
+
+    conn.execute('BEGIN IMMEDIATE')
+    legacy_rows = conn.execute('SELECT COUNT(*) FROM song_ratings').fetchone()[0]
+    normalized_rows = conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0]
+    if legacy_rows != normalized_rows:
+        conn.execute('ROLLBACK')
+        print(f"Row counts differ: song_ratings={legacy_rows}, song_votes={normalized_rows}. "
+              "Storage not switched; re-run to retry.")
+        return False
+    ratings.set_meta(conn, 'ratings_storage', ratings.NORMALIZED)
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    print(f"Migrated {normalized_rows} votes. Restart the servers to use normalized storage, "
+          "then run with --finalize.")
+    return True
+
+
+def finalize(conn, drop_legacy):
+    if ratings.detect_storage(conn) != ratings.NORMALIZED:
+        print("Migration has not completed; nothing to finalize.")
+        return False
+    conn.execute('BEGIN IMMEDIATE')
+    for name in TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    if drop_legacy:
+        conn.execute('DROP TABLE IF EXISTS song_ratings')
+    conn.execute('COMMIT')
+    print("Mirroring triggers dropped." + (" Legacy song_ratings table dropped." if drop_legacy else ""))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize song rating storage')
+    parser.add_argument('--database', default='database.db')
+    parser.add_argument('--chunk', type=int, default=5000, help='Rows copied per transaction')
+    parser.add_argument('--pause', type=float, default=0.05,
+                        help='Seconds to sleep between chunks so servers can write')
+    parser.add_argument('--finalize', action='store_true',
+                        help='Drop the mirroring triggers after all servers restarted')
+    parser.add_argument('--drop-legacy', action='store_true',
+                        help='With --finalize, also drop the song_ratings table')
+    args = parser.parse_args()
+
+    conn = connect(args.database)
+    try:
+        if args.finalize:
+            ok = finalize(conn, args.drop_legacy)
+        else:
+            ok = migrate(conn, args.chunk, args.pause)
+    finally:
+        conn.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Server-side poller for the station's now-playing metadata.
+
+One background thread fetches metadatav2.json every few seconds with
+conditional requests (If-None-Match / If-Modified-Since), keeps the latest
+document in memory and notifies listeners when the track changes.  Every
+open player tab then reads /api/now-playing from us instead of polling
+the upstream itself.
+"""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_METADATA_URL = 'https://d3d4yli4hf5bmh.cloudfront.net/metadatav2.json'
+DEFAULT_INTERVAL = 10.0
+DEFAULT_TIMEOUT = 5.0
+
+
+class NowPlayingPoller:
+    def __init__(self, url=DEFAULT_METADATA_URL, interval=DEFAULT_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.metadata = None      # latest upstream document
+        self.track = None         # (title, artist) of the current track
+        self.updated_at = None    # when the document last changed
+        self.changed_at = None    # when the track last changed
+        self.last_error = None
+        self.fetches = 0
+        self.not_modified = 0
+        self.errors = 0
+        self._etag = None
+        self._last_modified = None
+        self._listeners = []
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """Call callback(old_track, new_track, metadata) on every track change"""
+        self._listeners.append(callback)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='now-playing',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'fetches': self.fetches,
+            'not_modified': self.not_modified,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.poll()
+            self._stopping.wait(self.interval)
+
+    def poll(self):
+        """Fetch the metadata once; returns True if the document changed"""
+        request = urllib.request.Request(self.url, headers={'Accept': 'application/json'})
+        if self._etag:
+            request.add_header('If-None-Match', self._etag)
+        if self._last_modified:
+            request.add_header('If-Modified-Since', self._last_modified)
+        self.fetches += 1
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                metadata = json.loads(response.read().decode('utf-8'))
+                self._etag = response.headers.get('ETag')
+                self._last_modified = response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                self.not_modified += 1
+                return False
+            self._record_error(e)
+            return False
+        except (OSError, ValueError) as e:
+            self._record_error(e)
+            return False
+        self.last_error = None
+        self._update(metadata)
+        return True
+
+    def _record_error(self, error):
+        self.errors += 1
+        if str(error) != self.last_error:
+            print(f"Now playing: fetching {self.url} failed: {error}")
+        self.last_error = str(error)
+
+    def _update(self, metadata):
+        track = (metadata.get('title') or '', metadata.get('artist') or '')
+        old_track = self.track
+        now = time.time()
+        self.metadata = metadata
+        self.updated_at = now
+        if track != old_track:
+            self.track = track
+            self.changed_at = now
+            for callback in self._listeners:
+                try:
+                    callback(old_track, track, metadata)
+                except Exception as e:
+                    print(f"Now playing: track change listener failed: {e}")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Prefork supervisor for simple_server.py.
+
+The supervisor forks N worker processes.  Each worker binds its own
+listening socket on the same port with SO_REUSEPORT, so the kernel spreads
+incoming connections across them and every worker gets its own GIL.
+Workers that die are restarted; SIGTERM/SIGINT on the supervisor is
+forwarded to the workers, which finish their in-flight requests and exit.
+"""
+import os
+import signal
+import sys
+import time
+import traceback
+
+POLL_INTERVAL = 0.2
+SHUTDOWN_GRACE = 10.0   # seconds before stragglers are killed
+RESTART_BACKOFF = 1.0   # delay before restarting a worker that died young
+MIN_UPTIME = 2.0
+
+
+def run(workers, serve):
+    """Fork `workers` children that each call serve() and supervise them.
+
+    serve() is expected to install its own SIGTERM handler and return once
+    its server has shut down.
+    """
+    supervisor = Supervisor(workers, serve)
+    supervisor.run()
+
+
+class Supervisor:
+    def __init__(self, workers, serve):
+        self.workers = workers
+        self.serve = serve
+        self.children = {}  # pid -> (slot, start time)
+        self.stopping = False
+        self.stop_deadline = None
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+
+        while self.children:
+            self.reap()
+            if self.stopping and time.monotonic() > self.stop_deadline:
+                for pid in self.children:
+                    self.kill(pid, signal.SIGKILL)
+                self.stop_deadline = float('inf')
+            time.sleep(POLL_INTERVAL)
+        print("All workers stopped.")
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                self.serve()
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = (slot, time.monotonic())
+        print(f"Worker {slot} started (pid {pid})")
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            slot, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            print(f"Worker {slot} (pid {pid}) exited with status "
+                  f"{os.waitstatus_to_exitcode(status)}, restarting")
+            if time.monotonic() - started < MIN_UPTIME:
+                time.sleep(RESTART_BACKOFF)
+            self.spawn(slot)
+
+    def handle_stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.stop_deadline = time.monotonic() + SHUTDOWN_GRACE
+        print("\nStopping workers...")
+        for pid in list(self.children):
+            self.kill(pid, signal.SIGTERM)
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
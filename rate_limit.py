@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""In-memory flood control for rating writes.
+
+Each vote is checked against two token buckets, one for the client IP and
+one for the listener identifier, and against a short memory of recent
+votes so an identical repeat (same listener, song and rating) is answered
+without touching SQLite.  Buckets refill continuously at `rate` tokens per
+second up to `burst`; a request that finds its bucket empty is rejected
+along with the number of seconds until a token is available.
+
+Both the buckets and the recent-vote memory are bounded, evicting the
+least recently used keys first.  An evicted key simply starts again with a
+full bucket, so the bound trades a little precision for fixed memory.
+Limits apply per process.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_IP_RATE = 20.0
+DEFAULT_IP_BURST = 100
+DEFAULT_LISTENER_RATE = 1.0
+DEFAULT_LISTENER_BURST = 10
+DEFAULT_DEDUP_WINDOW = 10.0
+DEFAULT_MAX_KEYS = 100000
+
+
+class TokenBuckets:
+    """Token buckets keyed by an arbitrary string, LRU bounded"""
+
+    def __init__(self, rate, burst, max_keys=DEFAULT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Spend a token for key; return 0 on success or seconds to wait"""
+        if not self.rate:
+            return 0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    def __init__(self, ip_rate=DEFAULT_IP_RATE, ip_burst=DEFAULT_IP_BURST,
+                 listener_rate=DEFAULT_LISTENER_RATE, listener_burst=DEFAULT_LISTENER_BURST,
+                 dedup_window=DEFAULT_DEDUP_WINDOW, max_keys=DEFAULT_MAX_KEYS):
+        self.ips = TokenBuckets(ip_rate, ip_burst, max_keys)
+        self.listeners = TokenBuckets(listener_rate, listener_burst, max_keys)
+        self.dedup_window = dedup_window
+        self.max_keys = max_keys
+        self._recent = OrderedDict()  # (identifier, title, artist) -> (rating, voted_at)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = {'ip': 0, 'listener': 0, 'duplicate': 0}
+
+    def check(self, ip, identifier):
+        """Return (reason, retry_after) for a rejected vote, or (None, 0)"""
+        now = time.monotonic()
+        for reason, buckets, key in (('ip', self.ips, ip), ('listener', self.listeners, identifier)):
+            wait = buckets.take(key, now)
+            if wait:
+                with self._lock:
+                    self.rejected[reason] += 1
+                return reason, wait
+        with self._lock:
+            self.allowed += 1
+        return None, 0
+
+    def is_duplicate(self, identifier, title, artist, rating):
+        """True if this listener cast the same vote within the dedup window"""
+        if not self.dedup_window:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            recent = self._recent.get((identifier, title, artist))
+            if recent is not None and recent[0] == rating:
+                self.rejected['duplicate'] += 1
+                return True
+            return False
+
+    def remember(self, identifier, title, artist, rating):
+        """Record a vote that was stored, for is_duplicate()"""
+        if not self.dedup_window:
+            return
+        key = (identifier, title, artist)
+        with self._lock:
+            self._recent.pop(key, None)  # re-insert so the oldest votes stay at the front
+            self._recent[key] = (rating, time.monotonic())
+            if len(self._recent) > self.max_keys:
+                self._recent.popitem(last=False)
+
+    def _expire(self, now):
+        while self._recent:
+            key, (rating, voted_at) = next(iter(self._recent.items()))
+            if now - voted_at <= self.dedup_window:
+                break
+            del self._recent[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'rejected': dict(self.rejected),
+                'tracked_ips': len(self.ips),
+                'tracked_listeners': len(self.listeners),
+                'recent_votes': len(self._recent),
+            }
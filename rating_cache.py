@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Process-wide cache of per-song thumbs up/down tallies.
+
+Entries are keyed by (song_title, song_artist), filled lazily from the
+database on a miss and updated in place whenever this process writes a
+rating, so repeated /api/ratings/song lookups never reach SQLite.  Writers
+call begin_write() before their vote commits and apply() (or end_write()
+if it failed) afterwards; fills are not stored while a write to the same
+stripe is in progress, since they may or may not include the vote.  The
+cache is bounded both by entry count and by an estimate of its memory use,
+evicting least recently used songs first.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+ENTRY_OVERHEAD = 240  # tuple, list, OrderedDict link and ints per entry
+STRIPES = 64
+
+
+def entry_size(key):
+    return ENTRY_OVERHEAD + sys.getsizeof(key[0]) + sys.getsizeof(key[1])
+
+
+class RatingCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # seconds; only needed when other processes also write
+        self._entries = OrderedDict()  # key -> [thumbs_up, thumbs_down, loaded_at]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped on every write so a fill that raced with a vote is discarded
+        self._versions = [0] * STRIPES
+        self._writing = [0] * STRIPES  # writes begun but not yet applied
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (thumbs_up, thumbs_down) or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def get_or_load(self, key, load):
+        """Return the tally for key, calling load() -> (up, down) on a miss"""
+        tally = self.get(key)
+        if tally is not None:
+            return tally
+        version = self._version(key)
+        tally = load()
+        with self._lock:
+            if self._fill_allowed(key, version):
+                self._store(key, tally)
+        return tally
+
+    def get_many_or_load(self, keys, load_many):
+        """Return {key: tally}, calling load_many(missing keys) -> dict once"""
+        found = {}
+        missing = []
+        for key in keys:
+            tally = self.get(key)
+            if tally is None:
+                missing.append(key)
+            else:
+                found[key] = tally
+        if missing:
+            versions = {key: self._version(key) for key in missing}
+            loaded = load_many(missing)
+            with self._lock:
+                for key, tally in loaded.items():
+                    if self._fill_allowed(key, versions.get(key)):
+                        self._store(key, tally)
+            found.update(loaded)
+        return found
+
+    def begin_write(self, key):
+        """Call before a vote for key commits; end it with apply() or end_write()"""
+        with self._lock:
+            stripe = hash(key) % STRIPES
+            self._versions[stripe] += 1
+            self._writing[stripe] += 1
+
+    def end_write(self, key):
+        """End a write that did not change the database (e.g. it failed)"""
+        with self._lock:
+            self._finish(key)
+
+    def apply(self, key, old_rating, new_rating):
+        """Adjust a cached tally after a vote (old_rating is None for new votes)"""
+        with self._lock:
+            self._finish(key)
+            entry = self._entries.get(key)
+            if entry is None or old_rating == new_rating:
+                return
+            if old_rating == 1:
+                entry[0] -= 1
+            elif old_rating == -1:
+                entry[1] -= 1
+            if new_rating == 1:
+                entry[0] += 1
+            elif new_rating == -1:
+                entry[1] += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _version(self, key):
+        return self._versions[hash(key) % STRIPES]
+
+    def _fill_allowed(self, key, version):
+        stripe = hash(key) % STRIPES
+        return self._versions[stripe] == version and not self._writing[stripe]
+
+    def _finish(self, key):
+        stripe = hash(key) % STRIPES
+        self._versions[stripe] += 1
+        if self._writing[stripe]:
+            self._writing[stripe] -= 1
+
+    def _store(self, key, tally):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = [tally[0], tally[1], time.monotonic()]
+        self._bytes += entry_size(key)
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= entry_size(key)
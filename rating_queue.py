@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Write-behind batching for rating submissions.
+
+Votes are queued in memory and a single writer thread commits them in
+groups: one transaction every flush_interval seconds or flush_rows votes,
+whichever comes first.  A vote storm after a track change then costs a
+handful of commits instead of one fsync per listener.
+
+Durability levels:
+
+  async - the request is answered 202 as soon as the vote is queued; votes
+          still queued when the process dies are lost
+  group - the request waits until its batch has committed (group commit)
+  full  - like group, and the writer runs with synchronous=FULL
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import ratings
+
+DURABILITY_LEVELS = ('async', 'group', 'full')
+
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_FLUSH_ROWS = 500
+DEFAULT_MAX_PENDING = 50000
+DEFAULT_RESULT_TIMEOUT = 10.0  # longest a group/full request waits for its commit
+
+
+class QueueClosed(RuntimeError):
+    """The queue is shutting down; the vote should be written directly"""
+
+
+class RatingWriteQueue:
+    def __init__(self, pool, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_rows=DEFAULT_FLUSH_ROWS, max_pending=DEFAULT_MAX_PENDING,
+                 durability='async', result_timeout=DEFAULT_RESULT_TIMEOUT,
+                 on_begin=None, on_commit=None, on_abort=None):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.durability = durability
+        self.result_timeout = result_timeout
+        self.on_begin = on_begin    # called with votes before their transaction
+        self.on_commit = on_commit  # called with (votes, previous ratings)
+        self.on_abort = on_abort    # called with votes whose transaction failed
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopping = threading.Event()
+        self._submit_lock = threading.Lock()  # no vote is queued once closing starts
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='rating-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, vote):
+        """Queue a (title, artist, album, user_id, rating) vote.
+
+        Returns a Future resolving to the previous rating once the vote is
+        committed.  Raises queue.Full if the backlog is at its limit and
+        QueueClosed once close() has been called.
+        """
+        future = Future()
+        with self._submit_lock:
+            if self._stopping.is_set():
+                raise QueueClosed('rating queue is shut down')
+            self._queue.put_nowait((vote, future))
+        with self._stats_lock:
+            self.submitted += 1
+        return future
+
+    @property
+    def waits_for_commit(self):
+        return self.durability != 'async'
+
+    def close(self, timeout=10.0):
+        """Stop accepting votes and flush everything still queued.
+
+        Votes the writer has not reached within timeout are failed with
+        QueueClosed, so no request waits on them forever.
+        """
+        with self._submit_lock:
+            self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not leftover:
+            return
+        with self._stats_lock:
+            self.failed += len(leftover)
+        error = QueueClosed(f'rating queue closed with {len(leftover)} votes unwritten')
+        for vote, future in leftover:
+            future.set_exception(error)
+        if not self.waits_for_commit:
+            print(f"Rating writer: dropped {len(leftover)} votes at shutdown")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'submitted': self.submitted,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'failed': self.failed,
+                'last_flush_ms': round(self.last_flush_ms, 3),
+                'max_flush_ms': round(self.max_flush_ms, 3),
+                'avg_flush_ms': round(self.total_flush_ms / self.batches, 3)
+                                if self.batches else 0.0,
+            }
+
+    def _run(self):
+        conn = self.pool.connection()
+        if self.durability == 'full':
+            conn.execute('PRAGMA synchronous = FULL')
+        while True:
+            batch = self._collect()
+            if batch:
+                try:
+                    self._flush(conn, batch)
+                except Exception as e:  # keep draining the queue whatever happens
+                    print(f"Rating writer: flush failed: {e}")
+            elif self._stopping.is_set():
+                break
+
+    def _collect(self):
+        """Wait for the first vote, then gather more until the batch is due"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _callback(self, callback, *args):
+        """Run an on_* hook; its errors are logged, never fatal to the writer"""
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Rating writer: {callback.__name__} failed: {e}")
+
+    def _flush(self, conn, batch):
+        votes = [vote for vote, future in batch]
+        started = time.perf_counter()
+        self._callback(self.on_begin, votes)
+        try:
+            with conn:
+                previous = ratings.upsert_ratings(conn, votes)
+        except Exception as e:
+            with self._stats_lock:
+                self.failed += len(batch)
+            for vote, future in batch:
+                future.set_exception(e)
+            if not self.waits_for_commit:
+                # These votes were already answered 202; record what was lost
+                print(f"Rating writer: dropped {len(votes)} votes: {e}")
+            self._callback(self.on_abort, votes)
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.flushed += len(batch)
+            self.batches += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+        # Answer the waiting requests before running hooks that may be slow or fail
+        for (vote, future), old in zip(batch, previous):
+            future.set_result(old)
+        self._callback(self.on_commit, votes, previous)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Maintain the song_rating_totals, song_rating_hourly and song_rating_daily tables.
+
+  python3 rating_totals.py check     report songs whose stored totals, hour
+                                     or day buckets differ from their votes
+                                     (exit status 1 if any)
+  python3 rating_totals.py rebuild   recompute the tables from song_votes and
+                                     song_votes_archive
+
+Both run in a single transaction, so they see (or replace) one consistent
+snapshot while servers keep voting.
+"""
+import argparse
+import sqlite3
+import sys
+
+import ratings
+
+
+def check(conn):
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not tables.issuperset(ratings.DERIVED_TABLES):
+        print("Rating count tables are missing; run 'rating_totals.py rebuild'.")
+        return False
+    conn.execute('BEGIN')
+    try:
+        mismatches = ratings.check_totals(conn)
+        buckets = ratings.check_hourly(conn)
+        days = ratings.check_daily(conn)
+    finally:
+        conn.execute('ROLLBACK')
+    for sid, stored, actual in mismatches:
+        print(f"  song {sid}: stored up/down {stored[0]}/{stored[1]}, "
+              f"votes {actual[0]}/{actual[1]}")
+    for sid, hour in buckets:
+        print(f"  song {sid}: hour bucket {hour} is wrong")
+    for sid, day in days:
+        print(f"  song {sid}: day bucket {day} is wrong")
+    if mismatches or buckets or days:
+        print(f"{len(mismatches)} songs have wrong totals, {len(buckets)} hour buckets "
+              f"and {len(days)} day buckets are wrong; run 'rating_totals.py rebuild'.")
+        return False
+    print("Song rating totals match the votes.")
+    return True
+
+
+def rebuild(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    ratings.create_normalized_schema(conn)
+    ratings.rebuild_totals(conn)
+    songs = conn.execute('SELECT COUNT(*) FROM song_rating_totals').fetchone()[0]
+    conn.execute('COMMIT')
+    print(f"Rebuilt totals for {songs} songs.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check or rebuild song rating totals')
+    parser.add_argument('command', choices=('check', 'rebuild'))
+    parser.add_argument('--database', default='database.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database, isolation_level=None)  # explicit transactions
+    conn.execute('PRAGMA busy_timeout = 10000')
+    try:
+        if ratings.detect_storage(conn) != ratings.NORMALIZED:
+            print("Ratings use legacy storage, which has no totals table; "
+                  "run migrate_songs.py first.")
+            ok = False
+        elif args.command == 'check':
+            ok = check(conn)
+        else:
+            ok = rebuild(conn)
+    finally:
+        conn.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""Song rating queries shared by the rating handlers.
+
+Ratings live in one of two layouts:
+
+  legacy     - song_ratings, one row per vote carrying the song title,
+               artist and album text and the listener's identifier string
+  normalized - songs and listeners dimension tables with integer ids, and
+               song_votes keyed by (song_id, listener_id), with per-song
+               counts materialized in song_rating_totals (all time) and
+               song_rating_hourly (per hour, for charts)
+
+Normalized votes older than the retention window are moved to
+song_votes_archive by rollups.py, and hour buckets past the hourly
+retention are folded into song_rating_daily.  Archived votes still count
+in every total and bucket, and a listener who votes again on a song gets
+their archived vote restored and replaced, so each listener still has at
+most one vote per song.
+
+schema_meta.ratings_storage records which layout a database uses (see
+migrate_songs.py).  Each process picks the layout once at startup with
+use_storage(detect_storage(conn)).
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+
+LEGACY = 'legacy'
+NORMALIZED = 'normalized'
+
+storage = LEGACY
+vote_archive = False  # whether song_votes_archive exists (see use_storage)
+
+NORMALIZED_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS schema_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS songs (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        album TEXT,
+        UNIQUE(title, artist)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS listeners (
+        id INTEGER PRIMARY KEY,
+        identifier TEXT NOT NULL UNIQUE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS song_votes (
+        song_id INTEGER NOT NULL REFERENCES songs(id),
+        listener_id INTEGER NOT NULL REFERENCES listeners(id),
+        rating INTEGER NOT NULL CHECK (rating IN (-1, 1)),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (song_id, listener_id)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS song_votes_archive (
+        song_id INTEGER NOT NULL,
+        listener_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL,
+        created_at DATETIME,
+        PRIMARY KEY (song_id, listener_id)
+    ) WITHOUT ROWID''',
+    # Lets the archiver find votes past the retention window without a scan
+    'CREATE INDEX IF NOT EXISTS idx_song_votes_created ON song_votes (created_at)',
+]
+
+# Deleting a vote only uncounts it when it is not being moved to the archive
+NOT_ARCHIVED = '''NOT EXISTS (SELECT 1 FROM song_votes_archive a
+                                WHERE a.song_id = old.song_id AND a.listener_id = old.listener_id)'''
+
+
+# Per-song counts kept exact by triggers on song_votes, so reading a tally
+# is one primary key lookup however many votes a song has
+TOTALS_TABLE = '''CREATE TABLE IF NOT EXISTS song_rating_totals (
+    song_id INTEGER PRIMARY KEY REFERENCES songs(id),
+    thumbs_up INTEGER NOT NULL DEFAULT 0,
+    thumbs_down INTEGER NOT NULL DEFAULT 0
+)'''
+
+ADD_VOTE = '''
+    INSERT INTO song_rating_totals (song_id, thumbs_up, thumbs_down)
+    VALUES (new.song_id, new.rating = 1, new.rating = -1)
+    ON CONFLICT (song_id) DO UPDATE
+    SET thumbs_up = thumbs_up + excluded.thumbs_up,
+        thumbs_down = thumbs_down + excluded.thumbs_down;
+'''
+
+REMOVE_VOTE = '''
+    UPDATE song_rating_totals
+    SET thumbs_up = thumbs_up - (old.rating = 1),
+        thumbs_down = thumbs_down - (old.rating = -1)
+    WHERE song_id = old.song_id;
+'''
+
+TOTALS_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_totals_insert
+        AFTER INSERT ON song_votes
+        BEGIN {ADD_VOTE} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_totals_update
+        AFTER UPDATE OF song_id, rating ON song_votes
+        WHEN old.rating != new.rating OR old.song_id != new.song_id
+        BEGIN {REMOVE_VOTE} {ADD_VOTE} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_totals_delete
+        AFTER DELETE ON song_votes WHEN {NOT_ARCHIVED}
+        BEGIN {REMOVE_VOTE} END''',
+]
+
+# Votes per song per hour of their created_at, for time-windowed charts
+HOURLY_TABLE = '''CREATE TABLE IF NOT EXISTS song_rating_hourly (
+    song_id INTEGER NOT NULL REFERENCES songs(id),
+    hour INTEGER NOT NULL,  -- unix time // 3600
+    thumbs_up INTEGER NOT NULL DEFAULT 0,
+    thumbs_down INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, song_id)  -- chart windows are ranges of hours
+) WITHOUT ROWID'''
+
+VOTE_HOUR = "CAST(strftime('%s', {}.created_at) AS INTEGER) / 3600"
+
+ADD_HOURLY = f'''
+    INSERT INTO song_rating_hourly (song_id, hour, thumbs_up, thumbs_down)
+    VALUES (new.song_id, {VOTE_HOUR.format('new')}, new.rating = 1, new.rating = -1)
+    ON CONFLICT (hour, song_id) DO UPDATE
+    SET thumbs_up = thumbs_up + excluded.thumbs_up,
+        thumbs_down = thumbs_down + excluded.thumbs_down;
+'''
+
+# An hour already folded into song_rating_daily gets a negative bucket,
+# which the next rollup folds into its day
+REMOVE_HOURLY = f'''
+    INSERT INTO song_rating_hourly (song_id, hour, thumbs_up, thumbs_down)
+    VALUES (old.song_id, {VOTE_HOUR.format('old')}, -(old.rating = 1), -(old.rating = -1))
+    ON CONFLICT (hour, song_id) DO UPDATE
+    SET thumbs_up = thumbs_up + excluded.thumbs_up,
+        thumbs_down = thumbs_down + excluded.thumbs_down;
+'''
+
+HOURLY_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_hourly_insert
+        AFTER INSERT ON song_votes
+        BEGIN {ADD_HOURLY} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_hourly_update
+        AFTER UPDATE ON song_votes
+        BEGIN {REMOVE_HOURLY} {ADD_HOURLY} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_hourly_delete
+        AFTER DELETE ON song_votes WHEN {NOT_ARCHIVED}
+        BEGIN {REMOVE_HOURLY} END''',
+]
+
+# Votes per song per day, for hours older than the hourly retention
+# (filled by rollups.py; schema_meta.rollup_hour is the first hour not in it)
+DAILY_TABLE = '''CREATE TABLE IF NOT EXISTS song_rating_daily (
+    song_id INTEGER NOT NULL REFERENCES songs(id),
+    day INTEGER NOT NULL,  -- unix time // 86400
+    thumbs_up INTEGER NOT NULL DEFAULT 0,
+    thumbs_down INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, song_id)
+) WITHOUT ROWID'''
+
+ROLLUP_HOUR = 'rollup_hour'
+
+# A new vote for a song the listener voted on before the retention window:
+# uncount the archived vote, which the new one replaces
+ARCHIVED_VOTE = '''FROM song_votes_archive a
+        WHERE a.song_id = new.song_id AND a.listener_id = new.listener_id'''
+
+ARCHIVE_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS song_votes_restore
+        AFTER INSERT ON song_votes
+        WHEN EXISTS (SELECT 1 {ARCHIVED_VOTE})
+        BEGIN
+            UPDATE song_rating_totals
+            SET thumbs_up = thumbs_up - (SELECT a.rating = 1 {ARCHIVED_VOTE}),
+                thumbs_down = thumbs_down - (SELECT a.rating = -1 {ARCHIVED_VOTE})
+            WHERE song_id = new.song_id;
+            INSERT INTO song_rating_hourly (song_id, hour, thumbs_up, thumbs_down)
+            SELECT a.song_id, {VOTE_HOUR.format('a')}, -(a.rating = 1), -(a.rating = -1)
+            {ARCHIVED_VOTE}
+            ON CONFLICT (hour, song_id) DO UPDATE
+            SET thumbs_up = thumbs_up + excluded.thumbs_up,
+                thumbs_down = thumbs_down + excluded.thumbs_down;
+            DELETE FROM song_votes_archive
+            WHERE song_id = new.song_id AND listener_id = new.listener_id;
+        END''',
+]
+
+DERIVED_TABLES = {
+    'song_rating_totals': (TOTALS_TABLE, TOTALS_TRIGGERS),
+    'song_rating_hourly': (HOURLY_TABLE, HOURLY_TRIGGERS),
+    'song_rating_daily': (DAILY_TABLE, ARCHIVE_TRIGGERS),
+}
+
+# Every vote, hot or archived
+ALL_VOTES = '''(SELECT song_id, rating, created_at FROM song_votes
+     UNION ALL
+     SELECT song_id, rating, created_at FROM song_votes_archive)'''
+
+
+def create_normalized_schema(conn):
+    """Create the rating tables and triggers if they are missing.
+
+    Newly created count tables are filled from the existing votes.
+    """
+    for statement in NORMALIZED_SCHEMA:
+        conn.execute(statement)
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, statements in DERIVED_TABLES.values():
+        conn.execute(table)
+        for statement in statements:
+            conn.execute(statement)
+    if not existing.issuperset(DERIVED_TABLES):
+        rebuild_totals(conn)
+
+
+def replace_vote_triggers(conn):
+    """Recreate the song_votes triggers from the current definitions (caller commits)"""
+    for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'song_votes'"
+    ).fetchall():
+        conn.execute(f'DROP TRIGGER {name}')
+    for _, statements in DERIVED_TABLES.values():
+        for statement in statements:
+            conn.execute(statement)
+
+
+def rolled_up_hour(conn):
+    """First hour whose buckets are still in song_rating_hourly"""
+    return int(get_meta(conn, ROLLUP_HOUR, 0))
+
+
+def rebuild_totals(conn):
+    """Recompute song_rating_totals, song_rating_hourly and song_rating_daily
+    from song_votes and song_votes_archive (caller commits)"""
+    for statement in NORMALIZED_SCHEMA:
+        conn.execute(statement)  # the archive, in databases from before it
+    conn.execute(DAILY_TABLE)
+    # A vote imported with the triggers off may duplicate an archived one; the newer wins
+    conn.execute(
+        '''DELETE FROM song_votes_archive WHERE EXISTS (
+               SELECT 1 FROM song_votes v
+               WHERE v.song_id = song_votes_archive.song_id
+                 AND v.listener_id = song_votes_archive.listener_id)'''
+    )
+    conn.execute('DELETE FROM song_rating_totals')
+    conn.execute(
+        f'''INSERT INTO song_rating_totals (song_id, thumbs_up, thumbs_down)
+            SELECT song_id, SUM(rating = 1), SUM(rating = -1)
+            FROM {ALL_VOTES} GROUP BY song_id'''
+    )
+    rolled_up = rolled_up_hour(conn)
+    conn.execute('DELETE FROM song_rating_hourly')
+    conn.execute(
+        f'''INSERT INTO song_rating_hourly (song_id, hour, thumbs_up, thumbs_down)
+            SELECT song_id, {VOTE_HOUR.format('v')} AS hour, SUM(rating = 1), SUM(rating = -1)
+            FROM {ALL_VOTES} v WHERE hour >= ? GROUP BY 1, 2''',
+        (rolled_up,)
+    )
+    conn.execute('DELETE FROM song_rating_daily')
+    conn.execute(
+        f'''INSERT INTO song_rating_daily (song_id, day, thumbs_up, thumbs_down)
+            SELECT song_id, {VOTE_HOUR.format('v')} / 24 AS day, SUM(rating = 1), SUM(rating = -1)
+            FROM {ALL_VOTES} v WHERE {VOTE_HOUR.format('v')} < ? GROUP BY 1, 2''',
+        (rolled_up,)
+    )
+
+
+def check_totals(conn):
+    """Return [(song_id, stored (up, down), actual (up, down))] for every mismatch"""
+    actual = f'''SELECT song_id, SUM(rating = 1), SUM(rating = -1)
+                 FROM {ALL_VOTES} GROUP BY song_id'''
+    stored = '''SELECT song_id, thumbs_up, thumbs_down FROM song_rating_totals
+                WHERE thumbs_up != 0 OR thumbs_down != 0'''
+    wrong = {row[0] for row in conn.execute(f'{actual} EXCEPT {stored}')}
+    wrong |= {row[0] for row in conn.execute(f'{stored} EXCEPT {actual}')}
+    mismatches = []
+    for sid in sorted(wrong):
+        row = conn.execute(
+            'SELECT thumbs_up, thumbs_down FROM song_rating_totals WHERE song_id = ?', (sid,)
+        ).fetchone()
+        counted = conn.execute(
+            'SELECT COALESCE(SUM(rating = 1), 0), COALESCE(SUM(rating = -1), 0) '
+            f'FROM {ALL_VOTES} WHERE song_id = ?', (sid,)
+        ).fetchone()
+        mismatches.append((sid, tuple(row) if row else (0, 0), tuple(counted)))
+    return mismatches
+
+
+def check_hourly(conn):
+    """Return the (song_id, hour) buckets whose stored counts differ from the votes"""
+    actual = f'''SELECT song_id, {VOTE_HOUR.format('v')} AS hour, SUM(rating = 1), SUM(rating = -1)
+                 FROM {ALL_VOTES} v WHERE hour >= ?1 GROUP BY 1, 2'''
+    stored = '''SELECT song_id, hour, thumbs_up, thumbs_down FROM song_rating_hourly
+                WHERE hour >= ?1 AND (thumbs_up != 0 OR thumbs_down != 0)'''
+    rolled_up = (rolled_up_hour(conn),)
+    wrong = {tuple(row[:2]) for row in conn.execute(f'{actual} EXCEPT {stored}', rolled_up)}
+    wrong |= {tuple(row[:2]) for row in conn.execute(f'{stored} EXCEPT {actual}', rolled_up)}
+    return sorted(wrong)
+
+
+def check_daily(conn):
+    """Return the (song_id, day) buckets before the rollup watermark whose
+    counts differ from the votes; hour buckets not yet folded in count
+    towards their day"""
+    actual = f'''SELECT song_id, {VOTE_HOUR.format('v')} / 24 AS day, SUM(rating = 1), SUM(rating = -1)
+                 FROM {ALL_VOTES} v WHERE {VOTE_HOUR.format('v')} < ?1 GROUP BY 1, 2'''
+    stored = '''SELECT song_id, day, SUM(up), SUM(down) FROM (
+                    SELECT song_id, day, thumbs_up AS up, thumbs_down AS down
+                    FROM song_rating_daily
+                    UNION ALL
+                    SELECT song_id, hour / 24, thumbs_up, thumbs_down
+                    FROM song_rating_hourly WHERE hour < ?1)
+                GROUP BY 1, 2 HAVING SUM(up) != 0 OR SUM(down) != 0'''
+    rolled_up = (rolled_up_hour(conn),)
+    wrong = {tuple(row[:2]) for row in conn.execute(f'{actual} EXCEPT {stored}', rolled_up)}
+    wrong |= {tuple(row[:2]) for row in conn.execute(f'{stored} EXCEPT {actual}', rolled_up)}
+    return sorted(wrong)
+
+
+def set_meta(conn, key, value):
+    conn.execute(
+        'INSERT INTO schema_meta (key, value) VALUES (?, ?) '
+        'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+        (key, str(value))
+    )
+
+
+def get_meta(conn, key, default=None):
+    try:
+        row = conn.execute('SELECT value FROM schema_meta WHERE key = ?', (key,)).fetchone()
+    except sqlite3.OperationalError:  # no schema_meta table yet
+        return default
+    return row[0] if row is not None else default
+
+
+def detect_storage(conn):
+    """Return the rating layout recorded in the database"""
+    return get_meta(conn, 'ratings_storage', LEGACY)
+
+
+def detect_vote_archive(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_votes_archive'"
+    ).fetchone() is not None
+
+
+def use_storage(layout, archive=False):
+    """Select the rating layout used by this process, and whether votes may be archived"""
+    global storage, vote_archive
+    if layout not in (LEGACY, NORMALIZED):
+        raise ValueError(f"Unknown ratings storage: {layout}")
+    storage = layout
+    vote_archive = archive
+
+
+class IdCache:
+    """Bounded LRU map of natural keys to interned integer ids"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            row_id = self._ids.get(key)
+            if row_id is not None:
+                self._ids.move_to_end(key)
+            return row_id
+
+    def put(self, key, row_id):
+        with self._lock:
+            self._ids[key] = row_id
+            self._ids.move_to_end(key)
+            if len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+song_ids = IdCache(50000)       # (title, artist) -> songs.id
+listener_ids = IdCache(200000)  # identifier -> listeners.id
+
+
+def song_id(conn, title, artist, album=None, create=False):
+    """Interned id for a song, or None if unknown and create is False"""
+    key = (title, artist)
+    row_id = song_ids.get(key)
+    if row_id is not None:
+        return row_id
+    row = conn.execute('SELECT id FROM songs WHERE title = ? AND artist = ?', key).fetchone()
+    if row is None:
+        if not create:
+            return None
+        conn.execute(
+            'INSERT INTO songs (title, artist, album) VALUES (?, ?, ?) ON CONFLICT DO NOTHING',
+            (title, artist, album or '')
+        )
+        row = conn.execute('SELECT id FROM songs WHERE title = ? AND artist = ?', key).fetchone()
+    song_ids.put(key, row[0])
+    return row[0]
+
+
+def listener_id(conn, identifier):
+    """Interned id for a listener identifier, created on first use"""
+    row_id = listener_ids.get(identifier)
+    if row_id is not None:
+        return row_id
+    conn.execute('INSERT INTO listeners (identifier) VALUES (?) ON CONFLICT DO NOTHING',
+                 (identifier,))
+    row = conn.execute('SELECT id FROM listeners WHERE identifier = ?', (identifier,)).fetchone()
+    listener_ids.put(identifier, row[0])
+    return row[0]
+
+
+def forget_ids():
+    """Drop interned ids, e.g. after a rollback may have discarded new rows"""
+    song_ids.clear()
+    listener_ids.clear()
+
+
+def fetch_tally(conn, title, artist):
+    """Return (thumbs_up, thumbs_down) for one song.
+
+    Normalized storage reads the song's song_rating_totals row; legacy
+    storage counts its votes with a single grouped query.
+    """
+    if storage == NORMALIZED:
+        sid = song_id(conn, title, artist)
+        if sid is None:
+            return 0, 0
+        row = conn.execute(
+            'SELECT thumbs_up, thumbs_down FROM song_rating_totals WHERE song_id = ?', (sid,)
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else (0, 0)
+    rows = conn.execute(
+        '''SELECT rating, COUNT(*) FROM song_ratings
+           WHERE song_title = ? AND song_artist = ?
+           GROUP BY rating''',
+        (title, artist)
+    ).fetchall()
+    counts = {rating: count for rating, count in rows}
+    return counts.get(1, 0), counts.get(-1, 0)
+
+
+def fetch_tallies(conn, songs):
+    """Return {(title, artist): (thumbs_up, thumbs_down)} for many songs at once.
+
+    The wanted songs are joined in as a VALUES list against the stored
+    totals (or counted with one grouped query on legacy storage); songs
+    without votes come back as (0, 0).
+    """
+    songs = list(dict.fromkeys(songs))
+    if not songs:
+        return {}
+    values = ', '.join(['(?, ?)'] * len(songs))
+    params = [part for song in songs for part in song]
+    if storage == NORMALIZED:
+        sql = f'''WITH wanted (title, artist) AS (VALUES {values})
+            SELECT w.title, w.artist,
+                   COALESCE(t.thumbs_up, 0), COALESCE(t.thumbs_down, 0)
+            FROM wanted w
+            LEFT JOIN songs s ON s.title = w.title AND s.artist = w.artist
+            LEFT JOIN song_rating_totals t ON t.song_id = s.id'''
+    else:
+        sql = f'''WITH wanted (title, artist) AS (VALUES {values})
+            SELECT w.title, w.artist,
+                   COALESCE(SUM(r.rating = 1), 0), COALESCE(SUM(r.rating = -1), 0)
+            FROM wanted w
+            LEFT JOIN song_ratings r ON r.song_title = w.title AND r.song_artist = w.artist
+            GROUP BY w.title, w.artist'''
+    rows = conn.execute(sql, params).fetchall()
+    return {(title, artist): (up, down) for title, artist, up, down in rows}
+
+
+def submit_rating(conn, title, artist, album, user_id, rating):
+    """Insert or update one user's rating and commit.
+
+    Returns the user's previous rating for the song, or None if this is
+    their first vote, so callers can adjust cached tallies for flips.
+    """
+    if storage == NORMALIZED:
+        try:
+            previous = _upsert_normalized(conn, [(title, artist, album, user_id, rating)])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            forget_ids()
+            raise
+        return previous[0]
+    try:
+        conn.execute(
+            '''INSERT INTO song_ratings (song_title, song_artist, song_album, user_identifier, rating)
+               VALUES (?, ?, ?, ?, ?)''',
+            (title, artist, album, user_id, rating)
+        )
+        conn.commit()
+        return None
+    except sqlite3.IntegrityError:
+        # User already rated this song - update the rating
+        row = conn.execute(
+            '''SELECT rating FROM song_ratings
+               WHERE song_title = ? AND song_artist = ? AND user_identifier = ?''',
+            (title, artist, user_id)
+        ).fetchone()
+        conn.execute(
+            '''UPDATE song_ratings
+               SET rating = ?, created_at = CURRENT_TIMESTAMP
+               WHERE song_title = ? AND song_artist = ? AND user_identifier = ?''',
+            (rating, title, artist, user_id)
+        )
+        conn.commit()
+        return row[0] if row is not None else None
+
+
+def upsert_ratings(conn, votes):
+    """Write a batch of (title, artist, album, user_id, rating) votes.
+
+    Uses one INSERT ... ON CONFLICT DO UPDATE per vote inside the caller's
+    transaction (no commit here).  Returns each vote's previous rating, or
+    None for first-time votes, in the same order.
+    """
+    if storage == NORMALIZED:
+        try:
+            return _upsert_normalized(conn, votes)
+        except Exception:
+            forget_ids()
+            raise
+    return _upsert_legacy(conn, votes)
+
+
+def _previous_ratings(keys, lookup):
+    """Previous rating per vote; repeats within a batch see the earlier vote"""
+    previous = []
+    latest = {}
+    for key, rating in keys:
+        if key in latest:
+            previous.append(latest[key])
+        else:
+            previous.append(lookup(key))
+        latest[key] = rating
+    return previous
+
+
+def _upsert_legacy(conn, votes):
+    def lookup(key):
+        row = conn.execute(
+            '''SELECT rating FROM song_ratings
+               WHERE song_title = ? AND song_artist = ? AND user_identifier = ?''',
+            key
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    previous = _previous_ratings(
+        [((title, artist, user_id), rating) for title, artist, album, user_id, rating in votes],
+        lookup)
+    conn.executemany(
+        '''INSERT INTO song_ratings (song_title, song_artist, song_album, user_identifier, rating)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT (song_title, song_artist, user_identifier) DO UPDATE
+           SET rating = excluded.rating, created_at = CURRENT_TIMESTAMP''',
+        votes
+    )
+    return previous
+
+
+def _upsert_normalized(conn, votes):
+    rows = [(song_id(conn, title, artist, album, create=True), listener_id(conn, user_id), rating)
+            for title, artist, album, user_id, rating in votes]
+
+    def lookup(key):
+        row = conn.execute(
+            'SELECT rating FROM song_votes WHERE song_id = ? AND listener_id = ?', key
+        ).fetchone()
+        if row is None and vote_archive:
+            row = conn.execute(
+                'SELECT rating FROM song_votes_archive WHERE song_id = ? AND listener_id = ?', key
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    previous = _previous_ratings([((sid, lid), rating) for sid, lid, rating in rows], lookup)
+    conn.executemany(
+        '''INSERT INTO song_votes (song_id, listener_id, rating)
+           VALUES (?, ?, ?)
+           ON CONFLICT (song_id, listener_id) DO UPDATE
+           SET rating = excluded.rating, created_at = CURRENT_TIMESTAMP''',
+        rows
+    )
+    return previous
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""In-process cache of rendered API responses.
+
+Entries are keyed by route and arguments, expire after a TTL and are
+dropped explicitly when the data behind them changes.  Each entry carries
+an ETag derived from its body so clients can revalidate with
+If-None-Match and get a 304 without the body being sent again.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+DEFAULT_TTL = 30.0
+DEFAULT_MAX_ENTRIES = 1000
+
+CachedResponse = namedtuple('CachedResponse', 'body etag mimetype stored_at')
+
+
+def body_etag(body):
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by invalidate() so a response rendered before a write is not stored after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the CachedResponse for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.stored_at > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, generation):
+        """Store a rendered body unless the cache was invalidated since `generation`"""
+        entry = CachedResponse(body, body_etag(body), mimetype, time.monotonic())
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Rating rollups and vote retention for normalized rating storage.
+
+  python3 rollups.py setup     create song_votes_archive and song_rating_daily
+                               and install the archive-aware vote triggers
+  python3 rollups.py run       fold old hour buckets and archive old votes now
+  python3 rollups.py status    show the watermark and table sizes
+
+Hour buckets (song_rating_hourly) are kept for --hourly-days; whole days
+older than that are folded into song_rating_daily and deleted.
+schema_meta.rollup_hour marks how far folding has got, and since folded
+buckets are gone, each run only reads the buckets that arrived since the
+previous one.  A vote changed after its hour was folded leaves a negative
+hour bucket that the next run folds into its day.
+
+Votes older than --vote-days are moved from song_votes to
+song_votes_archive in short batches, so the hot table stops growing.
+Archived votes stay counted in the totals and buckets, and a listener
+voting again on a song replaces their archived vote (see ratings.py).
+
+simple_server.py runs both steps every --rollup-interval seconds.
+"""
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+
+import db_pool
+import ratings
+
+DEFAULT_INTERVAL = 300.0
+DEFAULT_HOURLY_DAYS = 14
+MIN_HOURLY_DAYS = 8        # the hour, day and week charts read hour buckets only
+DEFAULT_VOTE_DAYS = 90
+FOLD_BATCH_HOURS = 24 * 7  # hours of buckets folded per transaction
+ARCHIVE_BATCH = 5000       # votes archived per transaction
+
+
+def has_rollups(conn):
+    """True once `rollups.py setup` has run on this database"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'song_votes_restore'"
+    ).fetchone() is not None
+
+
+def setup(conn):
+    """Create the rollup tables and replace the vote triggers (explicit transactions)"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        ratings.create_normalized_schema(conn)
+        ratings.replace_vote_triggers(conn)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def fold_hours(conn, now=None, hourly_days=DEFAULT_HOURLY_DAYS):
+    """Fold hour buckets of whole days older than hourly_days into song_rating_daily.
+
+    Returns the number of hour buckets folded.
+    """
+    hourly_days = max(hourly_days, MIN_HOURLY_DAYS)
+    cutoff = (int(now if now is not None else time.time()) // 86400 - hourly_days) * 24
+    folded = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            watermark = ratings.rolled_up_hour(conn)
+            # Buckets below the watermark are late changes to folded days
+            limit = max(cutoff, watermark)
+            start = conn.execute('SELECT MIN(hour) FROM song_rating_hourly').fetchone()[0]
+            end = limit if start is None else min(limit, (start // 24) * 24 + FOLD_BATCH_HOURS)
+            if start is not None and start < end:
+                conn.execute(
+                    '''INSERT INTO song_rating_daily (song_id, day, thumbs_up, thumbs_down)
+                       SELECT song_id, hour / 24, SUM(thumbs_up), SUM(thumbs_down)
+                       FROM song_rating_hourly WHERE hour < ?
+                       GROUP BY hour / 24, song_id
+                       ON CONFLICT (day, song_id) DO UPDATE
+                       SET thumbs_up = thumbs_up + excluded.thumbs_up,
+                           thumbs_down = thumbs_down + excluded.thumbs_down''',
+                    (end,))
+                folded += conn.execute('DELETE FROM song_rating_hourly WHERE hour < ?',
+                                       (end,)).rowcount
+            if end > watermark:
+                ratings.set_meta(conn, ratings.ROLLUP_HOUR, end)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if start is None or end >= limit:
+            return folded
+
+
+def archive_votes(conn, now=None, vote_days=DEFAULT_VOTE_DAYS, batch=ARCHIVE_BATCH):
+    """Move votes older than vote_days to song_votes_archive; returns how many"""
+    now = now if now is not None else time.time()
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - vote_days * 86400))
+    archived = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                '''SELECT song_id, listener_id, rating, created_at FROM song_votes
+                   WHERE created_at < ? ORDER BY created_at LIMIT ?''',
+                (cutoff, batch)).fetchall()
+            # Archive first: the delete triggers skip votes that are in the archive
+            conn.executemany(
+                '''INSERT INTO song_votes_archive (song_id, listener_id, rating, created_at)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT (song_id, listener_id) DO UPDATE
+                   SET rating = excluded.rating, created_at = excluded.created_at''',
+                rows)
+            conn.executemany('DELETE FROM song_votes WHERE song_id = ? AND listener_id = ?',
+                             [tuple(row[:2]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        archived += len(rows)
+        if len(rows) < batch:
+            return archived
+
+
+def run(conn, now=None, hourly_days=DEFAULT_HOURLY_DAYS, vote_days=DEFAULT_VOTE_DAYS):
+    """One rollup pass; vote_days of 0 keeps every vote in song_votes"""
+    folded = fold_hours(conn, now, hourly_days)
+    archived = archive_votes(conn, now, vote_days) if vote_days else 0
+    return {'buckets_folded': folded, 'votes_archived': archived}
+
+
+def status(conn):
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('song_votes', 'song_votes_archive',
+                            'song_rating_hourly', 'song_rating_daily')}
+    counts['rollup_hour'] = ratings.rolled_up_hour(conn)
+    return counts
+
+
+class RollupJob:
+    """Runs a rollup pass every `interval` seconds on a background thread"""
+
+    def __init__(self, path=db_pool.DATABASE, interval=DEFAULT_INTERVAL,
+                 hourly_days=DEFAULT_HOURLY_DAYS, vote_days=DEFAULT_VOTE_DAYS):
+        self.path = path
+        self.interval = interval
+        self.hourly_days = hourly_days
+        self.vote_days = vote_days
+        self.runs = 0
+        self.buckets_folded = 0
+        self.votes_archived = 0
+        self.last_run_ms = None
+        self.last_error = None
+        self._conn = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='rating-rollups',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop after the pass in progress, if any, and close the connection"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return  # still inside a pass; its connection closes with the process
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self):
+        # The first pass waits an interval too, keeping startup quick
+        while not self._stopping.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        if self._conn is None:
+            self._conn = db_pool.get_pool(self.path).connect()
+            self._conn.isolation_level = None  # explicit transactions
+        started = time.monotonic()
+        try:
+            result = run(self._conn, hourly_days=self.hourly_days, vote_days=self.vote_days)
+        except Exception as e:  # keep the job alive; the next pass retries
+            if str(e) != self.last_error:
+                print(f"Rating rollups failed: {e}")
+            self.last_error = str(e)
+            return
+        self.last_error = None
+        self.runs += 1
+        self.buckets_folded += result['buckets_folded']
+        self.votes_archived += result['votes_archived']
+        self.last_run_ms = round((time.monotonic() - started) * 1000, 1)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'hourly_days': self.hourly_days,
+            'vote_days': self.vote_days,
+            'runs': self.runs,
+            'buckets_folded': self.buckets_folded,
+            'votes_archived': self.votes_archived,
+            'last_run_ms': self.last_run_ms,
+            'last_error': self.last_error,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Roll up rating buckets and archive old votes')
+    parser.add_argument('command', choices=('setup', 'run', 'status'))
+    parser.add_argument('--database', default='database.db')
+    parser.add_argument('--hourly-days', type=int, default=DEFAULT_HOURLY_DAYS,
+                        help=f'Days of hour buckets to keep (at least {MIN_HOURLY_DAYS})')
+    parser.add_argument('--vote-days', type=int, default=DEFAULT_VOTE_DAYS,
+                        help='Days of votes to keep in song_votes; 0 keeps them all')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database, isolation_level=None)  # explicit transactions
+    conn.execute('PRAGMA busy_timeout = 10000')
+    try:
+        if ratings.detect_storage(conn) != ratings.NORMALIZED:
+            print("Ratings use legacy storage; run migrate_songs.py first.")
+            sys.exit(1)
+        if args.command == 'setup':
+            setup(conn)
+            print("Rating rollup tables and triggers installed.")
+            return
+        if not has_rollups(conn):
+            print("Rollups are not set up; run 'rollups.py setup' first.")
+            sys.exit(1)
+        if args.command == 'run':
+            started = time.monotonic()
+            result = run(conn, hourly_days=args.hourly_days, vote_days=args.vote_days)
+            print(f"Folded {result['buckets_folded']} hour buckets and archived "
+                  f"{result['votes_archived']} votes in {time.monotonic() - started:.1f}s.")
+        for name, value in status(conn).items():
+            print(f"  {name}: {value}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Full-text search over posts, shared by simple_server.py and app.py.
+
+posts_fts is an external-content FTS5 index over posts.title and
+posts.content: it stores only the inverted index and reads the text back
+from posts, and triggers on posts keep it in step with every insert,
+update and delete.  Matches are ranked by bm25 with title hits weighted
+above content hits, and come back with the matching words wrapped in
+<mark> in an HTML-escaped title and content snippet.
+
+Search terms are quoted before they reach FTS5, so user input never needs
+to be valid FTS5 query syntax; the last term also matches as a prefix (of
+three or more characters, which the index stores separately) so results
+appear while the user is still typing.
+"""
+import html
+import re
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_OFFSET = 1000  # relevance-ranked pages past this are not worth scoring
+MAX_TERMS = 16
+MIN_PREFIX = 3  # shorter prefixes match too many terms to rank quickly
+
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+SNIPPET_TOKENS = 24
+
+# Private-use markers survive html.escape() and become <mark> tags afterwards
+_OPEN, _CLOSE = '\ue000', '\ue001'
+
+SEARCH_TABLE = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    title, content,
+    content = 'posts', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2',
+    prefix = '3'
+)'''
+
+SEARCH_TRIGGERS = {
+    'posts_fts_insert': '''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END''',
+    'posts_fts_delete': '''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, old.content);
+        END''',
+    'posts_fts_update': '''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF id, title, content ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, content)
+            VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END''',
+}
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def has_search_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+    ).fetchone() is not None
+
+
+def create_search_index(conn):
+    """Create posts_fts and its triggers; index existing posts if it is new"""
+    new = not has_search_index(conn)
+    conn.execute(SEARCH_TABLE)
+    for statement in SEARCH_TRIGGERS.values():
+        conn.execute(statement)
+    if new:
+        rebuild_search_index(conn)
+    return new
+
+
+def rebuild_search_index(conn):
+    """Re-index every post from scratch, then merge the index into one segment"""
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+
+
+def check_search_index(conn):
+    """Raise sqlite3.DatabaseError if posts_fts disagrees with posts"""
+    conn.execute("INSERT INTO posts_fts (posts_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def match_query(text):
+    """FTS5 query matching every word of text, the last one also as a prefix"""
+    terms = _TERM.findall(text)[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= MIN_PREFIX:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def parse_search(params):
+    """(match, limit, offset, published_only) from query parameters (any mapping with .get)"""
+    match = match_query(params.get('q') or '')
+    if match is None:
+        raise ValueError('q must contain at least one word')
+    limit = _int_param(params, 'limit', DEFAULT_LIMIT)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    offset = _int_param(params, 'offset', 0)
+    if not 0 <= offset <= MAX_OFFSET:
+        raise ValueError(f'offset must be between 0 and {MAX_OFFSET}')
+    published_only = (params.get('published') or '').lower() in TRUE_VALUES
+    return match, min(limit, MAX_LIMIT), offset, published_only
+
+
+def _int_param(params, name, default):
+    value = params.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def _marked(text):
+    """HTML-escape highlighted text and turn the markers into <mark> tags"""
+    if text is None:
+        return None
+    return html.escape(text).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search_posts(conn, match, limit, offset=0, published_only=False):
+    """Return (posts, next_offset) for an FTS5 match expression, best first"""
+    where = 'AND p.published = 1' if published_only else ''
+    rows = conn.execute(f'''
+        SELECT p.id, p.published, p.created_at,
+               u.name AS author_name, u.email AS author_email,
+               highlight(posts_fts, 0, ?1, ?2) AS title,
+               snippet(posts_fts, 1, ?1, ?2, '…', ?3) AS snippet,
+               bm25(posts_fts, ?4, ?5) AS score
+        FROM posts_fts
+        JOIN posts p ON p.id = posts_fts.rowid
+        LEFT JOIN users u ON u.id = p.author_id
+        WHERE posts_fts MATCH ?6 {where}
+        ORDER BY score
+        LIMIT ?7 OFFSET ?8''',
+        (_OPEN, _CLOSE, SNIPPET_TOKENS, TITLE_WEIGHT, CONTENT_WEIGHT, match,
+         limit + 1, offset)).fetchall()
+    posts = []
+    for row in rows[:limit]:
+        post = dict(row)
+        post['title'] = _marked(post['title'])
+        post['snippet'] = _marked(post['snippet'])
+        post['score'] = -post['score']  # bm25 is lower-is-better
+        posts.append(post)
+    next_offset = offset + limit if len(rows) > limit and offset + limit <= MAX_OFFSET else None
+    return posts, next_offset
+
+
+def search_response(conn, params):
+    """(body, status) for a /api/posts/search request"""
+    try:
+        match, limit, offset, published_only = parse_search(params)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if not has_search_index(conn):
+        return {'error': 'Search index not built; run add_search_index.py'}, 503
+    posts, next_offset = search_posts(conn, match, limit, offset, published_only)
+    return {'query': params.get('q'), 'posts': posts, 'next_offset': next_offset}, 200
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Serving engines for simple_server.py.
+
+Three modes are available:
+
+  single   - the original socketserver.TCPServer, one request at a time
+  threaded - a bounded thread pool with HTTP/1.1 keep-alive
+  asyncio  - an asyncio front end that owns every connection and only
+             borrows a pool thread while a request is being handled,
+             so idle keep-alive sockets cost no threads
+
+Every engine exposes serve_forever(), shutdown() and server_close() so
+the launcher can treat them the same way.
+
+The pooled engines bound the requests waiting for a pool thread: beyond
+`max_pending` they answer 503 straight away from the accepting thread or
+the event loop instead of letting work pile up behind busy handlers.
+They also record when each request arrived (see received_at()) so that
+time spent waiting counts against the request's deadline.
+"""
+import asyncio
+import io
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+MODES = ('single', 'threaded', 'asyncio')
+
+DEFAULT_THREADS = 32
+KEEPALIVE_TIMEOUT = 5  # seconds an idle persistent connection is kept
+MAX_HEADER_BYTES = 65536
+MAX_BODY_BYTES = 1024 * 1024  # request bodies are JSON posts and votes
+WRITE_BUFFER_BYTES = 65536
+DEFAULT_MAX_PENDING = 256
+
+_OVERLOADED_BODY = b'{"error": "Server is overloaded"}'
+OVERLOADED_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                       b'Content-Type: application/json\r\n'
+                       b'Content-Length: %d\r\n'
+                       b'Retry-After: 1\r\n'
+                       b'Connection: close\r\n\r\n' % len(_OVERLOADED_BODY)) + _OVERLOADED_BODY
+
+_TOO_LARGE_BODY = b'{"error": "Request body too large"}'
+TOO_LARGE_RESPONSE = (b'HTTP/1.1 413 Content Too Large\r\n'
+                      b'Content-Type: application/json\r\n'
+                      b'Content-Length: %d\r\n'
+                      b'Connection: close\r\n\r\n' % len(_TOO_LARGE_BODY)) + _TOO_LARGE_BODY
+
+_arrivals = threading.local()
+
+
+def received_at():
+    """Monotonic arrival time of the request the calling thread is about to
+    handle, if the engine recorded one; each recorded time is returned once"""
+    arrived = getattr(_arrivals, 'time', None)
+    _arrivals.time = None
+    return arrived
+
+
+def keepalive_handler(handler_class):
+    """Return a subclass of handler_class that speaks HTTP/1.1"""
+    return type(handler_class.__name__, (handler_class,), {
+        'protocol_version': 'HTTP/1.1',
+        'timeout': KEEPALIVE_TIMEOUT,
+        # Headers and body go out as separate writes; without TCP_NODELAY the
+        # second one waits for the client's delayed ACK on a kept-alive socket
+        'disable_nagle_algorithm': True,
+    })
+
+
+class SingleHTTPServer(socketserver.TCPServer):
+    """The original single-threaded server"""
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, reuse_port=False):
+        self.reuse_port = reuse_port
+        super().__init__(server_address, handler_class)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class ThreadPoolHTTPServer(SingleHTTPServer):
+    """TCPServer that hands each connection to a bounded thread pool"""
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS,
+                 reuse_port=False, max_pending=DEFAULT_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=threads,
+                                           thread_name_prefix='http')
+        self.max_pending = max_pending
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        super().__init__(server_address, keepalive_handler(handler_class),
+                         reuse_port=reuse_port)
+
+    def process_request(self, request, client_address):
+        with self._pending_lock:
+            overloaded = self._pending >= self.max_pending
+            if not overloaded:
+                self._pending += 1
+        if overloaded:
+            metrics.requests_shed.inc('backlog')
+            try:
+                request.sendall(OVERLOADED_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.executor.submit(self.process_request_thread, request, client_address,
+                             time.monotonic())
+
+    def process_request_thread(self, request, client_address, accepted_at=None):
+        with self._pending_lock:
+            self._pending -= 1
+        _arrivals.time = accepted_at
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class _TransportWriter:
+    """File-like wfile that forwards handler output to an asyncio stream.
+
+    Output is buffered and pushed to the event loop in blocks; the calling
+    pool thread waits for the transport to drain, which gives streaming
+    responses natural backpressure.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= WRITE_BUFFER_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self.buffer or self.closed:
+            return
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        future = asyncio.run_coroutine_threadsafe(self._send(chunk), self.loop)
+        try:
+            future.result()
+        except (ConnectionError, RuntimeError):
+            self.closed = True
+            raise BrokenPipeError('client went away')
+
+    async def _send(self, chunk):
+        self.writer.write(chunk)
+        await self.writer.drain()
+
+
+class AsyncioHTTPServer:
+    """asyncio connection handling with a thread pool for request handlers.
+
+    The event loop parses request heads and bodies off the socket, then runs
+    the ordinary BaseHTTPRequestHandler code for that single request in the
+    pool.  Connections waiting for their next request only hold a coroutine.
+
+    A handler may set `self.takeover` to a coroutine function; once the
+    handler returns, the connection is passed to takeover(reader, writer)
+    on the loop (used for long-lived event streams) and closed afterwards.
+    """
+    supports_takeover = True
+
+    def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS,
+                 reuse_port=False, max_pending=DEFAULT_MAX_PENDING):
+        self.server_address = server_address
+        self.RequestHandlerClass = keepalive_handler(handler_class)
+        self.reuse_port = reuse_port
+        self.executor = ThreadPoolExecutor(max_workers=threads,
+                                           thread_name_prefix='http')
+        self.max_pending = max_pending
+        self._pending = 0  # requests handed to the pool that have not started
+        self.loop = None
+        self._stopped = None
+        self._ready = threading.Event()
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+            # Drop connections still open (idle keep-alives, event streams)
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:  # gather() of nothing needs a current loop this thread lacks
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            self.loop.close()
+
+    def shutdown(self):
+        self._ready.wait()
+        self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def server_close(self):
+        self.executor.shutdown(wait=True)
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self._handle_connection, host or None, port,
+            reuse_address=True, reuse_port=self.reuse_port or None,
+            limit=MAX_HEADER_BYTES, backlog=1024)
+        self._ready.set()
+        async with server:
+            await self._stopped.wait()
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while True:
+                raw = await self._read_request(reader, writer)
+                if raw is None:
+                    break
+                if self._pending >= self.max_pending:
+                    metrics.requests_shed.inc('backlog')
+                    writer.write(OVERLOADED_RESPONSE)
+                    await writer.drain()
+                    break
+                out = _TransportWriter(self.loop, writer)
+                self._pending += 1
+                close, takeover = await self.loop.run_in_executor(
+                    self.executor, self._run_handler, raw, out, peer,
+                    time.monotonic(), reader.at_eof)
+                if takeover is not None and not out.closed:
+                    await takeover(reader, writer)
+                    break
+                if close or out.closed:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        """Read one request head plus its body, or None on idle/close.
+
+        Bodies over MAX_BODY_BYTES are refused with a 413, and a body
+        that stalls for KEEPALIVE_TIMEOUT drops the connection.
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                          KEEPALIVE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            return None
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                try:
+                    length = int(value.strip())
+                except ValueError:
+                    length = 0
+        if length > MAX_BODY_BYTES:
+            writer.write(TOO_LARGE_RESPONSE)
+            await writer.drain()
+            return None
+        if length <= 0:
+            return head
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), KEEPALIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        return head + body
+
+    def _run_handler(self, raw, wfile, peer, received, client_gone):
+        """Run one request through the handler class.
+
+        Returns (close_connection, takeover coroutine function or None).
+        """
+        self.loop.call_soon_threadsafe(self._started)
+        if client_gone():
+            # The client hung up while the request waited for a thread
+            metrics.requests_shed.inc('client_gone')
+            return True, None
+        _arrivals.time = received
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.server = self
+        handler.request = None
+        handler.client_address = peer[:2]
+        handler.rfile = io.BytesIO(raw)
+        handler.wfile = wfile
+        handler.close_connection = True
+        handler.takeover = None
+        try:
+            handler.handle_one_request()
+            wfile.flush()
+        except (BrokenPipeError, ConnectionError):
+            return True, None
+        return handler.close_connection, handler.takeover
+
+    def _started(self):
+        self._pending -= 1
+
+
+def make_server(mode, server_address, handler_class, threads=DEFAULT_THREADS,
+                reuse_port=False, max_pending=DEFAULT_MAX_PENDING):
+    """Build a server for the given mode"""
+    if mode == 'single':
+        return SingleHTTPServer(server_address, handler_class, reuse_port=reuse_port)
+    if mode == 'threaded':
+        return ThreadPoolHTTPServer(server_address, handler_class, threads=threads,
+                                    reuse_port=reuse_port, max_pending=max_pending)
+    if mode == 'asyncio':
+        return AsyncioHTTPServer(server_address, handler_class, threads=threads,
+                                 reuse_port=reuse_port, max_pending=max_pending)
+    raise ValueError(f"Unknown serving mode: {mode}")
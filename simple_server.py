@@ -1,14 +1,191 @@
 #!/usr/bin/env python3
+import argparse
+import concurrent.futures
 import http.server
-import socketserver
 import json
+import math
+import os
+import queue
+import signal
 import sqlite3
+import threading
+import time
 import urllib.parse
 from urllib.parse import urlparse, parse_qs
 
+import admission
+import charts
+import cover_art
+import db_pool
+import events
+import hls_cache
+import json_stream
+import listings
+import metrics
+import now_playing
+import prefork
+import rating_cache
+import rate_limit
+import rating_queue
+import ratings
+import rollups
+import search
+import serving
+import static_cache
+import table_versions
+
 PORT = 8000
+DATABASE = 'database.db'
+
+# Thumbs up/down per (title, artist), kept current by create_rating
+rating_tallies = rating_cache.RatingCache()
+# Optional write-behind queue for votes (see --rating-write-behind)
+rating_writer = None
+# Shared poller for the upstream now-playing metadata (see --metadata-url)
+now_playing_poller = None
+# Per-IP and per-listener flood control for /api/ratings (see --vote-rate)
+vote_limiter = rate_limit.RateLimiter()
+# Top rated songs per time window for /api/charts
+chart_board = charts.ChartBoard()
+# Local edge cache of the HLS stream for /hls/ (see --hls-origin)
+hls_edge = None
+# Bounds concurrent requests and queues the rest by priority (see --max-in-flight)
+admission_control = admission.AdmissionController(serving.DEFAULT_THREADS)
+# List endpoints that may be slowed or shed first under load
+BULK_PATHS = {'/api/users', '/api/posts', '/api/posts/published'}
+# Tables each list endpoint reads, for its change-counter ETag
+LIST_TABLES = {
+    '/api/users': ('users',),
+    '/api/posts': ('posts', 'users'),
+    '/api/posts/published': ('posts', 'users'),
+}
+# Monitoring and long-lived streams are never queued or shed
+UNADMITTED_PATHS = {'/metrics', '/api/events', '/api/admission/stats'}
+# Background rating rollups and vote archival (see --rollup-interval)
+rollup_job = None
+# Album art fetched once per track and served under content hashes (see --cover-url)
+album_art = None
+# Pushes track changes and rating counts to /api/events listeners
+event_broker = events.EventBroker()
+# Pages, stylesheets and images from the working directory (asset types only)
+static_assets = static_cache.StaticAssetCache()
+MAX_BATCH_SONGS = 50
+STATIC_EXTENSIONS = ('.html', '.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.ico')
+# Paths reported under their own route label in /metrics
+METRIC_ROUTES = {
+    '/', '/radio', '/api/users', '/api/posts', '/api/posts/published', '/api/posts/search',
+    '/api/now-playing', '/api/events', '/api/charts', '/api/ratings', '/api/ratings/batch',
+    '/api/ratings/song', '/api/ratings/stats', '/api/hls/stats', '/api/admission/stats',
+    '/metrics',
+}
+
+def get_db():
+    """Get the current thread's pooled database connection"""
+    return db_pool.get_pool(DATABASE).connection()
+
+def song_tally(title, artist):
+    """Cached (thumbs_up, thumbs_down) for a song"""
+    return rating_tallies.get_or_load(
+        (title, artist), lambda: ratings.fetch_tally(get_db(), title, artist))
+
+def route_label(path):
+    """Bounded route name for metrics: the API path, 'hls', 'static' or 'other'"""
+    path = urlparse(path).path
+    if path in METRIC_ROUTES:
+        return path
+    if path.startswith('/hls/'):
+        return 'hls'
+    if path.startswith('/api/cover'):
+        return '/api/cover'
+    if path.startswith('/static/') or path.endswith(STATIC_EXTENSIONS):
+        return 'static'
+    return 'other'
+
+def request_priority(command, path):
+    """Admission priority for a request, or None if it bypasses admission"""
+    path = urlparse(path).path
+    if path in UNADMITTED_PATHS:
+        return None
+    if path in BULK_PATHS and command == 'GET':
+        return admission.BULK
+    if (command == 'POST' and path != '/api/ratings/batch') or path in (
+            '/api/charts', '/api/posts/search'):
+        return admission.NORMAL
+    # Pages, static files, the stream and rating reads keep the player working
+    return admission.CRITICAL
+
+def tally_body(thumbs_up, thumbs_down):
+    return {'thumbs_up': thumbs_up, 'thumbs_down': thumbs_down, 'total': thumbs_up + thumbs_down}
+
+def now_playing_event(metadata):
+    """The current track together with its rating counts"""
+    title = metadata.get('title') or ''
+    artist = metadata.get('artist') or ''
+    tally = song_tally(title, artist) if title and artist else (0, 0)
+    body = {'track': metadata, 'ratings': tally_body(*tally)}
+    if album_art is not None:
+        body['cover'] = album_art.current((title, artist))
+    return body
+
+def publish_rating(title, artist):
+    """Let event stream listeners know a song's counts changed"""
+    thumbs_up, thumbs_down = song_tally(title, artist)
+    event_broker.publish_rating((title, artist), {
+        'song': {'title': title, 'artist': artist},
+        'ratings': tally_body(thumbs_up, thumbs_down)
+    })
 
 class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
+    def handle_one_request(self):
+        self.timer = metrics.RequestTimer()
+        self.status = None
+        self.response_size = None
+        self.admitted = False
+        try:
+            super().handle_one_request()
+        finally:
+            # Never leave a half-finished transaction on a pooled connection
+            db_pool.get_pool(DATABASE).release()
+            if self.admitted:
+                admission_control.release()
+            if self.timer.started is not None:
+                self.timer.finish(route_label(self.path), self.command, self.status,
+                                  self.response_size)
+    
+    def parse_request(self):
+        received = serving.received_at() or time.monotonic()
+        parsed = super().parse_request()
+        if parsed:
+            self.timer.start()
+            parsed = self.admit(received)
+        return parsed
+    
+    def admit(self, received):
+        """Wait for an admission slot; answer 503 and return False if shed"""
+        priority = request_priority(self.command, self.path)
+        if priority is None:
+            return True
+        deadline = admission.request_deadline(
+            received, self.headers.get(admission.TIMEOUT_HEADER),
+            admission_control.request_timeout)
+        try:
+            admission_control.admit(priority, deadline)
+        except admission.Shed as e:
+            self.close_connection = True  # any request body is left unread
+            self.send_json({'error': str(e)}, 503, {'Retry-After': str(e.retry_after)})
+            return False
+        self.admitted = True
+        return True
+    
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self.response_size = int(value)
+        super().send_header(keyword, value)
+    
     def do_GET(self):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
@@ -23,9 +200,31 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
             self.get_posts()
         elif path == '/api/posts/published':
             self.get_published_posts()
+        elif path == '/api/posts/search':
+            self.search_posts()
+        elif path == '/api/now-playing':
+            self.get_now_playing()
+        elif path == '/api/events':
+            self.get_events()
+        elif path == '/api/charts':
+            self.get_charts()
+        elif path == '/metrics':
+            self.send_metrics()
+        elif path.startswith('/hls/'):
+            self.get_hls(path[len('/hls/'):])
+        elif path == '/api/hls/stats':
+            self.get_hls_stats()
+        elif path == '/api/admission/stats':
+            self.send_json(admission_control.stats())
+        elif path == '/api/cover/stats':
+            self.get_cover_stats()
+        elif path == '/api/cover':
+            self.get_current_cover()
+        elif path.startswith('/api/cover/'):
+            self.get_cover(path[len('/api/cover/'):])
         elif path.startswith('/api/ratings/'):
             self.handle_ratings_get(path)
-        elif path.startswith('/static/') or path.endswith(('.html', '.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.ico')):
+        elif path.startswith('/static/') or path.endswith(STATIC_EXTENSIONS):
             self.serve_file(path.lstrip('/'))
         else:
             self.send_error(404, 'Not Found')
@@ -37,89 +236,218 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
             self.create_user()
         elif self.path == '/api/ratings':
             self.create_rating()
+        elif self.path == '/api/ratings/batch':
+            self.get_batch_ratings()
         else:
             self.send_error(404, 'Not Found')
     
-    def send_json(self, data, status=200):
+    def send_json(self, data, status=200, headers=None):
+        if status == 500 and admission.deadline_exceeded():
+            # SQLite was interrupted because the client stopped waiting
+            data, status, headers = {'error': 'Request deadline exceeded'}, 503, {'Retry-After': '1'}
+        body = json.dumps(data).encode()
+        gzipped = len(body) >= json_stream.MIN_GZIP_SIZE and self.accepts_gzip()
+        if gzipped:
+            body = json_stream.gzip_body(body)
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_json_stream(self, chunks, status=200, headers=None):
+        """Send JSON produced incrementally, chunk-encoded on HTTP/1.1"""
+        chunked = self.protocol_version == 'HTTP/1.1' and self.request_version == 'HTTP/1.1'
         self.send_response(status)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Vary', 'Accept-Encoding')
+        if self.accepts_gzip():
+            chunks = json_stream.gzip_chunks(chunks)
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # Without chunking the end of the body is the end of the connection
+            self.send_header('Connection', 'close')
+            self.close_connection = True
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        try:
+            for chunk in chunks:
+                self.response_size = (self.response_size or 0) + len(chunk)
+                if chunked:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # Headers are already out; all we can do is cut the response short
+            self.log_error('Streaming response aborted: %s', e)
+            self.close_connection = True
+    
+    def accepts_gzip(self):
+        return static_cache.accepts(self.headers.get('Accept-Encoding'), 'gzip')
+    
+    def list_validators(self, path, query):
+        """ETag headers for a list response, or None once a 304 has been sent"""
+        counters = table_versions.versions(get_db(), LIST_TABLES[path])
+        if counters is None:
+            return {}
+        headers = {'ETag': table_versions.list_etag(counters, path, query),
+                   'Cache-Control': 'no-cache'}
+        if table_versions.etag_matches(self.headers.get('If-None-Match'), headers['ETag']):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return None
+        return headers
     
     def serve_file(self, filepath):
         try:
-            with open(filepath, 'rb') as f:
-                content = f.read()
-            
+            asset = static_assets.get(filepath)
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            self.send_error(404, 'File not found')
+            return
+        
+        encoding = static_cache.choose_encoding(asset, self.headers.get('Accept-Encoding'))
+        if static_cache.not_modified(asset, self.headers):
+            self.send_response(304)
+            self.send_asset_headers(asset, encoding)
+            self.end_headers()
+            return
+        
+        if encoding:
+            body = asset.variants[encoding]
             self.send_response(200)
-            if filepath.endswith('.html'):
-                self.send_header('Content-type', 'text/html')
-            elif filepath.endswith('.css'):
-                self.send_header('Content-type', 'text/css')
-            elif filepath.endswith('.js'):
-                self.send_header('Content-type', 'application/javascript')
-            elif filepath.endswith('.png'):
-                self.send_header('Content-type', 'image/png')
-            elif filepath.endswith('.jpg') or filepath.endswith('.jpeg'):
-                self.send_header('Content-type', 'image/jpeg')
-            elif filepath.endswith('.gif'):
-                self.send_header('Content-type', 'image/gif')
-            elif filepath.endswith('.ico'):
-                self.send_header('Content-type', 'image/x-icon')
-            else:
-                self.send_header('Content-type', 'text/plain')
+            self.send_asset_headers(asset, encoding)
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(content)
-        except FileNotFoundError:
-            self.send_error(404, 'File not found')
+            self.wfile.write(body)
+            return
+        
+        try:
+            byte_range = static_cache.parse_range(self.headers.get('Range'), asset.size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{asset.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if_range = self.headers.get('If-Range')
+        if byte_range and if_range and if_range.strip() != asset.etag:
+            byte_range = None
+        
+        if byte_range:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{asset.size}')
+        else:
+            start, end = 0, asset.size - 1
+            self.send_response(200)
+        length = end - start + 1
+        self.send_asset_headers(asset)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if asset.body is not None:
+            self.wfile.write(asset.body[start:end + 1])
+        elif length > 0:
+            self.send_file_range(asset.path, start, length)
+    
+    def send_asset_headers(self, asset, encoding=None):
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('ETag', asset.etag_for(encoding))
+        self.send_header('Last-Modified', asset.last_modified)
+        self.send_header('Cache-Control', asset.cache_control)
+        self.send_header('Accept-Ranges', 'bytes')
+        if asset.variants:
+            self.send_header('Vary', 'Accept-Encoding')
+    
+    def send_file_range(self, path, offset, count):
+        """Send part of a file, zero-copy via sendfile when we own the socket"""
+        with open(path, 'rb') as f:
+            sock = getattr(self, 'connection', None)
+            if sock is not None:
+                self.wfile.flush()
+                sock.sendfile(f, offset, count)
+                return
+            f.seek(offset)
+            while count > 0:
+                chunk = f.read(min(count, 65536))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                count -= len(chunk)
     
     def get_users(self):
+        parsed = urlparse(self.path)
+        params = listings.query_params(parsed.query)
         try:
-            conn = sqlite3.connect('database.db')
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, email, name, created_at FROM users ORDER BY created_at DESC')
-            users = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            self.send_json({'users': users})
+            page = listings.parse_page(params)
+            fields = listings.parse_fields(params, listings.USER_FIELDS)
+        except ValueError as e:
+            self.send_json({'error': str(e)}, 400)
+            return
+        try:
+            headers = self.list_validators(parsed.path, parsed.query)
+            if headers is None:
+                return
+            if page.unpaginated:
+                self.send_json_stream(json_stream.encode_list(
+                    'users', listings.stream_users(get_db(), fields)), headers=headers)
+                return
+            users, next_cursor = listings.list_users(get_db(), page, fields)
+            self.send_json(listings.list_response('users', users, next_cursor, page),
+                           headers=headers)
         except Exception as e:
             self.send_json({'error': str(e)}, 500)
     
-    def get_posts(self):
+    def get_posts(self, published_only=False):
+        parsed = urlparse(self.path)
+        params = listings.query_params(parsed.query)
         try:
-            conn = sqlite3.connect('database.db')
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT p.id, p.title, p.content, p.published, p.created_at,
-                       u.name as author_name, u.email as author_email
-                FROM posts p
-                LEFT JOIN users u ON p.author_id = u.id
-                ORDER BY p.created_at DESC
-            ''')
-            posts = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            self.send_json({'posts': posts})
+            page = listings.parse_page(params)
+            fields = listings.parse_fields(params, listings.PUBLISHED_POST_FIELDS
+                                           if published_only else listings.POST_FIELDS)
+        except ValueError as e:
+            self.send_json({'error': str(e)}, 400)
+            return
+        try:
+            headers = self.list_validators(parsed.path, parsed.query)
+            if headers is None:
+                return
+            if page.unpaginated:
+                self.send_json_stream(json_stream.encode_list(
+                    'posts', listings.stream_posts(get_db(), published_only, fields)),
+                    headers=headers)
+                return
+            posts, next_cursor = listings.list_posts(get_db(), page, published_only, fields)
+            self.send_json(listings.list_response('posts', posts, next_cursor, page),
+                           headers=headers)
         except Exception as e:
             self.send_json({'error': str(e)}, 500)
     
     def get_published_posts(self):
+        self.get_posts(published_only=True)
+    
+    def search_posts(self):
+        """Full-text search over post titles and content (?q=&limit=&offset=&published=)"""
         try:
-            conn = sqlite3.connect('database.db')
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT p.id, p.title, p.content, p.created_at,
-                       u.name as author_name, u.email as author_email
-                FROM posts p
-                LEFT JOIN users u ON p.author_id = u.id
-                WHERE p.published = 1
-                ORDER BY p.created_at DESC
-            ''')
-            posts = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            self.send_json({'posts': posts})
+            body, status = search.search_response(
+                get_db(), listings.query_params(urlparse(self.path).query))
+            self.send_json(body, status)
         except Exception as e:
             self.send_json({'error': str(e)}, 500)
     
@@ -133,7 +461,7 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
                 self.send_json({'error': 'Title and author_id are required'}, 400)
                 return
             
-            conn = sqlite3.connect('database.db')
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute(
                 'INSERT INTO posts (title, content, author_id, published) VALUES (?, ?, ?, ?)',
@@ -141,7 +469,6 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
             )
             conn.commit()
             post_id = cursor.lastrowid
-            conn.close()
             
             self.send_json({'message': 'Post created successfully', 'post_id': post_id}, 201)
         except Exception as e:
@@ -160,7 +487,7 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
             # Simple password hash (in production, use proper hashing)
             password_hash = data.get('password', 'default_password')
             
-            conn = sqlite3.connect('database.db')
+            conn = get_db()
             cursor = conn.cursor()
             try:
                 cursor.execute(
@@ -169,15 +496,169 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
                 )
                 conn.commit()
                 user_id = cursor.lastrowid
-                conn.close()
                 
                 self.send_json({'message': 'User created successfully', 'user_id': user_id}, 201)
             except sqlite3.IntegrityError:
-                conn.close()
+                conn.rollback()
                 self.send_json({'error': 'Email already exists'}, 409)
         except Exception as e:
             self.send_json({'error': str(e)}, 500)
     
+    def get_now_playing(self):
+        """Current track from the metadata poller, with its rating counts"""
+        metadata = now_playing_poller.metadata if now_playing_poller is not None else None
+        if metadata is None:
+            self.send_json({'error': 'Now playing metadata is not available'}, 503)
+            return
+        try:
+            body = now_playing_event(metadata)
+            body['updated_at'] = now_playing_poller.updated_at
+            body['changed_at'] = now_playing_poller.changed_at
+            self.send_json(body)
+        except Exception as e:
+            self.send_json({'error': str(e)}, 500)
+    
+    def get_hls(self, name):
+        """Serve a playlist or media segment from the edge cache"""
+        if hls_edge is None:
+            self.send_error(404, 'HLS edge cache is not enabled')
+            return
+        if not hls_cache.valid_path(name):
+            self.send_error(400, 'Invalid stream path')
+            return
+        try:
+            entry = hls_edge.get(name)
+        except hls_cache.UpstreamError as e:
+            self.send_error(e.status, str(e))
+            return
+        max_age = max(int(entry.ttl - (time.time() - entry.fetched_at)), 0)
+        cache_control = 'public, max-age=%d' % (max_age if hls_cache.is_playlist(name)
+                                                  else int(entry.ttl))
+        etag = f'"{entry.etag}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', entry.content_type)
+        self.send_header('Content-Length', str(len(entry.body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(entry.body)
+    
+    def get_hls_stats(self):
+        """Hit, miss and collapsed-fetch counters for the HLS edge cache"""
+        if hls_edge is None:
+            self.send_json({'error': 'HLS edge cache is not enabled'}, 404)
+            return
+        self.send_json(hls_edge.stats())
+    
+    def get_current_cover(self):
+        """Redirect to the current track's cover (?size= picks a thumbnail)"""
+        if album_art is None:
+            self.send_error(404, 'Album art proxy is not enabled')
+            return
+        metadata = now_playing_poller.metadata if now_playing_poller is not None else None
+        track = ((metadata.get('title') or '', metadata.get('artist') or '')
+                 if metadata else None)
+        urls = album_art.current(track)
+        if urls is None:
+            self.send_error(503, 'Album art is not available')
+            return
+        size = self.parse_query_params().get('size', [None])[0]
+        location = urls['sizes'].get(size, urls['original'])
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def get_cover(self, name):
+        """Serve a content-hashed cover image; its URL never changes meaning"""
+        variant = album_art.variant(name) if album_art is not None else None
+        if variant is None:
+            self.send_error(404, 'Cover not found')
+            return
+        not_modified = self.headers.get('If-None-Match') == variant.etag
+        if not_modified:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', variant.content_type)
+            self.send_header('Content-Length', str(len(variant.body)))
+        self.send_header('ETag', variant.etag)
+        self.send_header('Cache-Control', cover_art.IMMUTABLE)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(variant.body)
+    
+    def get_cover_stats(self):
+        """Origin fetch and cache counters for the album art proxy"""
+        if album_art is None:
+            self.send_json({'error': 'Album art proxy is not enabled'}, 404)
+            return
+        self.send_json(album_art.stats())
+    
+    def send_metrics(self):
+        """Prometheus text exposition of this process's metrics"""
+        body = metrics.REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def get_charts(self):
+        """Top rated songs for ?window=hour|day|week|month|all"""
+        if ratings.storage != ratings.NORMALIZED:
+            self.send_json({'error': 'Charts require normalized rating storage (run migrate_songs.py)'}, 503)
+            return
+        query_params = self.parse_query_params()
+        window = query_params.get('window', [charts.DEFAULT_WINDOW])[0]
+        if window not in charts.WINDOWS:
+            self.send_json({'error': f"window must be one of {', '.join(charts.WINDOWS)}"}, 400)
+            return
+        try:
+            limit = int(query_params.get('limit', [charts.DEFAULT_LIMIT])[0])
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= charts.MAX_LIMIT:
+            self.send_json({'error': f'limit must be between 1 and {charts.MAX_LIMIT}'}, 400)
+            return
+        try:
+            self.send_json({'window': window, 'songs': chart_board.top(get_db(), window, limit)})
+        except Exception as e:
+            self.send_json({'error': str(e)}, 500)
+    
+    def get_events(self):
+        """Server-Sent Events: track_changed and ratings_updated"""
+        if not getattr(self.server, 'supports_takeover', False):
+            self.send_json({'error': 'Event stream requires --mode asyncio'}, 503)
+            return
+        if now_playing_poller is None:
+            # No track_changed would ever arrive; make the player keep polling
+            self.send_json({'error': 'Event stream requires --metadata-url'}, 503)
+            return
+        initial = []
+        if now_playing_poller.metadata is not None:
+            initial.append(('track_changed', now_playing_event(now_playing_poller.metadata)))
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # The stream ends when either side closes the connection
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(event_broker.preamble(initial))
+        self.close_connection = True
+        self.takeover = event_broker.hold
+    
     def handle_ratings_get(self, path):
         """Handle GET requests for ratings"""
         path_parts = path.split('/')
@@ -192,6 +673,15 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
                 return
                 
             self.get_song_ratings(title, artist)
+        elif len(path_parts) >= 4 and path_parts[3] == 'stats':
+            # GET /api/ratings/stats - tally cache and write queue counters
+            self.send_json({
+                'cache': rating_tallies.stats(),
+                'charts': chart_board.stats(),
+                'rate_limit': vote_limiter.stats(),
+                'rollups': rollup_job.stats() if rollup_job is not None else None,
+                'write_queue': rating_writer.stats() if rating_writer is not None else None
+            })
         else:
             self.send_error(404, 'Not Found')
     
@@ -204,36 +694,44 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
     def get_song_ratings(self, title, artist):
         """Get ratings for a specific song"""
         try:
-            conn = sqlite3.connect('database.db')
-            cursor = conn.cursor()
-            
-            # Get thumbs up count
-            cursor.execute(
-                'SELECT COUNT(*) FROM song_ratings WHERE song_title = ? AND song_artist = ? AND rating = 1',
-                (title, artist)
-            )
-            thumbs_up = cursor.fetchone()[0]
-            
-            # Get thumbs down count
-            cursor.execute(
-                'SELECT COUNT(*) FROM song_ratings WHERE song_title = ? AND song_artist = ? AND rating = -1',
-                (title, artist)
-            )
-            thumbs_down = cursor.fetchone()[0]
-            
-            conn.close()
+            thumbs_up, thumbs_down = song_tally(title, artist)
             
             self.send_json({
                 'song': {'title': title, 'artist': artist},
-                'ratings': {
-                    'thumbs_up': thumbs_up,
-                    'thumbs_down': thumbs_down,
-                    'total': thumbs_up + thumbs_down
-                }
+                'ratings': tally_body(thumbs_up, thumbs_down)
             })
         except Exception as e:
             self.send_json({'error': str(e)}, 500)
     
+    def get_batch_ratings(self):
+        """Get ratings for many songs at once (e.g. the recently played list)"""
+        try:
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+            data = json.loads(post_data.decode('utf-8'))
+            
+            songs = data.get('songs') if isinstance(data, dict) else None
+            if not isinstance(songs, list) or not songs or \
+                    not all(isinstance(song, dict) and song.get('title') and song.get('artist')
+                            for song in songs):
+                self.send_json({'error': 'songs must be a list of {title, artist} objects'}, 400)
+                return
+            if len(songs) > MAX_BATCH_SONGS:
+                self.send_json({'error': f'At most {MAX_BATCH_SONGS} songs per request'}, 400)
+                return
+            
+            keys = [(song['title'], song['artist']) for song in songs]
+            tallies = rating_tallies.get_many_or_load(
+                keys, lambda missing: ratings.fetch_tallies(get_db(), missing))
+            
+            self.send_json({'songs': [
+                {'song': {'title': title, 'artist': artist},
+                 'ratings': tally_body(*tallies.get((title, artist), (0, 0)))}
+                for title, artist in keys
+            ]})
+        except Exception as e:
+            self.send_json({'error': str(e)}, 500)
+    
     def create_rating(self):
         """Create or update a song rating"""
         try:
@@ -254,34 +752,57 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
                 self.send_json({'error': 'Title, artist, and rating (1 or -1) are required'}, 400)
                 return
             
-            conn = sqlite3.connect('database.db')
-            cursor = conn.cursor()
+            # Turn floods away before they become write load
+            reason, retry_after = vote_limiter.check(self.get_client_ip(), user_id)
+            if reason is not None:
+                metrics.votes_rejected.inc(reason)
+                self.send_json({'error': 'Too many ratings, slow down'}, 429,
+                               {'Retry-After': str(math.ceil(retry_after))})
+                return
+            if vote_limiter.is_duplicate(user_id, title, artist, rating):
+                metrics.votes_rejected.inc('duplicate')
+                self.send_json({'message': 'Rating unchanged'}, 200)
+                return
             
-            try:
-                # Try to insert new rating
-                cursor.execute(
-                    '''INSERT INTO song_ratings (song_title, song_artist, song_album, user_identifier, rating) 
-                       VALUES (?, ?, ?, ?, ?)''',
-                    (title, artist, album, user_id, rating)
-                )
-                conn.commit()
-                
+            vote = (title, artist, album, user_id, rating)
+            if rating_writer is not None:
+                try:
+                    future = rating_writer.submit(vote)
+                except (queue.Full, rating_queue.QueueClosed):
+                    future = None  # backlog is full or shutting down; write this one directly
+                if future is not None and not rating_writer.waits_for_commit:
+                    vote_limiter.remember(user_id, title, artist, rating)
+                    self.send_json({'message': 'Rating accepted'}, 202)
+                    return
+            else:
+                future = None
+            
+            if future is not None:
+                try:
+                    previous = future.result(rating_writer.result_timeout)
+                except rating_queue.QueueClosed:
+                    future = None  # shut down before reaching it; write it directly
+                except concurrent.futures.TimeoutError:
+                    # Still queued and will commit; repeating it is harmless
+                    self.send_json({'error': 'Rating not committed yet, retry'}, 503,
+                                   {'Retry-After': '1'})
+                    return
+            if future is None:
+                rating_tallies.begin_write((title, artist))
+                try:
+                    previous = ratings.submit_rating(get_db(), *vote)
+                except Exception:
+                    rating_tallies.end_write((title, artist))
+                    raise
+                rating_tallies.apply((title, artist), previous, rating)
+                publish_rating(title, artist)
+            vote_limiter.remember(user_id, title, artist, rating)
+            
+            if previous is None:
                 self.send_json({'message': 'Rating submitted successfully'}, 201)
-                
-            except sqlite3.IntegrityError:
-                # User already rated this song - update the rating
-                cursor.execute(
-                    '''UPDATE song_ratings 
-                       SET rating = ?, created_at = CURRENT_TIMESTAMP 
-                       WHERE song_title = ? AND song_artist = ? AND user_identifier = ?''',
-                    (rating, title, artist, user_id)
-                )
-                conn.commit()
-                
+            else:
                 self.send_json({'message': 'Rating updated successfully'}, 200)
             
-            conn.close()
-            
         except Exception as e:
             self.send_json({'error': str(e)}, 500)
     
@@ -331,21 +852,239 @@ class RadioCalioHandler(http.server.BaseHTTPRequestHandler):
         # Fall back to direct connection IP
         return self.client_address[0]
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='RadioCalico HTTP server')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--mode', choices=serving.MODES, default='single',
+                        help='single (default), threaded or asyncio')
+    parser.add_argument('--threads', type=int, default=serving.DEFAULT_THREADS,
+                        help='Handler pool size for threaded and asyncio modes')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes sharing the port via SO_REUSEPORT')
+    parser.add_argument('--rating-cache-size', type=int,
+                        default=rating_cache.DEFAULT_MAX_ENTRIES,
+                        help='Songs kept in the in-memory rating tally cache')
+    parser.add_argument('--rating-cache-mb', type=float,
+                        default=rating_cache.DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help='Memory cap for the rating tally cache')
+    parser.add_argument('--rating-cache-ttl', type=float, default=None,
+                        help='Seconds before a cached tally is re-read '
+                             '(default: never, or 5 s with --workers > 1)')
+    parser.add_argument('--rating-write-behind', default='off',
+                        choices=('off',) + rating_queue.DURABILITY_LEVELS,
+                        help='Batch rating writes: async answers 202 at once, '
+                             'group/full wait for the batch commit')
+    parser.add_argument('--flush-ms', type=float,
+                        default=rating_queue.DEFAULT_FLUSH_INTERVAL * 1000,
+                        help='Write-behind flush interval in milliseconds')
+    parser.add_argument('--metadata-url', default='',
+                        help='Upstream now-playing JSON to poll for /api/now-playing, e.g. '
+                             f'{now_playing.DEFAULT_METADATA_URL} (default: off)')
+    parser.add_argument('--metadata-interval', type=float,
+                        default=now_playing.DEFAULT_INTERVAL,
+                        help='Seconds between now-playing metadata polls')
+    parser.add_argument('--event-rating-interval', type=float,
+                        default=events.DEFAULT_RATING_INTERVAL,
+                        help='Minimum seconds between ratings_updated events per song')
+    parser.add_argument('--flush-rows', type=int, default=rating_queue.DEFAULT_FLUSH_ROWS,
+                        help='Write-behind flush after this many votes')
+    parser.add_argument('--chart-refresh', type=float, default=charts.DEFAULT_REFRESH,
+                        help='Seconds a ranked /api/charts list is served before re-ranking')
+    parser.add_argument('--rollup-interval', type=float, default=rollups.DEFAULT_INTERVAL,
+                        help='Seconds between rating rollup passes (0 to disable)')
+    parser.add_argument('--hourly-days', type=int, default=rollups.DEFAULT_HOURLY_DAYS,
+                        help='Days of hour buckets kept before folding them into days')
+    parser.add_argument('--vote-days', type=int, default=rollups.DEFAULT_VOTE_DAYS,
+                        help='Days of votes kept in song_votes before archiving (0 keeps all)')
+    parser.add_argument('--metrics-sample', type=float, default=1.0,
+                        help='Fraction of requests and SQL statements timed for /metrics '
+                             '(0 disables timing; counters stay exact)')
+    parser.add_argument('--vote-rate', type=float, default=rate_limit.DEFAULT_LISTENER_RATE,
+                        help='Votes per second each listener may sustain (0 disables)')
+    parser.add_argument('--vote-burst', type=int, default=rate_limit.DEFAULT_LISTENER_BURST,
+                        help='Votes a listener may cast back to back')
+    parser.add_argument('--ip-vote-rate', type=float, default=rate_limit.DEFAULT_IP_RATE,
+                        help='Votes per second each client IP may sustain (0 disables)')
+    parser.add_argument('--ip-vote-burst', type=int, default=rate_limit.DEFAULT_IP_BURST,
+                        help='Votes an IP may cast back to back')
+    parser.add_argument('--vote-dedup-window', type=float,
+                        default=rate_limit.DEFAULT_DEDUP_WINDOW,
+                        help='Seconds an identical repeat vote is answered without a write')
+    parser.add_argument('--rate-limit-keys', type=int, default=rate_limit.DEFAULT_MAX_KEYS,
+                        help='IPs, listeners and recent votes tracked before evicting')
+    parser.add_argument('--hls-origin', default=None,
+                        help='Serve /hls/ from a local cache of this HLS origin, e.g. '
+                             f'{hls_cache.DEFAULT_ORIGIN} or a local stand-in '
+                             '(off by default)')
+    parser.add_argument('--hls-cache-dir', default=hls_cache.DEFAULT_CACHE_DIR,
+                        help="On-disk segment cache shared by workers ('' for memory only)")
+    parser.add_argument('--hls-cache-mb', type=float,
+                        default=hls_cache.DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help='Memory for cached playlists and segments')
+    parser.add_argument('--hls-disk-mb', type=float,
+                        default=hls_cache.DEFAULT_MAX_DISK_BYTES / (1024 * 1024),
+                        help='Disk for cached segments')
+    parser.add_argument('--cover-url', default='',
+                        help='Album art to proxy at /api/cover, e.g. '
+                             f'{cover_art.DEFAULT_COVER_URL} (default: off)')
+    parser.add_argument('--cover-dir', default=cover_art.DEFAULT_CACHE_DIR,
+                        help='Where cover images and thumbnails are stored')
+    parser.add_argument('--cover-refresh', type=float, default=cover_art.DEFAULT_REFRESH,
+                        help='Seconds between conditional checks of the cover during a track')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Requests handled at once; more wait in the admission queue '
+                             '(default: three quarters of --threads)')
+    parser.add_argument('--max-queue', type=int, default=admission.DEFAULT_MAX_QUEUE,
+                        help='Requests that may wait for admission before 503s')
+    parser.add_argument('--queue-timeout', type=float, default=admission.DEFAULT_QUEUE_TIMEOUT,
+                        help='Seconds a request may wait for admission')
+    parser.add_argument('--request-timeout', type=float,
+                        default=admission.DEFAULT_REQUEST_TIMEOUT,
+                        help='Default request deadline in seconds (clients may send a '
+                             f'shorter {admission.TIMEOUT_HEADER})')
+    parser.add_argument('--max-pending', type=int, default=serving.DEFAULT_MAX_PENDING,
+                        help='Connections or requests waiting for a thread before 503s')
+    return parser.parse_args()
+
+def configure(args):
+    """Apply command line settings to this process's shared state"""
+    global rating_tallies, rating_writer, now_playing_poller, event_broker, chart_board
+    global vote_limiter, hls_edge, album_art, admission_control, rollup_job
+    metrics.configure(sample_rate=args.metrics_sample)
+    db_pool.set_connection_factory(metrics.InstrumentedConnection)
+    db_pool.add_connect_hook(admission.install)
+    max_in_flight = args.max_in_flight
+    if max_in_flight is None:
+        max_in_flight = 1 if args.mode == 'single' else max(1, args.threads * 3 // 4)
+    admission_control = admission.AdmissionController(
+        max_in_flight, max_queue=args.max_queue, queue_timeout=args.queue_timeout,
+        request_timeout=args.request_timeout)
+    conn = get_db()
+    ratings.use_storage(ratings.detect_storage(conn), archive=ratings.detect_vote_archive(conn))
+    ttl = args.rating_cache_ttl
+    if ttl is None and args.workers > 1:
+        # Other workers' votes only reach this cache when entries expire
+        ttl = 5.0
+    rating_tallies = rating_cache.RatingCache(
+        max_entries=args.rating_cache_size,
+        max_bytes=int(args.rating_cache_mb * 1024 * 1024),
+        ttl=ttl)
+    event_broker = events.EventBroker(rating_interval=args.event_rating_interval)
+    chart_board = charts.ChartBoard(refresh=args.chart_refresh)
+    vote_limiter = rate_limit.RateLimiter(
+        ip_rate=args.ip_vote_rate, ip_burst=args.ip_vote_burst,
+        listener_rate=args.vote_rate, listener_burst=args.vote_burst,
+        dedup_window=args.vote_dedup_window, max_keys=args.rate_limit_keys)
+    if args.cover_url:
+        album_art = cover_art.CoverArt(args.cover_url, cache_dir=args.cover_dir,
+                                       refresh=args.cover_refresh)
+        album_art.start()
+    if args.hls_origin:
+        hls_edge = hls_cache.HlsCache(
+            args.hls_origin, cache_dir=args.hls_cache_dir or None,
+            max_bytes=int(args.hls_cache_mb * 1024 * 1024),
+            max_disk_bytes=int(args.hls_disk_mb * 1024 * 1024))
+    static_assets.warm(name for name in os.listdir('.') if name.endswith(STATIC_EXTENSIONS))
+    if args.rating_write_behind != 'off':
+        rating_writer = rating_queue.RatingWriteQueue(
+            db_pool.get_pool(DATABASE),
+            flush_interval=args.flush_ms / 1000,
+            flush_rows=args.flush_rows,
+            durability=args.rating_write_behind,
+            on_begin=begin_vote_writes, on_commit=apply_committed_votes,
+            on_abort=abort_vote_writes)
+        rating_writer.start()
+    if args.rollup_interval > 0 and ratings.storage == ratings.NORMALIZED:
+        if rollups.has_rollups(conn):
+            rollup_job = rollups.RollupJob(DATABASE, interval=args.rollup_interval,
+                                           hourly_days=args.hourly_days, vote_days=args.vote_days)
+            rollup_job.start()
+        else:
+            print("Rating rollups are off until 'python3 rollups.py setup' has run.")
+    if args.metadata_url:
+        now_playing_poller = now_playing.NowPlayingPoller(
+            args.metadata_url, interval=args.metadata_interval)
+        now_playing_poller.add_listener(announce_track)
+        now_playing_poller.start()
+
+def announce_track(old_track, new_track, metadata):
+    """Look up the new track's tally once and push it to event listeners"""
+    if album_art is not None:
+        album_art.update(new_track)  # on the poller's thread, not a request's
+    event_broker.publish('track_changed', now_playing_event(metadata))
+
+def begin_vote_writes(votes):
+    """Hold back tally cache fills for a write-behind batch about to commit"""
+    for vote in votes:
+        rating_tallies.begin_write((vote[0], vote[1]))
+
+def abort_vote_writes(votes):
+    for vote in votes:
+        rating_tallies.end_write((vote[0], vote[1]))
+
+def apply_committed_votes(votes, previous):
+    """Fold a committed write-behind batch into the tally cache"""
+    for (title, artist, album, user_id, rating), old in zip(votes, previous):
+        rating_tallies.apply((title, artist), old, rating)
+    for title, artist in {(vote[0], vote[1]) for vote in votes}:
+        publish_rating(title, artist)
+
+def serve(args, reuse_port=False):
+    """Run one server until it is interrupted or receives SIGTERM"""
+    configure(args)
+    httpd = serving.make_server(args.mode, ("", args.port), RadioCalioHandler,
+                                threads=args.threads, reuse_port=reuse_port,
+                                max_pending=args.max_pending)
+
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it cannot
+        # run on the thread that is serving
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if now_playing_poller is not None:
+            now_playing_poller.stop()
+        if album_art is not None:
+            album_art.stop()
+        if rating_writer is not None:
+            rating_writer.close()
+        if rollup_job is not None:
+            rollup_job.stop()
+
 if __name__ == "__main__":
-    with socketserver.TCPServer(("", PORT), RadioCalioHandler) as httpd:
-        print(f"Starting server at http://localhost:{PORT}")
-        print("Available endpoints:")
-        print("  GET  / - Server status")
-        print("  GET  /api/users - All users")
-        print("  GET  /api/posts - All posts")
-        print("  GET  /api/posts/published - Published posts only")
-        print("  POST /api/posts - Create new post")
-        print("  POST /api/users - Create new user")
-        print("\nTest in browser:")
-        print(f"  http://localhost:{PORT}")
-        print(f"  http://localhost:{PORT}/api/users")
-        print(f"  http://localhost:{PORT}/api/posts")
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\nServer stopped.")
\ No newline at end of file
+    args = parse_args()
+    print(f"Starting server at http://localhost:{args.port} ({args.mode} mode"
+          f", {args.workers} worker{'s' if args.workers != 1 else ''})")
+    print("Available endpoints:")
+    print("  GET  / - Server status")
+    print("  GET  /api/users - All users")
+    print("  GET  /api/posts - All posts")
+    print("  GET  /api/posts/published - Published posts only")
+    print("  GET  /api/posts/search?q= - Full-text post search")
+    print("  GET  /api/now-playing - Current track with rating counts")
+    print("  GET  /api/events - Live track and rating events (asyncio mode)")
+    print("  GET  /api/charts - Top rated songs per hour, day, week, month or all time")
+    print("  GET  /api/cover?size= - Current album art (content-hashed, cached)")
+    print("  GET  /api/admission/stats - In-flight, queued and shed request counts")
+    print("  GET  /metrics - Prometheus metrics")
+    if args.hls_origin:
+        print(f"  GET  /hls/live.m3u8 - HLS stream cached from {args.hls_origin}")
+        print("  GET  /api/hls/stats - HLS edge cache counters")
+    print("  POST /api/posts - Create new post")
+    print("  POST /api/users - Create new user")
+    print("  POST /api/ratings/batch - Ratings for many songs at once")
+    print("\nTest in browser:")
+    print(f"  http://localhost:{args.port}")
+    print(f"  http://localhost:{args.port}/api/users")
+    print(f"  http://localhost:{args.port}/api/posts")
+    if args.workers > 1:
+        prefork.run(args.workers, lambda: serve(args, reuse_port=True))
+    else:
+        serve(args)
+    print("\nServer stopped.")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""In-memory static asset cache for simple_server.py.
+
+Small files (the HTML pages and stylesheets) are held in memory together
+with gzip and, when the optional brotli module is installed, brotli
+variants computed once.  Large files such as RadioCalicoLayout.png only
+keep their metadata and are streamed with os.sendfile.  Every asset gets
+a strong content-hash ETag and Last-Modified header; compressed variants
+get the same ETag suffixed with their content-coding, since their bytes
+differ.  Entries are reloaded when the file's mtime or size changes.
+"""
+import email.utils
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants without it
+    brotli = None
+
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.ico': 'image/x-icon',
+}
+
+COMPRESSIBLE = ('.html', '.css', '.js', '.txt', '.svg', '.json')
+
+# HTML must be revalidated so new deploys show up; everything else may be
+# reused for an hour and then revalidated cheaply with a 304
+CACHE_CONTROL = {
+    '.html': 'no-cache',
+}
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+
+INLINE_LIMIT = 256 * 1024        # larger files are sent with sendfile
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+MIN_COMPRESS_SIZE = 512
+
+
+class Asset:
+    """Metadata (and for small files, content) of one static file"""
+
+    def __init__(self, path, stat, etag, body):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.etag = etag
+        self.body = body          # None for files served via sendfile
+        self.variants = {}        # content-coding -> compressed body
+        ext = os.path.splitext(path)[1].lower()
+        self.content_type = CONTENT_TYPES.get(ext, 'text/plain')
+        self.cache_control = CACHE_CONTROL.get(ext, DEFAULT_CACHE_CONTROL)
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.mtime = int(stat.st_mtime)
+
+    def compress(self):
+        if self.body is None or len(self.body) < MIN_COMPRESS_SIZE:
+            return
+        if not self.path.lower().endswith(COMPRESSIBLE):
+            return
+        self.variants['gzip'] = gzip.compress(self.body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body)
+
+    def etag_for(self, coding=None):
+        """Strong ETag of the identity body, or of its variant in coding"""
+        if coding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{coding}"'
+
+    def memory(self):
+        return (len(self.body) if self.body is not None else 0) + \
+            sum(len(v) for v in self.variants.values())
+
+
+class StaticAssetCache:
+    def __init__(self, root='.', max_bytes=DEFAULT_MAX_BYTES, inline_limit=INLINE_LIMIT):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.inline_limit = inline_limit
+        self._assets = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, filepath):
+        """Map a request path to a public asset under root, or None.
+
+        Root is the server's working directory, which also holds the
+        database and the source, so only files with an asset extension are
+        served and any '..', '.' or hidden path segment is refused.
+        """
+        parts = filepath.replace('\\', '/').split('/')
+        if any(not part or part.startswith('.') for part in parts):
+            return None
+        if os.path.splitext(parts[-1])[1].lower() not in CONTENT_TYPES:
+            return None
+        full = os.path.abspath(os.path.join(self.root, *parts))
+        if not full.startswith(self.root + os.sep):
+            return None
+        return full
+
+    def get(self, filepath):
+        """Return an up-to-date Asset, or raise FileNotFoundError"""
+        full = self.resolve(filepath)
+        if full is None:
+            raise FileNotFoundError(filepath)
+        stat = os.stat(full)
+        asset = self._assets.get(full)
+        if asset is not None and asset.mtime_ns == stat.st_mtime_ns \
+                and asset.size == stat.st_size:
+            return asset
+        return self._load(full, stat)
+
+    def warm(self, filepaths):
+        """Load and precompress assets ahead of the first request"""
+        for filepath in filepaths:
+            try:
+                self.get(filepath)
+            except OSError:
+                pass
+
+    def _load(self, full, stat):
+        digest = hashlib.sha256()
+        inline = stat.st_size <= self.inline_limit
+        chunks = []
+        with open(full, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+                if inline:
+                    chunks.append(chunk)
+        etag = '"%s"' % digest.hexdigest()[:32]
+        asset = Asset(full, stat, etag, b''.join(chunks) if inline else None)
+        asset.compress()
+        with self._lock:
+            old = self._assets.pop(full, None)
+            if old is not None:
+                self._bytes -= old.memory()
+            if self._bytes + asset.memory() > self.max_bytes:
+                # Over budget: keep the metadata, stream the file from disk
+                asset.body = None
+                asset.variants = {}
+            self._assets[full] = asset
+            self._bytes += asset.memory()
+        return asset
+
+
+def not_modified(asset, headers):
+    """Evaluate If-None-Match / If-Modified-Since against an asset"""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        known = {asset.etag_for(coding) for coding in (None, *asset.variants)}
+        return any(tag.strip().removeprefix('W/') in known for tag in if_none_match.split(','))
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return since is not None and asset.mtime <= since.timestamp()
+    return False
+
+
+def accepted_codings(accept_encoding):
+    """Content-coding -> q value from an Accept-Encoding header"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def accepts(accept_encoding, coding):
+    """True if an Accept-Encoding header allows coding"""
+    accepted = accepted_codings(accept_encoding)
+    return accepted.get(coding, accepted.get('*', 0)) > 0
+
+
+def choose_encoding(asset, accept_encoding):
+    """Pick the best precomputed variant the client accepts, or None"""
+    if not asset.variants or not accept_encoding:
+        return None
+    accepted = accepted_codings(accept_encoding)
+    for coding in ('br', 'gzip'):
+        if coding in asset.variants and accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+def parse_range(range_header, size):
+    """Parse a single 'bytes=' range into (start, end) inclusive.
+
+    Returns None when the header should be ignored (absent, malformed or
+    multi-range) and raises ValueError when it cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    spec = range_header[len('bytes='):].strip()
+    if ',' in spec:
+        return None
+    start, sep, end = spec.partition('-')
+    if not sep:
+        return None
+    try:
+        first = int(start) if start else None
+        last = int(end) if end else None
+    except ValueError:
+        return None
+    if first is None:
+        if last is None:
+            return None
+        if last == 0:
+            raise ValueError('range not satisfiable')
+        first, last = max(size - last, 0), size - 1   # suffix range: last N bytes
+    else:
+        last = size - 1 if last is None else min(last, size - 1)
+    if first >= size or first > last:
+        raise ValueError('range not satisfiable')
+    return first, last
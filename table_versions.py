@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Per-table change counters for conditional GETs on the list endpoints.
+
+table_versions holds one counter per tracked table, and triggers bump it
+on every insert, update and delete, whichever process or tool made the
+change.  A list response's ETag is built from the counters of the tables
+it reads plus the request's path and query, so a client revalidating with
+If-None-Match costs one primary-key lookup and a 304 while nothing has
+changed, without running the list query.  The ETags are weak because the
+same data may be sent gzip-compressed or not.
+"""
+import hashlib
+import sqlite3
+
+TRACKED_TABLES = ('users', 'posts')
+
+VERSIONS_TABLE = '''
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID'''
+
+
+def _triggers(table):
+    return {
+        f'{table}_version_{event.lower()}': f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+        END'''
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    }
+
+
+VERSION_TRIGGERS = {name: statement for table in TRACKED_TABLES
+                    for name, statement in _triggers(table).items()}
+
+
+def has_version_tracking(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'table_versions'"
+    ).fetchone() is not None
+
+
+def create_version_tracking(conn):
+    """Create table_versions, its rows and the triggers; True if it was new"""
+    new = not has_version_tracking(conn)
+    conn.execute(VERSIONS_TABLE)
+    conn.executemany('INSERT OR IGNORE INTO table_versions (name) VALUES (?)',
+                     [(table,) for table in TRACKED_TABLES])
+    for statement in VERSION_TRIGGERS.values():
+        conn.execute(statement)
+    return new
+
+
+def bump(conn, table):
+    """Mark table changed by something its triggers did not see (e.g. a bulk import)"""
+    conn.execute('UPDATE table_versions SET version = version + 1 WHERE name = ?', (table,))
+
+
+def versions(conn, tables):
+    """Tuple of the tables' counters, or None if the database does not track them"""
+    try:
+        rows = dict(conn.execute(
+            f"SELECT name, version FROM table_versions WHERE name IN ({', '.join('?' * len(tables))})",
+            tables).fetchall())
+    except sqlite3.OperationalError:
+        return None  # no table_versions: run add_table_versions.py
+    if len(rows) != len(tables):
+        return None
+    return tuple(rows[table] for table in tables)
+
+
+def list_etag(counters, path, query=''):
+    """Weak ETag for a response built from tables at the given counters"""
+    digest = hashlib.blake2b(f'{path}?{query}'.encode(), digest_size=8).hexdigest()
+    return 'W/"%s-%s"' % ('.'.join(map(str, counters)), digest)
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against etag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tag = etag.removeprefix('W/')
+    return any(candidate.strip().removeprefix('W/') == tag
+               for candidate in if_none_match.split(','))
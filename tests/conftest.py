@@ -0,0 +1,111 @@
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'database.db')
+
+
+@pytest.fixture
+def normalized_db(db_path):
+    """Path of a database with the normalized rating tables, selected for this process"""
+    import ratings
+    conn = sqlite3.connect(db_path)
+    ratings.create_normalized_schema(conn)
+    ratings.set_meta(conn, 'ratings_storage', ratings.NORMALIZED)
+    conn.commit()
+    conn.close()
+    previous = ratings.storage, ratings.vote_archive
+    ratings.use_storage(ratings.NORMALIZED, archive=True)
+    ratings.forget_ids()
+    yield db_path
+    ratings.use_storage(*previous)
+    ratings.forget_ids()
+
+
+@pytest.fixture
+def site_db(db_path):
+    """Path of a database built from database.sql, with 2 users and 2 posts"""
+    conn = sqlite3.connect(db_path)
+    with open(os.path.join(ROOT, 'database.sql')) as f:
+        conn.executescript(f.read())
+    conn.close()
+    return db_path
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RunningServer:
+    def __init__(self, port, process):
+        self.port = port
+        self.process = process
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, headers, parsed JSON or raw bytes) for one request"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        data = json.dumps(body).encode() if body is not None else None
+        all_headers = {'Content-Type': 'application/json'} if data else {}
+        all_headers.update(headers or {})
+        conn.request(method, path, body=data, headers=all_headers)
+        response = conn.getresponse()
+        raw = response.read()
+        conn.close()
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            payload = raw
+        return response.status, response.headers, payload
+
+
+@pytest.fixture
+def simple_server(site_db):
+    """Start simple_server.py on a copy of site_db with normalized ratings"""
+    import ratings
+    conn = sqlite3.connect(site_db)
+    ratings.create_normalized_schema(conn)
+    ratings.set_meta(conn, 'ratings_storage', ratings.NORMALIZED)
+    conn.commit()
+    conn.close()
+    started = []
+
+    def start(*args):
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'simple_server.py'), '--port', str(port),
+             '--rollup-interval', '0', *args],
+            cwd=os.path.dirname(site_db), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        started.append(process)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                return RunningServer(port, process)
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError('simple_server.py exited during startup')
+                time.sleep(0.05)
+        raise RuntimeError('simple_server.py did not start')
+
+    yield start
+    for process in started:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import BULK, CRITICAL, NORMAL
+
+
+def _later(seconds=10):
+    return time.monotonic() + seconds
+
+
+def _wait_queued(controller, count):
+    deadline = time.monotonic() + 5
+    while sum(controller.stats()['queued'].values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _queue(controller, priority, order, name):
+    def run():
+        try:
+            controller.admit(priority, _later())
+        except admission.Shed as e:
+            order.append((name, e.reason))
+            return
+        order.append(name)
+        controller.release()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_request_deadline_is_capped_by_the_default():
+    assert admission.request_deadline(100.0, None, 10) == 110.0
+    assert admission.request_deadline(100.0, '2.5', 10) == 102.5
+    assert admission.request_deadline(100.0, '60', 10) == 110.0
+    assert admission.request_deadline(100.0, '-1', 10) == 100.0
+    assert admission.request_deadline(100.0, 'soon', 10) == 110.0
+
+
+def test_waiters_run_by_priority_then_arrival():
+    controller = admission.AdmissionController(1, max_queue=10)
+    controller.admit(NORMAL, _later())
+    order, threads = [], []
+    for name, priority in (('bulk', BULK), ('normal1', NORMAL), ('critical', CRITICAL),
+                           ('normal2', NORMAL)):
+        threads.append(_queue(controller, priority, order, name))
+        _wait_queued(controller, len(threads))
+    controller.release()
+    for thread in threads:
+        thread.join()
+    assert order == ['critical', 'normal1', 'normal2', 'bulk']
+    stats = controller.stats()
+    assert stats['in_flight'] == 0 and stats['admitted'] == 5
+
+
+def test_lower_priorities_get_a_smaller_share_of_the_queue():
+    controller = admission.AdmissionController(1, max_queue=4, queue_timeout=5)
+    controller.admit(NORMAL, _later())
+    order = []
+    threads = [_queue(controller, BULK, order, 'bulk')]
+    _wait_queued(controller, 1)
+    with pytest.raises(admission.Shed) as full:
+        controller.admit(BULK, _later())  # bulk may fill a quarter of 4
+    assert full.value.reason == 'queue_full' and full.value.retry_after >= 1
+    threads += [_queue(controller, NORMAL, order, 'normal') for _ in range(2)]
+    _wait_queued(controller, 3)
+    with pytest.raises(admission.Shed):
+        controller.admit(NORMAL, _later())
+    threads.append(_queue(controller, CRITICAL, order, 'critical'))
+    _wait_queued(controller, 4)
+    controller.release()
+    for thread in threads:
+        thread.join()
+    assert order[0] == 'critical' and order[-1] == 'bulk'
+    assert controller.stats()['shed']['queue_full'] == 2
+
+
+def test_waiting_past_the_queue_timeout_or_deadline_sheds():
+    controller = admission.AdmissionController(1, queue_timeout=0.05)
+    controller.admit(NORMAL, _later())
+    with pytest.raises(admission.Shed) as timed_out:
+        controller.admit(NORMAL, _later())
+    with pytest.raises(admission.Shed) as expired:
+        controller.admit(NORMAL, time.monotonic() + 0.01)
+    with pytest.raises(admission.Shed) as already:
+        controller.admit(CRITICAL, time.monotonic() - 1)
+    assert [e.value.reason for e in (timed_out, expired, already)] == \
+        ['queue_timeout', 'deadline', 'deadline']
+    controller.release()
+    assert controller.stats()['queued'] == {'critical': 0, 'normal': 0, 'bulk': 0}
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_progress_handler_interrupts_statements_past_the_deadline():
+    controller = admission.AdmissionController(1)
+    conn = sqlite3.connect(':memory:')
+    admission.install(conn)
+    slow = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n'
+    controller.admit(NORMAL, time.monotonic() + 0.05)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='interrupted'):
+            conn.execute(slow).fetchone()
+    finally:
+        controller.release()
+    assert not admission.deadline_exceeded()  # cleared with the request
+    assert conn.execute('SELECT 1').fetchone() == (1,)
@@ -0,0 +1,97 @@
+import gzip
+import sqlite3
+
+import pytest
+
+import app as flask_app
+import db_pool
+import table_versions
+
+SCHEMA = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL, name TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, content TEXT,
+    author_id INTEGER, published BOOLEAN DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+'''
+
+
+def _make_client(monkeypatch, path, versions):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT INTO users (email, password_hash, name) VALUES ('a@example.com', 'x', 'A')")
+    conn.executemany('INSERT INTO posts (title, content, author_id, published) VALUES (?, ?, 1, 1)',
+                     [(f'Post {i}', 'words ' * 100) for i in range(20)])
+    if versions:
+        table_versions.create_version_tracking(conn)
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(flask_app, 'DATABASE', path)
+    flask_app.post_cache.invalidate()
+    return flask_app.app.test_client()
+
+
+@pytest.fixture
+def client(monkeypatch, db_path):
+    yield _make_client(monkeypatch, db_path, versions=False)
+    db_pool.get_pool(db_path).close_all()
+
+
+@pytest.fixture
+def versioned_client(monkeypatch, db_path):
+    yield _make_client(monkeypatch, db_path, versions=True)
+    db_pool.get_pool(db_path).close_all()
+
+
+def test_post_cache_etag_is_weak_and_varies_on_encoding(client):
+    plain = client.get('/api/posts/1')
+    gzipped = client.get('/api/posts?limit=20', headers={'Accept-Encoding': 'gzip'})
+    for response in (plain, gzipped):
+        assert response.headers['ETag'].startswith('W/')
+        assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data).startswith(b'{')
+
+
+def test_weak_etag_revalidates_either_representation(client):
+    first = client.get('/api/posts?limit=20', headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+    for encoding in ('gzip', 'identity'):
+        again = client.get('/api/posts?limit=20', headers={'Accept-Encoding': encoding,
+                                                          'If-None-Match': etag})
+        assert again.status_code == 304
+        assert 'Accept-Encoding' in again.headers['Vary']
+
+
+def test_versioned_list_revalidates_until_a_write(versioned_client, db_path):
+    first = versioned_client.get('/api/posts')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert versioned_client.get('/api/posts', headers={'If-None-Match': etag}).status_code == 304
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE posts SET title = 'Changed' WHERE id = 1")
+    conn.commit()
+    conn.close()
+    changed = versioned_client.get('/api/posts', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_fields_projection_and_unknown_field(client):
+    posts = client.get('/api/posts?fields=id,title').get_json()
+    assert set(posts['posts'][0]) == {'id', 'title'}
+    assert client.get('/api/posts?fields=nope').status_code == 400
+
+
+def test_writes_invalidate_cached_posts(client):
+    first = client.get('/api/posts/1')
+    assert first.headers['X-Cache'] == 'MISS'
+    assert client.get('/api/posts/1').headers['X-Cache'] == 'HIT'
+    assert client.put('/api/posts/1', json={'title': 'Renamed'}).status_code == 200
+    after = client.get('/api/posts/1')
+    assert after.headers['X-Cache'] == 'MISS'
+    assert after.get_json()['post']['title'] == 'Renamed'
+    assert after.headers['ETag'] != first.headers['ETag']
@@ -0,0 +1,33 @@
+import random
+import sqlite3
+
+import benchmark
+import ratings
+
+
+def test_percentile_picks_the_nearest_rank():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 0.50) == 50
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile([7], 0.95) == 7
+    assert benchmark.percentile([], 0.5) is None
+
+
+def test_vote_pairs_are_distinct_and_long_tailed():
+    pairs = list(benchmark.vote_pairs(random.Random(1), 50, 200, 1000))
+    assert len(pairs) == len(set(pairs))
+    per_song = [sum(1 for song, _ in pairs if song == s) for s in (1, 50)]
+    assert per_song[0] > per_song[1]
+    assert all(1 <= listener <= 200 for _, listener in pairs)
+
+
+def test_generated_database_has_exact_totals(tmp_path):
+    path = str(tmp_path / 'database.db')
+    benchmark.generate_database(path, users=5, posts=10, songs=20, listeners=30, votes=100)
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0] == 12
+    assert ratings.check_totals(conn) == []
+    assert ratings.check_hourly(conn) == []
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+                        "AND tbl_name = 'song_votes'").fetchone()[0] > 0
+    conn.close()
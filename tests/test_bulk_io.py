@@ -0,0 +1,140 @@
+import csv
+import json
+import os
+import time
+
+import bulk_io
+import ratings
+import rollups
+
+
+def _vote(conn, title, listener, rating, days_ago):
+    sid = ratings.song_id(conn, title, 'Artist', create=True)
+    lid = ratings.listener_id(conn, listener)
+    created = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days_ago * 86400))
+    conn.execute('INSERT INTO song_votes (song_id, listener_id, rating, created_at) '
+                 'VALUES (?, ?, ?, ?)', (sid, lid, rating, created))
+
+
+def _export(conn, tmp_path, chunk=3):
+    path = str(tmp_path / 'votes.csv')
+    bulk_io.export_table(conn, 'ratings', path, 'csv', chunk, False)
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_users_export_round_trips(db_path, tmp_path):
+    conn = bulk_io.connect(db_path)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, password_hash TEXT, '
+                 'name TEXT, created_at TEXT, updated_at TEXT)')
+    conn.executemany('INSERT INTO users (email, name) VALUES (?, ?)',
+                     [(f'u{i}@example.com', f'User {i}') for i in range(7)])
+    path = str(tmp_path / 'users.jsonl')
+    bulk_io.export_table(conn, 'users', path, 'jsonl', 2, False)
+    with open(path) as f:
+        assert len(f.readlines()) == 7
+
+
+def test_ratings_export_includes_archived_votes(normalized_db, tmp_path):
+    conn = bulk_io.connect(normalized_db)
+    conn.execute('BEGIN')
+    for i in range(10):
+        _vote(conn, f'Song {i % 3}', f'listener{i}', 1 if i % 2 else -1, 200 if i < 6 else 1)
+    conn.execute('COMMIT')
+    rollups.run(conn, hourly_days=14, vote_days=90)
+    assert conn.execute('SELECT COUNT(*) FROM song_votes_archive').fetchone()[0] == 6
+
+    rows = _export(conn, tmp_path)
+    assert len(rows) == 10
+    assert len({(r['title'], r['user_identifier']) for r in rows}) == 10
+
+
+def test_ratings_export_lists_a_pair_in_both_tables_once(normalized_db, tmp_path):
+    conn = bulk_io.connect(normalized_db)
+    conn.execute('BEGIN')
+    _vote(conn, 'Song', 'listener', 1, 1)
+    conn.execute("INSERT INTO song_votes_archive (song_id, listener_id, rating, created_at) "
+                 "SELECT song_id, listener_id, -rating, created_at FROM song_votes")
+    conn.execute('COMMIT')
+    rows = _export(conn, tmp_path)
+    assert [(r['title'], r['rating']) for r in rows] == [('Song', '1')]
+
+
+def _write_votes(tmp_path, count):
+    path = str(tmp_path / 'import.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk_io.TABLES['ratings'])
+        for i in range(count):
+            writer.writerow([f'Song {i % 4}', 'Artist', '', f'listener{i}', 1 if i % 3 else -1,
+                             '2024-01-01 00:00:00'])
+    return path
+
+
+def _totals(conn):
+    return conn.execute('SELECT SUM(thumbs_up), SUM(thumbs_down) FROM song_rating_totals').fetchone()
+
+
+def test_ratings_import_with_deferred_indexes_rebuilds_them(normalized_db, tmp_path):
+    conn = bulk_io.connect(normalized_db)
+    before = sorted(bulk_io.deferrable(conn, 'song_votes'))
+    path = _write_votes(tmp_path, 12)
+    bulk_io.import_table(conn, 'ratings', path, 'csv', 5, False, True)
+
+    assert sorted(bulk_io.deferrable(conn, 'song_votes')) == before
+    assert conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0] == 12
+    assert _totals(conn) == (8, 4)
+    assert ratings.check_totals(conn) == []
+    assert ratings.check_hourly(conn) == []
+
+
+def test_ratings_import_twice_does_not_duplicate(normalized_db, tmp_path):
+    conn = bulk_io.connect(normalized_db)
+    path = _write_votes(tmp_path, 6)
+    bulk_io.import_table(conn, 'ratings', path, 'csv', 4, False, False)
+    bulk_io.import_table(conn, 'ratings', path, 'csv', 4, False, False)
+    assert conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0] == 6
+    assert _totals(conn) == (4, 2)
+
+
+def test_ratings_import_resumes_after_the_last_committed_chunk(normalized_db, tmp_path,
+                                                                monkeypatch):
+    conn = bulk_io.connect(normalized_db)
+    path = _write_votes(tmp_path, 10)
+    real_chunk = bulk_io.import_ratings_chunk
+    calls = []
+
+    def failing_chunk(conn, batch, storage):
+        calls.append(len(batch))
+        if len(calls) == 2:
+            raise RuntimeError('interrupted')
+        real_chunk(conn, batch, storage)
+
+    monkeypatch.setattr(bulk_io, 'import_ratings_chunk', failing_chunk)
+    try:
+        bulk_io.import_table(conn, 'ratings', path, 'csv', 4, False, True)
+    except RuntimeError:
+        pass
+    assert conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0] == 4
+    assert not conn.in_transaction
+
+    monkeypatch.setattr(bulk_io, 'import_ratings_chunk', real_chunk)
+    bulk_io.import_table(conn, 'ratings', path, 'csv', 4, True, True)
+    assert conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0] == 10
+    assert ratings.check_totals(conn) == []
+    assert bulk_io.deferrable(conn, 'song_votes')  # rebuilt although dropped by the first run
+    assert not os.path.exists(bulk_io.progress_path(path))
+
+
+def test_export_resume_truncates_past_the_checkpoint(db_path, tmp_path):
+    conn = bulk_io.connect(db_path)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, password_hash TEXT, '
+                 'name TEXT, created_at TEXT, updated_at TEXT)')
+    conn.executemany('INSERT INTO users (email) VALUES (?)', [(f'u{i}@example.com',) for i in range(5)])
+    path = str(tmp_path / 'users.jsonl')
+    with open(path, 'w') as f:
+        f.write('{"id": 1}\n{"id": 2}\n{"partial')
+    bulk_io.save_progress(path, {'last_key': [2], 'rows': 2, 'bytes': len('{"id": 1}\n{"id": 2}\n')})
+    bulk_io.export_table(conn, 'users', path, 'jsonl', 2, True)
+    with open(path) as f:
+        assert [json.loads(line)['id'] for line in f] == [1, 2, 3, 4, 5]
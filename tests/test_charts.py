@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+
+import pytest
+
+import charts
+
+
+@pytest.fixture
+def conn(normalized_db):
+    conn = sqlite3.connect(normalized_db, isolation_level=None)
+    conn.executemany('INSERT INTO songs (id, title, artist) VALUES (?, ?, ?)',
+                     [(1, 'Loved', 'Band'), (2, 'Few fans', 'Band'), (3, 'Old hit', 'Band')])
+    conn.executemany('INSERT INTO listeners (id, identifier) VALUES (?, ?)',
+                     [(i, f'listener{i}') for i in range(1, 101)])
+
+    def votes(song, ups, downs, age):
+        conn.executemany(
+            "INSERT INTO song_votes (song_id, listener_id, rating, created_at) "
+            "VALUES (?, ?, ?, datetime('now', ?))",
+            [(song, i + 1, 1 if i < ups else -1, age) for i in range(ups + downs)])
+
+    votes(1, 40, 10, '+0 minutes')  # 80% of many votes, in the current hour
+    votes(2, 3, 0, '+0 minutes')    # 100% of very few
+    votes(3, 60, 0, '-3 days')
+    yield conn
+    conn.close()
+
+
+def _titles(entries):
+    return [entry['song']['title'] for entry in entries]
+
+
+def test_wilson_bound_prefers_more_evidence():
+    assert charts.wilson_lower_bound(40, 10) > charts.wilson_lower_bound(3, 0)
+    assert charts.wilson_lower_bound(0, 0) == 0.0
+    assert 0 < charts.wilson_lower_bound(1, 0) < 1
+
+
+def test_windows_sum_their_hour_buckets(conn):
+    board = charts.ChartBoard()
+    assert _titles(board.top(conn, 'hour')) == ['Loved', 'Few fans']
+    assert _titles(board.top(conn, 'week')) == ['Old hit', 'Loved', 'Few fans']
+    assert _titles(board.top(conn, 'all', limit=1)) == ['Old hit']
+    entry = board.top(conn, 'hour')[0]
+    assert entry['rank'] == 1
+    assert entry['ratings'] == {'thumbs_up': 40, 'thumbs_down': 10, 'total': 50}
+
+
+def test_charts_are_reused_within_the_refresh_interval(conn):
+    board = charts.ChartBoard(refresh=60)
+    board.top(conn, 'day')
+    conn.execute("INSERT INTO song_votes (song_id, listener_id, rating) VALUES (2, 99, 1)")
+    assert board.top(conn, 'day')[1]['ratings']['thumbs_up'] == 3
+    board.invalidate()
+    assert board.top(conn, 'day')[1]['ratings']['thumbs_up'] == 4
+    assert board.stats()['hits'] == 1
+
+
+def test_hits_are_counted_exactly_across_threads(conn):
+    board = charts.ChartBoard(refresh=60)
+    board.top(conn, 'day')
+
+    def read():
+        for _ in range(500):
+            board.top(None, 'day')  # served from memory, no connection needed
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert board.stats()['hits'] == 4000
+
+
+def test_unknown_window(conn):
+    with pytest.raises(ValueError):
+        charts.ChartBoard().top(conn, 'decade')
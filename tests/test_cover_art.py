@@ -0,0 +1,143 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import cover_art
+
+
+def _png(color):
+    """An 8x8 solid PNG, built without Pillow"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + bytes(color) * 8 for _ in range(8))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 8, 8, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class CoverStub(BaseHTTPRequestHandler):
+    image = _png((255, 0, 0))
+    requests = []
+
+    def do_GET(self):
+        etag = '"%s"' % zlib.crc32(self.image)
+        CoverStub.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')  # sniffed instead
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(self.image)))
+        self.end_headers()
+        self.wfile.write(self.image)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CoverStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/cover.jpg'
+    server.shutdown()
+    server.server_close()
+    CoverStub.image = _png((255, 0, 0))
+    CoverStub.requests = []
+
+
+@pytest.fixture
+def no_pillow(monkeypatch):
+    monkeypatch.setattr(cover_art, 'Image', None)
+
+
+def _fetched(covers, track=None):
+    covers.update(track)
+    return covers.current(track)
+
+
+def test_cover_is_fetched_once_per_track_and_revalidated(stub, tmp_path, no_pillow):
+    covers = cover_art.CoverArt(stub, str(tmp_path), refresh=60)
+    urls = _fetched(covers, ('Song', 'Band'))
+    assert urls['original'].endswith('.png') and urls['sizes'] == {}
+    assert _fetched(covers, ('Song', 'Band')) == urls
+    assert CoverStub.requests == [None]
+
+    covers.checked_at = 0  # the refresh interval passed
+    assert _fetched(covers, ('Song', 'Band')) == urls
+    assert CoverStub.requests[-1] is not None
+    assert covers.stats()['not_modified'] == 1
+
+    CoverStub.image = _png((0, 0, 255))
+    changed = _fetched(covers, ('Next', 'Band'))
+    assert CoverStub.requests[-1] is None  # a new track fetches unconditionally
+    assert changed['original'] != urls['original']
+    assert covers.stats()['new_covers'] == 2
+
+
+def test_variant_serves_hashed_names_only(stub, tmp_path, no_pillow):
+    covers = cover_art.CoverArt(stub, str(tmp_path))
+    name = _fetched(covers)['original'].rsplit('/', 1)[1]
+    variant = covers.variant(name)
+    assert variant.body == CoverStub.image
+    assert variant.content_type == 'image/png'
+    assert variant.etag == f'"{name}"'
+    assert covers.variant(name) is variant
+    assert covers.stats()['hits'] == 1
+    assert covers.variant('../' + name) is None
+    assert covers.variant('0' * 32 + '.png') is None
+
+
+def test_origin_errors_keep_the_last_cover(stub, tmp_path, no_pillow):
+    covers = cover_art.CoverArt(stub, str(tmp_path))
+    urls = _fetched(covers)
+    covers.url = stub.rsplit(':', 1)[0] + ':1/cover.jpg'  # nothing listens there
+    assert _fetched(covers, ('Other', 'Band')) == urls
+    assert covers.stats()['errors'] == 1
+
+
+def test_old_covers_are_pruned(stub, tmp_path, no_pillow):
+    covers = cover_art.CoverArt(stub, str(tmp_path), max_covers=2)
+    for i in range(4):
+        CoverStub.image = _png((i, 0, 0))
+        covers.update(('Song', str(i)))
+        stamp = 1000 + i
+        os.utime(os.path.join(str(tmp_path), covers.digest + covers.extension), (stamp, stamp))
+    covers._prune()
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_thumbnails_are_rendered_with_pillow(stub, tmp_path):
+    pytest.importorskip('PIL')
+    covers = cover_art.CoverArt(stub, str(tmp_path), sizes=(4,))
+    urls = _fetched(covers)
+    thumbnail = covers.variant(urls['sizes']['4'].rsplit('/', 1)[1])
+    assert thumbnail.content_type == 'image/jpeg'
+    assert thumbnail.body.startswith(b'\xff\xd8')
+
+
+def test_current_never_waits_for_the_origin(stub, tmp_path, no_pillow):
+    covers = cover_art.CoverArt(stub, str(tmp_path))
+    with covers._fetch_lock:  # an origin fetch is in progress elsewhere
+        assert covers.current(('Song', 'Band')) is None
+    assert CoverStub.requests == []
+
+
+def test_background_thread_fetches_the_requested_track(stub, tmp_path, no_pillow):
+    covers = cover_art.CoverArt(stub, str(tmp_path), refresh=60)
+    covers.start()
+    try:
+        covers.current(('Song', 'Band'))
+        deadline = time.monotonic() + 5
+        while covers.current(('Song', 'Band')) is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        covers.stop()
+    assert not covers._thread.is_alive()
@@ -0,0 +1,57 @@
+import os
+import threading
+
+import db_pool
+
+
+def _in_thread(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+
+def test_connection_is_reused_within_a_thread(db_path):
+    pool = db_pool.ConnectionPool(db_path)
+    assert pool.connection() is pool.connection()
+    assert pool.connection().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    pool.close_all()
+
+
+def test_each_thread_gets_its_own_connection(db_path):
+    pool = db_pool.ConnectionPool(db_path)
+    main = pool.connection()
+    seen = []
+    _in_thread(lambda: seen.append(pool.connection()))
+    assert seen[0] is not main
+    pool.close_all()
+
+
+def test_thread_exit_closes_its_connection(db_path):
+    pool = db_pool.ConnectionPool(db_path)
+    fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+    for _ in range(50):
+        _in_thread(lambda: pool.connection().execute('SELECT 1'))
+    assert len(pool._connections) == 0
+    if fds is not None:
+        assert len(os.listdir('/proc/self/fd')) <= fds + 2
+
+
+def test_release_rolls_back_open_transaction(db_path):
+    pool = db_pool.ConnectionPool(db_path)
+    conn = pool.connection()
+    conn.execute('CREATE TABLE t (x)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    pool.release()
+    assert not conn.in_transaction
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    pool.close_all()
+
+
+def test_close_all_closes_every_live_connection(db_path):
+    pool = db_pool.ConnectionPool(db_path)
+    conn = pool.connection()
+    pool.close_all()
+    assert len(pool._connections) == 0
+    assert pool.connection() is not conn
+    pool.close_all()
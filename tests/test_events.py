@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import events
+
+
+async def _events(reader, count, timeout=3):
+    """Read count SSE events as (event, data) tuples"""
+    received = []
+    while len(received) < count:
+        block = await asyncio.wait_for(reader.readuntil(b'\n\n'), timeout)
+        lines = dict(line.split(': ', 1) for line in block.decode().strip().split('\n'))
+        received.append((lines['event'], lines['data']))
+    return received
+
+
+async def _with_client(broker, scenario):
+    server = await asyncio.start_server(broker.hold, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    while not broker.clients:
+        await asyncio.sleep(0.01)
+    try:
+        return await scenario(reader)
+    finally:
+        writer.close()
+        server.close()
+
+
+def test_publish_from_another_thread_reaches_clients():
+    broker = events.EventBroker()
+
+    async def scenario(reader):
+        threading.Thread(target=broker.publish, args=('track_changed', {'title': 'A'})).start()
+        return await _events(reader, 1)
+
+    assert asyncio.run(_with_client(broker, scenario)) == [('track_changed', '{"title": "A"}')]
+    assert broker.sent == 1
+
+
+def test_rating_updates_are_coalesced_per_song():
+    broker = events.EventBroker(rating_interval=0.3)
+
+    async def scenario(reader):
+        broker.publish_rating(('A', 'B'), {'total': 1})
+        first = await _events(reader, 1)
+        started = asyncio.get_running_loop().time()
+        for total in range(2, 6):
+            broker.publish_rating(('A', 'B'), {'total': total})
+        second = await _events(reader, 1)
+        return first + second, asyncio.get_running_loop().time() - started
+
+    received, waited = asyncio.run(_with_client(broker, scenario))
+    # The first vote goes out at once; the next ones are folded into one event
+    # sent an interval later with the latest counts
+    assert received == [('ratings_updated', '{"total": 1}'), ('ratings_updated', '{"total": 5}')]
+    assert waited > 0.2
+
+
+def test_preamble_sets_retry_and_initial_events():
+    out = events.EventBroker().preamble([('track_changed', {'title': 'A'})])
+    assert out.startswith(b'retry: ')
+    assert out.endswith(events.format_event('track_changed', {'title': 'A'}))
+
+
+def test_publish_without_clients_is_a_no_op():
+    broker = events.EventBroker()
+    broker.publish('track_changed', {})
+    broker.publish_rating(('A', 'B'), {})
+    assert broker.sent == 0
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import hls_cache
+
+PLAYLIST = '''#EXTM3U
+#EXT-X-TARGETDURATION:4
+#EXTINF:4.0,
+{origin}/seg1.ts
+#EXTINF:4.0,
+seg2.ts
+'''
+
+
+class OriginStub(BaseHTTPRequestHandler):
+    requests = []
+    delay = 0
+    status = 200
+
+    def do_GET(self):
+        OriginStub.requests.append((self.path, self.headers.get('If-None-Match')))
+        time.sleep(self.delay)
+        if self.status != 200:
+            self.send_error(self.status)
+            return
+        if self.path.endswith('.m3u8'):
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            origin = f'http://127.0.0.1:{self.server.server_port}/hls'
+            body = PLAYLIST.format(origin=origin).encode()
+        else:
+            body = b'segment:' + self.path.encode()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OriginStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/hls'
+    server.shutdown()
+    server.server_close()
+    OriginStub.requests = []
+    OriginStub.delay = 0
+    OriginStub.status = 200
+
+
+def _cache(origin, tmp_path, **kwargs):
+    return hls_cache.HlsCache(origin, str(tmp_path / 'hls'), **kwargs)
+
+
+def test_valid_path_rejects_traversal():
+    assert hls_cache.valid_path('live.m3u8')
+    assert hls_cache.valid_path('audio/seg-1.ts')
+    assert not hls_cache.valid_path('../secret')
+    assert not hls_cache.valid_path('a/../../b')
+    assert not hls_cache.valid_path('/etc/passwd')
+
+
+def test_playlist_uris_are_rewritten_and_ttl_follows_target_duration(origin, tmp_path):
+    cache = _cache(origin, tmp_path)
+    entry = cache.get('live.m3u8')
+    assert b'\nseg1.ts\n' in entry.body and origin.encode() not in entry.body
+    assert entry.content_type == 'application/vnd.apple.mpegurl'
+    assert entry.ttl == 2.0
+    assert cache.target_duration == 4.0
+    assert cache.segment_ttl() == 4.0 * hls_cache.MIN_SEGMENT_WINDOW
+
+
+def test_concurrent_misses_collapse_into_one_fetch(origin, tmp_path):
+    OriginStub.delay = 0.3
+    cache = _cache(origin, tmp_path)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('seg1.ts')))
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 6 and len({r.body for r in results}) == 1
+    assert [path for path, _ in OriginStub.requests] == ['/hls/seg1.ts']
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['collapsed'] == 5
+
+
+def test_expired_playlists_are_revalidated(origin, tmp_path):
+    cache = _cache(origin, tmp_path)
+    first = cache.get('live.m3u8')
+    assert cache.get('live.m3u8') is first
+    cache._entries['live.m3u8'] = first._replace(fetched_at=time.time() - 10)
+    again = cache.get('live.m3u8')
+    assert again.body == first.body
+    assert OriginStub.requests[-1] == ('/hls/live.m3u8', '"v1"')
+    assert cache.stats()['revalidated'] == 1
+
+
+def test_segments_are_shared_through_the_disk_cache(origin, tmp_path):
+    _cache(origin, tmp_path).get('seg2.ts')
+    other = _cache(origin, tmp_path)  # another worker, same directory
+    assert other.get('seg2.ts').body == b'segment:/hls/seg2.ts'
+    assert len(OriginStub.requests) == 1
+    assert other.stats()['disk_hits'] == 1
+
+
+def test_memory_is_bounded(origin):
+    cache = hls_cache.HlsCache(origin, None, max_bytes=50)  # memory only
+    for i in range(5):
+        cache.get(f'seg{i}.ts')
+    stats = cache.stats()
+    assert stats['memory_bytes'] <= 50 and stats['entries'] < 5
+    assert 'seg4.ts' in cache._entries
+
+
+def test_upstream_errors_map_to_gateway_statuses(origin, tmp_path):
+    cache = _cache(origin, tmp_path)
+    OriginStub.status = 404
+    with pytest.raises(hls_cache.UpstreamError) as missing:
+        cache.get('gone.ts')
+    OriginStub.status = 500
+    with pytest.raises(hls_cache.UpstreamError) as broken:
+        cache.get('broken.ts')
+    assert (missing.value.status, broken.value.status) == (404, 502)
+    unreachable = hls_cache.HlsCache('http://127.0.0.1:1/hls', None)
+    with pytest.raises(hls_cache.UpstreamError) as down:
+        unreachable.get('live.m3u8')
+    assert down.value.status == 502
+    assert cache.stats()['upstream_errors'] == 2
+
+
+def test_sweep_removes_expired_segment_files(origin, tmp_path):
+    cache = _cache(origin, tmp_path)
+    cache.get('seg1.ts')
+    cache.get('seg2.ts')
+    old = cache._disk_path('seg1.ts')
+    stale = time.time() - cache.segment_ttl() - 1
+    os.utime(old, (stale, stale))
+    cache.sweep_disk()
+    assert not os.path.exists(old)
+    assert os.path.exists(cache._disk_path('seg2.ts'))
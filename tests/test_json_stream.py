@@ -0,0 +1,39 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+import json_stream
+
+
+def _cursor(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE t (id INTEGER, name TEXT)')
+    conn.executemany('INSERT INTO t VALUES (?, ?)', [(i, f'né "{i}"') for i in range(rows)])
+    return conn.execute('SELECT id, name FROM t ORDER BY id')
+
+
+@pytest.mark.parametrize('rows, chunk_rows', [(0, 3), (1, 3), (7, 3), (9, 3)])
+def test_matches_json_dumps(rows, chunk_rows):
+    expected = json.dumps({'users': [dict(row) for row in _cursor(rows)], 'count': rows})
+    streamed = b''.join(json_stream.encode_list('users', _cursor(rows), {'count': rows},
+                                                chunk_rows=chunk_rows))
+    assert streamed == expected.encode()
+
+
+def test_yields_one_chunk_per_batch_of_rows():
+    chunks = list(json_stream.encode_list('users', _cursor(10), chunk_rows=4))
+    assert len(chunks) == 1 + 3 + 1  # head, three batches, tail
+
+
+def test_gzip_chunks_decompress_to_the_stream():
+    chunks = list(json_stream.encode_list('users', _cursor(50), chunk_rows=10))
+    compressed = list(json_stream.gzip_chunks(iter(chunks)))
+    assert len(compressed) > 1  # flushed per chunk, not buffered to the end
+    assert gzip.decompress(b''.join(compressed)) == b''.join(chunks)
+
+
+def test_gzip_body_is_deterministic():
+    assert json_stream.gzip_body(b'{}') == json_stream.gzip_body(b'{}')
@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+
+import listings
+
+
+@pytest.fixture
+def conn(site_db):
+    conn = sqlite3.connect(site_db)
+    conn.row_factory = sqlite3.Row
+    # Many rows share a created_at, so the id must break ties
+    conn.executemany('INSERT INTO posts (title, author_id, published, created_at) '
+                     'VALUES (?, 1, ?, ?)',
+                     [(f'Post {i}', i % 2, f'2024-01-0{1 + i // 10} 00:00:00')
+                      for i in range(45)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _walk(list_page, limit):
+    seen, after, pages = [], None, 0
+    while True:
+        rows, cursor = list_page(listings.Page(limit=limit, after=after))
+        seen.extend(rows)
+        pages += 1
+        if cursor is None:
+            return seen, pages
+        after = listings.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('limit', [1, 7, 10, 50])
+def test_keyset_pages_cover_every_post_once_in_order(conn, limit):
+    rows, _ = _walk(lambda page: listings.list_posts(conn, page), limit)
+    expected = [row['id'] for row in conn.execute(
+        'SELECT id FROM posts ORDER BY created_at DESC, id DESC')]
+    assert [row['id'] for row in rows] == expected
+
+
+def test_published_pages_only_hold_published_posts(conn):
+    rows, _ = _walk(lambda page: listings.list_posts(conn, page, published_only=True), 4)
+    published = [row['id'] for row in conn.execute(
+        'SELECT id FROM posts WHERE published = 1 ORDER BY created_at DESC, id DESC')]
+    assert [row['id'] for row in rows] == published
+
+
+def test_unpaginated_list_has_no_cursor(conn):
+    rows, cursor = listings.list_users(conn, listings.Page(unpaginated=True))
+    assert cursor is None and len(rows) == 2
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    cursor = listings.encode_cursor('2024-01-01 00:00:00', 42)
+    assert listings.decode_cursor(cursor) == ('2024-01-01 00:00:00', 42)
+    for bad in ('not-a-cursor', listings.encode_cursor('x', 'y')):
+        with pytest.raises(ValueError):
+            listings.decode_cursor(bad)
+
+
+@pytest.mark.parametrize('params, limit', [({}, listings.DEFAULT_LIMIT), ({'limit': '5'}, 5),
+                                           ({'limit': '100000'}, listings.MAX_LIMIT)])
+def test_parse_page_limits(params, limit):
+    assert listings.parse_page(params).limit == limit
+
+
+@pytest.mark.parametrize('params', [{'limit': '0'}, {'limit': 'x'}, {'after': '!!'}])
+def test_parse_page_rejects_bad_values(params):
+    with pytest.raises(ValueError):
+        listings.parse_page(params)
+
+
+def test_parse_page_all():
+    assert listings.parse_page({'all': 'true'}).unpaginated
+
+
+def test_fields_select_only_the_named_columns_in_order(conn):
+    rows, cursor = listings.list_posts(conn, listings.Page(limit=5),
+                                       fields=listings.parse_fields({'fields': 'title,id'},
+                                                                    listings.POST_FIELDS))
+    assert list(rows[0]) == ['id', 'title']  # cursor columns were read, then dropped
+    assert cursor is not None
+    rest, _ = listings.list_posts(conn, listings.Page(limit=5, after=listings.decode_cursor(cursor)),
+                                  fields=('id', 'title'))
+    assert rest[0]['id'] < rows[-1]['id']
+
+
+def test_posts_join_users_only_for_author_fields():
+    select, _, _ = listings._posts_select(False, ('id', 'title'), True)
+    assert 'JOIN users' not in select
+    select, _, _ = listings._posts_select(False, ('title', 'author_name'), True)
+    assert 'JOIN users' in select
+
+
+def test_parse_fields_rejects_unknown_and_published_only_fields():
+    assert listings.parse_fields({}, listings.POST_FIELDS) is None
+    with pytest.raises(ValueError):
+        listings.parse_fields({'fields': 'title,secret'}, listings.POST_FIELDS)
+    with pytest.raises(ValueError):
+        listings.parse_fields({'fields': 'published'}, listings.PUBLISHED_POST_FIELDS)
+    with pytest.raises(ValueError):
+        listings.parse_fields({'fields': ' , '}, listings.POST_FIELDS)
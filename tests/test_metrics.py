@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db_pool
+import metrics
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = db_pool.ConnectionPool(db_path, factory=metrics.InstrumentedConnection,
+                                  busy_timeout=3000)
+    conn = pool.connection()
+    conn.execute('CREATE TABLE t (x INTEGER PRIMARY KEY)')
+    conn.commit()
+    yield pool
+    pool.close_all()
+
+
+def _hold_write_lock(path, seconds):
+    """Take the write lock on another connection and release it after a while"""
+    blocker = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    blocker.execute('BEGIN IMMEDIATE')
+    timer = threading.Timer(seconds, lambda: (blocker.execute('COMMIT'), blocker.close()))
+    timer.start()
+    return timer
+
+
+def _busy_retries():
+    return sum(metrics.busy_retries._values.values())
+
+
+def test_execute_retries_while_locked(pool, db_path):
+    retries = _busy_retries()
+    timer = _hold_write_lock(db_path, 0.3)
+    conn = pool.connection()
+    conn.execute('INSERT INTO t VALUES (1)')
+    conn.commit()
+    timer.join()
+    assert _busy_retries() > retries
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+
+
+def test_executemany_retry_keeps_generator_rows(pool, db_path):
+    timer = _hold_write_lock(db_path, 0.3)
+    conn = pool.connection()
+    conn.executemany('INSERT INTO t VALUES (?)', ((i,) for i in range(100)))
+    conn.commit()
+    timer.join()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 100
+
+
+def test_gives_up_after_the_busy_budget(pool, db_path):
+    conn = pool.connection()
+    conn.busy_budget = 0.2
+    timer = _hold_write_lock(db_path, 1.0)
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute('INSERT INTO t VALUES (1)')
+    conn.rollback()
+    timer.join()
+
+
+def test_partly_applied_executemany_is_not_retried():
+    calls = []
+    error = sqlite3.OperationalError('database is locked')
+    error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+
+    def run():
+        calls.append(1)
+        raise error
+
+    with pytest.raises(sqlite3.OperationalError):
+        metrics._timed(run, 'INSERT INTO t VALUES (?)', 5.0, can_retry=lambda: False)
+    assert len(calls) == 1
+
+
+def test_statement_names_and_render():
+    assert metrics.statement_name('SELECT * FROM posts WHERE id = ?') == 'SELECT posts'
+    text = metrics.REGISTRY.render()
+    assert '# TYPE http_requests_total counter' in text
@@ -0,0 +1,85 @@
+import pytest
+
+import migrate_songs
+import ratings
+
+LEGACY_SCHEMA = '''
+CREATE TABLE song_ratings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    song_title TEXT NOT NULL, song_artist TEXT NOT NULL, song_album TEXT,
+    user_identifier TEXT NOT NULL,
+    rating INTEGER NOT NULL CHECK (rating IN (-1, 1)),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(song_title, song_artist, user_identifier))
+'''
+
+
+@pytest.fixture
+def legacy(db_path):
+    conn = migrate_songs.connect(db_path)
+    conn.execute(LEGACY_SCHEMA)
+    conn.executemany('INSERT INTO song_ratings (song_title, song_artist, song_album, '
+                     'user_identifier, rating) VALUES (?, ?, ?, ?, ?)',
+                     [(f'Song {i % 7}', 'Band', 'LP', f'listener{i}', 1 if i % 3 else -1)
+                      for i in range(50)])
+    yield conn
+    conn.close()
+
+
+def _normalized_votes(conn):
+    return sorted(conn.execute(
+        '''SELECT s.title, l.identifier, v.rating FROM song_votes v
+           JOIN songs s ON s.id = v.song_id JOIN listeners l ON l.id = v.listener_id'''))
+
+
+def _legacy_votes(conn):
+    return sorted(conn.execute('SELECT song_title, user_identifier, rating FROM song_ratings'))
+
+
+def test_migration_copies_every_vote_and_switches_storage(legacy):
+    assert migrate_songs.migrate(legacy, chunk=8, pause=0)
+    assert _normalized_votes(legacy) == _legacy_votes(legacy)
+    assert ratings.detect_storage(legacy) == ratings.NORMALIZED
+    legacy.execute('BEGIN')
+    assert ratings.check_totals(legacy) == []
+    legacy.execute('ROLLBACK')
+
+
+def test_writes_during_migration_are_mirrored(legacy):
+    migrate_songs.prepare(legacy)
+    migrate_songs.copy_chunk(legacy, 0, 20)
+    # A server still on legacy storage keeps writing
+    legacy.execute("INSERT INTO song_ratings (song_title, song_artist, user_identifier, rating) "
+                   "VALUES ('New', 'Band', 'late', 1)")
+    legacy.execute("UPDATE song_ratings SET rating = -rating WHERE id IN (3, 30)")
+    legacy.execute("DELETE FROM song_ratings WHERE id IN (5, 40)")
+    assert migrate_songs.migrate(legacy, chunk=8, pause=0)  # resumes after id 20
+    assert _normalized_votes(legacy) == _legacy_votes(legacy)
+
+
+def test_interrupted_migration_resumes(legacy):
+    migrate_songs.prepare(legacy)
+    migrate_songs.copy_chunk(legacy, 0, 25)
+    assert ratings.get_meta(legacy, migrate_songs.PROGRESS_KEY) == '25'
+    assert migrate_songs.migrate(legacy, chunk=100, pause=0)
+    assert len(_normalized_votes(legacy)) == 50
+
+
+def test_finalize_drops_triggers_and_optionally_the_legacy_table(legacy):
+    assert not migrate_songs.finalize(legacy, False)  # not migrated yet
+    migrate_songs.migrate(legacy, chunk=100, pause=0)
+    assert migrate_songs.finalize(legacy, True)
+    names = {row[0] for row in legacy.execute('SELECT name FROM sqlite_master')}
+    assert not names & set(migrate_songs.TRIGGERS)
+    assert 'song_ratings' not in names
+
+
+def test_normalized_submit_returns_previous_rating(normalized_db):
+    conn = migrate_songs.connect(normalized_db)
+    conn.isolation_level = ''  # submit_rating commits itself
+    assert ratings.submit_rating(conn, 'Song', 'Band', '', 'listener', 1) is None
+    assert ratings.submit_rating(conn, 'Song', 'Band', '', 'listener', -1) == 1
+    assert ratings.fetch_tally(conn, 'Song', 'Band') == (0, 1)
+    assert ratings.fetch_tallies(conn, [('Song', 'Band'), ('Other', 'Band')]) == {
+        ('Song', 'Band'): (0, 1), ('Other', 'Band'): (0, 0)}
+    conn.close()
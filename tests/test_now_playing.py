@@ -0,0 +1,67 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import now_playing
+
+
+class MetadataStub(BaseHTTPRequestHandler):
+    document = {'title': 'First', 'artist': 'Band'}
+
+    def do_GET(self):
+        body = json.dumps(self.document).encode()
+        etag = '"%d"' % hash(body)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MetadataStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/metadatav2.json'
+    server.shutdown()
+    server.server_close()
+    MetadataStub.document = {'title': 'First', 'artist': 'Band'}
+
+
+def test_polls_conditionally_and_announces_track_changes(stub):
+    poller = now_playing.NowPlayingPoller(stub)
+    changes = []
+    poller.add_listener(lambda old, new, metadata: changes.append((old, new)))
+    assert poller.poll()
+    assert poller.track == ('First', 'Band')
+    assert not poller.poll()  # unchanged: answered 304
+    assert poller.not_modified == 1
+    MetadataStub.document = {'title': 'Second', 'artist': 'Band'}
+    assert poller.poll()
+    assert changes == [(None, ('First', 'Band')), (('First', 'Band'), ('Second', 'Band'))]
+
+
+def test_errors_keep_the_last_document(stub, capsys):
+    poller = now_playing.NowPlayingPoller(stub)
+    poller.poll()
+    poller.url = stub.rsplit(':', 1)[0] + ':1/metadatav2.json'  # nothing listens there
+    assert not poller.poll()
+    assert poller.errors == 1
+    assert poller.metadata == {'title': 'First', 'artist': 'Band'}
+    assert 'failed' in capsys.readouterr().out
+
+
+def test_failing_listener_does_not_stop_updates(stub):
+    poller = now_playing.NowPlayingPoller(stub)
+    poller.add_listener(lambda old, new, metadata: 1 / 0)
+    assert poller.poll()
+    assert poller.track == ('First', 'Band')
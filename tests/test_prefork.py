@@ -0,0 +1,55 @@
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SUPERVISED = textwrap.dedent('''
+    import os, signal, sys, time
+    sys.path.insert(0, {root!r})
+    import prefork
+
+    def serve():
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        open(os.path.join({workdir!r}, str(os.getpid())), 'w').close()
+        while not stopping:
+            time.sleep(0.05)
+
+    prefork.run(2, serve)
+''')
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='prefork needs fork()')
+
+
+def _workers(workdir, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pids = sorted(int(name) for name in os.listdir(workdir))
+        if len(pids) >= count:
+            return pids
+        time.sleep(0.05)
+    raise AssertionError(f'expected {count} workers, saw {os.listdir(workdir)}')
+
+
+def test_supervisor_restarts_workers_and_stops_them(tmp_path):
+    script = SUPERVISED.format(root=ROOT, workdir=str(tmp_path))
+    supervisor = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE,
+                                  text=True)
+    try:
+        first = _workers(tmp_path, 2)
+        os.kill(first[0], signal.SIGKILL)
+        assert len(_workers(tmp_path, 3)) == 3  # a replacement started
+        supervisor.send_signal(signal.SIGTERM)
+        output, _ = supervisor.communicate(timeout=15)
+    finally:
+        if supervisor.poll() is None:
+            supervisor.kill()
+    assert supervisor.returncode == 0
+    assert 'restarting' in output
+    assert 'All workers stopped.' in output
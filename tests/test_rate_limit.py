@@ -0,0 +1,99 @@
+import threading
+
+import rate_limit
+
+
+def test_bucket_allows_a_burst_then_reports_the_wait():
+    buckets = rate_limit.TokenBuckets(rate=2.0, burst=3)
+    assert [buckets.take('a', now=0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take('a', now=0) == 0.5
+    assert buckets.take('a', now=0.5) == 0  # refilled one token
+    assert buckets.take('b', now=0) == 0  # keys are independent
+
+
+def test_bucket_refill_is_capped_at_burst():
+    buckets = rate_limit.TokenBuckets(rate=10.0, burst=2)
+    buckets.take('a', now=0)
+    results = [buckets.take('a', now=100) for _ in range(3)]
+    assert results[:2] == [0, 0] and results[2] > 0
+
+
+def test_bucket_evicts_the_least_recently_used_key():
+    buckets = rate_limit.TokenBuckets(rate=1.0, burst=1, max_keys=2)
+    buckets.take('a', now=0)
+    buckets.take('b', now=0)
+    buckets.take('a', now=0)  # a is now the most recent
+    buckets.take('c', now=0)
+    assert len(buckets) == 2
+    assert 'b' not in buckets._buckets and 'a' in buckets._buckets
+
+
+def test_zero_rate_disables_a_bucket():
+    buckets = rate_limit.TokenBuckets(rate=0, burst=0)
+    assert all(buckets.take('a') == 0 for _ in range(100))
+    assert len(buckets) == 0
+
+
+def test_buckets_never_overspend_under_threads():
+    buckets = rate_limit.TokenBuckets(rate=1e-9, burst=50)
+    granted = []
+
+    def worker():
+        for _ in range(20):
+            if buckets.take('shared') == 0:
+                granted.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(granted) == 50
+
+
+def test_limiter_checks_ip_before_listener_and_counts_rejections():
+    limiter = rate_limit.RateLimiter(ip_rate=1.0, ip_burst=2, listener_rate=1.0, listener_burst=5)
+    assert limiter.check('1.2.3.4', 'x') == (None, 0)
+    assert limiter.check('1.2.3.4', 'y') == (None, 0)
+    reason, wait = limiter.check('1.2.3.4', 'z')
+    assert reason == 'ip' and wait > 0
+    stats = limiter.stats()
+    assert stats['allowed'] == 2 and stats['rejected']['ip'] == 1
+
+
+def test_limiter_rejects_one_listener_across_ips():
+    limiter = rate_limit.RateLimiter(listener_rate=1.0, listener_burst=2)
+    assert limiter.check('10.0.0.1', 'x')[0] is None
+    assert limiter.check('10.0.0.2', 'x')[0] is None
+    assert limiter.check('10.0.0.3', 'x')[0] == 'listener'
+    assert limiter.stats()['rejected']['listener'] == 1
+
+
+def test_duplicate_vote_is_detected_until_the_window_passes(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: clock[0])
+    limiter = rate_limit.RateLimiter(dedup_window=10)
+    assert not limiter.is_duplicate('x', 'Song', 'Artist', 1)
+    limiter.remember('x', 'Song', 'Artist', 1)
+    assert limiter.is_duplicate('x', 'Song', 'Artist', 1)
+    assert not limiter.is_duplicate('x', 'Song', 'Artist', -1)  # a changed vote goes through
+    assert not limiter.is_duplicate('y', 'Song', 'Artist', 1)
+    clock[0] += 11
+    assert not limiter.is_duplicate('x', 'Song', 'Artist', 1)
+    stats = limiter.stats()
+    assert stats['rejected']['duplicate'] == 1 and stats['recent_votes'] == 0
+
+
+def test_recent_votes_are_bounded():
+    limiter = rate_limit.RateLimiter(max_keys=3)
+    for i in range(5):
+        limiter.remember(f'listener{i}', 'Song', 'Artist', 1)
+    assert limiter.stats()['recent_votes'] == 3
+    assert not limiter.is_duplicate('listener0', 'Song', 'Artist', 1)
+    assert limiter.is_duplicate('listener4', 'Song', 'Artist', 1)
+
+
+def test_zero_window_disables_dedup():
+    limiter = rate_limit.RateLimiter(dedup_window=0)
+    limiter.remember('x', 'Song', 'Artist', 1)
+    assert not limiter.is_duplicate('x', 'Song', 'Artist', 1)
@@ -0,0 +1,77 @@
+import rating_cache
+
+KEY = ('Song', 'Artist')
+
+
+def test_miss_loads_once_then_hits():
+    cache = rating_cache.RatingCache()
+    calls = []
+    load = lambda: calls.append(1) or (3, 1)
+    assert cache.get_or_load(KEY, load) == (3, 1)
+    assert cache.get_or_load(KEY, load) == (3, 1)
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_apply_adjusts_cached_tally():
+    cache = rating_cache.RatingCache()
+    cache.get_or_load(KEY, lambda: (3, 1))
+    cache.begin_write(KEY)
+    cache.apply(KEY, None, 1)
+    assert cache.get(KEY) == (4, 1)
+    cache.begin_write(KEY)
+    cache.apply(KEY, 1, -1)
+    assert cache.get(KEY) == (3, 2)
+
+
+def test_fill_during_write_is_not_stored():
+    # A reader that misses while a vote is committing may load a tally that
+    # already includes the vote; apply() must not count it a second time.
+    cache = rating_cache.RatingCache()
+    cache.begin_write(KEY)
+    assert cache.get_or_load(KEY, lambda: (1, 0)) == (1, 0)  # includes the vote
+    cache.apply(KEY, None, 1)
+    assert cache.get(KEY) is None
+    assert cache.get_or_load(KEY, lambda: (1, 0)) == (1, 0)
+    assert cache.get(KEY) == (1, 0)
+
+
+def test_fill_started_before_write_is_discarded():
+    cache = rating_cache.RatingCache()
+
+    def load():
+        cache.begin_write(KEY)      # the vote starts while the reader is loading
+        cache.apply(KEY, None, 1)
+        return (0, 0)
+
+    cache.get_or_load(KEY, load)
+    assert cache.get(KEY) is None
+
+
+def test_end_write_reopens_fills():
+    cache = rating_cache.RatingCache()
+    cache.begin_write(KEY)
+    cache.end_write(KEY)
+    cache.get_or_load(KEY, lambda: (2, 2))
+    assert cache.get(KEY) == (2, 2)
+
+
+def test_get_many_skips_keys_being_written():
+    cache = rating_cache.RatingCache()
+    other = next((f'Other {i}', 'Artist') for i in range(1000)
+                 if hash((f'Other {i}', 'Artist')) % rating_cache.STRIPES
+                 != hash(KEY) % rating_cache.STRIPES)
+    cache.begin_write(KEY)
+    found = cache.get_many_or_load([KEY, other], lambda keys: {k: (1, 1) for k in keys})
+    assert found == {KEY: (1, 1), other: (1, 1)}
+    assert cache.get(other) == (1, 1)
+    cache.end_write(KEY)
+    assert cache.get(KEY) is None
+
+
+def test_evicts_least_recently_used():
+    cache = rating_cache.RatingCache(max_entries=2)
+    for i in range(3):
+        cache.get_or_load((f'S{i}', 'A'), lambda: (0, 0))
+    assert cache.get(('S0', 'A')) is None
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,101 @@
+import pytest
+
+import db_pool
+import rating_queue
+
+
+def _queue(path, **kwargs):
+    writer = rating_queue.RatingWriteQueue(db_pool.ConnectionPool(path), flush_interval=0.01,
+                                           **kwargs)
+    writer.start()
+    return writer
+
+
+def _count_votes(path):
+    conn = db_pool.ConnectionPool(path).connect()
+    try:
+        return conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('durability', ['group', 'full'])
+def test_waiting_durability_resolves_after_commit(normalized_db, durability):
+    writer = _queue(normalized_db, durability=durability)
+    futures = [writer.submit(('Song', 'Artist', '', f'listener{i}', 1)) for i in range(20)]
+    assert [f.result(timeout=5) for f in futures] == [None] * 20
+    assert writer.submit(('Song', 'Artist', '', 'listener0', -1)).result(timeout=5) == 1
+    writer.close()
+    assert _count_votes(normalized_db) == 20
+    assert writer.stats()['flushed'] == 21
+
+
+def test_async_votes_are_flushed_on_close(normalized_db):
+    writer = _queue(normalized_db, durability='async')
+    for i in range(100):
+        writer.submit(('Song', 'Artist', '', f'listener{i}', 1))
+    writer.close()
+    assert _count_votes(normalized_db) == 100
+
+
+def test_hooks_bracket_each_batch(normalized_db):
+    calls = []
+    writer = _queue(normalized_db, durability='group',
+                    on_begin=lambda votes: calls.append(('begin', len(votes))),
+                    on_commit=lambda votes, previous: calls.append(('commit', previous)))
+    writer.submit(('Song', 'Artist', '', 'listener', 1)).result(timeout=5)
+    writer.close()
+    assert calls == [('begin', 1), ('commit', [None])]
+
+
+def test_failing_on_commit_does_not_stop_the_writer(normalized_db, capsys):
+    def on_commit(votes, previous):
+        raise RuntimeError('publish failed')
+
+    writer = _queue(normalized_db, durability='group', on_commit=on_commit)
+    assert writer.submit(('Song', 'Artist', '', 'a', 1)).result(timeout=5) is None
+    assert writer.submit(('Song', 'Artist', '', 'b', 1)).result(timeout=5) is None
+    writer.close()
+    assert _count_votes(normalized_db) == 2
+    assert 'publish failed' in capsys.readouterr().out
+
+
+def test_failed_batch_fails_futures_and_writer_keeps_running(normalized_db, capsys):
+    aborted = []
+    writer = _queue(normalized_db, durability='async',
+                    on_abort=lambda votes: aborted.extend(votes))
+    bad = writer.submit(('Song', 'Artist', '', 'a', 5))  # violates the rating CHECK
+    with pytest.raises(Exception):
+        bad.result(timeout=5)
+    assert writer.submit(('Song', 'Artist', '', 'b', 1)).result(timeout=5) is None
+    writer.close()
+    assert aborted == [('Song', 'Artist', '', 'a', 5)]
+    assert writer.stats()['failed'] == 1
+    out = capsys.readouterr().out
+    assert 'dropped 1 votes' in out
+    assert 'dropped vote' not in out  # one line per failed batch, not per vote
+
+
+def test_full_queue_raises():
+    writer = rating_queue.RatingWriteQueue(None, max_pending=1)  # not started
+    writer.submit(('Song', 'Artist', '', 'a', 1))
+    with pytest.raises(rating_queue.queue.Full):
+        writer.submit(('Song', 'Artist', '', 'b', 1))
+
+
+def test_submit_after_close_is_refused(normalized_db):
+    writer = _queue(normalized_db)
+    writer.close()
+    with pytest.raises(rating_queue.QueueClosed):
+        writer.submit(('Song', 'Artist', '', 'a', 1))
+
+
+def test_close_fails_votes_the_writer_never_reached(capsys):
+    writer = rating_queue.RatingWriteQueue(None, durability='async')  # no writer thread
+    futures = [writer.submit(('Song', 'Artist', '', f'l{i}', 1)) for i in range(3)]
+    writer.close(timeout=0.1)
+    for future in futures:
+        with pytest.raises(rating_queue.QueueClosed):
+            future.result(timeout=0)
+    assert writer.stats()['failed'] == 3
+    assert 'dropped 3 votes at shutdown' in capsys.readouterr().out
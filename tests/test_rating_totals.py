@@ -0,0 +1,70 @@
+import random
+import sqlite3
+
+import pytest
+
+import ratings
+
+
+@pytest.fixture
+def conn(normalized_db):
+    conn = sqlite3.connect(normalized_db, isolation_level=None)
+    conn.executemany('INSERT INTO songs (id, title, artist) VALUES (?, ?, ?)',
+                     [(i, f'Song {i}', 'Band') for i in range(1, 6)])
+    conn.executemany('INSERT INTO listeners (id, identifier) VALUES (?, ?)',
+                     [(i, f'listener{i}') for i in range(1, 31)])
+    yield conn
+    conn.close()
+
+
+def _mismatches(conn):
+    return ratings.check_totals(conn), ratings.check_hourly(conn), ratings.check_daily(conn)
+
+
+def _totals(conn):
+    return dict((row[0], (row[1], row[2])) for row in conn.execute(
+        'SELECT song_id, thumbs_up, thumbs_down FROM song_rating_totals'))
+
+
+def test_triggers_keep_totals_and_buckets_exact(conn):
+    rng = random.Random(7)
+    for _ in range(400):
+        song, listener = rng.randint(1, 5), rng.randint(1, 30)
+        action = rng.random()
+        if action < 0.6:
+            conn.execute(
+                '''INSERT INTO song_votes (song_id, listener_id, rating, created_at)
+                   VALUES (?, ?, ?, datetime('now', ?))
+                   ON CONFLICT (song_id, listener_id) DO UPDATE
+                   SET rating = excluded.rating, created_at = excluded.created_at''',
+                (song, listener, rng.choice((1, -1)), f'-{rng.randint(0, 72)} hours'))
+        elif action < 0.8:
+            conn.execute('UPDATE song_votes SET rating = -rating '
+                         'WHERE song_id = ? AND listener_id = ?', (song, listener))
+        else:
+            conn.execute('DELETE FROM song_votes WHERE song_id = ? AND listener_id = ?',
+                         (song, listener))
+    assert _mismatches(conn) == ([], [], [])
+
+
+def test_flipping_a_vote_moves_one_count(conn):
+    conn.execute('INSERT INTO song_votes (song_id, listener_id, rating) VALUES (1, 1, 1)')
+    conn.execute('INSERT INTO song_votes (song_id, listener_id, rating) VALUES (1, 2, 1)')
+    assert _totals(conn)[1] == (2, 0)
+    conn.execute('UPDATE song_votes SET rating = -1 WHERE listener_id = 2')
+    assert _totals(conn)[1] == (1, 1)
+    conn.execute('DELETE FROM song_votes WHERE listener_id = 1')
+    assert _totals(conn)[1] == (0, 1)
+
+
+def test_check_finds_drift_and_rebuild_repairs_it(conn):
+    conn.execute('INSERT INTO song_votes (song_id, listener_id, rating) VALUES (2, 1, 1)')
+    conn.execute('UPDATE song_rating_totals SET thumbs_up = 5 WHERE song_id = 2')
+    conn.execute('UPDATE song_rating_hourly SET thumbs_down = 3')
+    totals, hourly, _ = _mismatches(conn)
+    assert totals == [(2, (5, 0), (1, 0))]
+    assert len(hourly) == 1
+    conn.execute('BEGIN')
+    ratings.rebuild_totals(conn)
+    conn.execute('COMMIT')
+    assert _mismatches(conn) == ([], [], [])
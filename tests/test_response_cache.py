@@ -0,0 +1,37 @@
+import time
+
+import response_cache
+
+
+def test_hit_after_put():
+    cache = response_cache.ResponseCache()
+    stored = cache.put('k', b'{}', 'application/json', cache.generation)
+    assert cache.get('k') is stored
+    assert stored.etag == response_cache.body_etag(b'{}')
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = response_cache.ResponseCache(ttl=10)
+    now = time.monotonic()
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now)
+    cache.put('k', b'{}', 'application/json', cache.generation)
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now + 11)
+    assert cache.get('k') is None
+
+
+def test_render_that_raced_with_a_write_is_not_stored():
+    cache = response_cache.ResponseCache()
+    generation = cache.generation
+    cache.invalidate()  # a write lands while the response is being rendered
+    cache.put('k', b'old', 'application/json', generation)
+    assert cache.get('k') is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = response_cache.ResponseCache(max_entries=2)
+    for key in ('a', 'b'):
+        cache.put(key, b'x', 'application/json', cache.generation)
+    cache.get('a')
+    cache.put('c', b'x', 'application/json', cache.generation)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
@@ -0,0 +1,149 @@
+import sqlite3
+import time
+
+import pytest
+
+import ratings
+import rollups
+
+DAY = 86400
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def conn(normalized_db):
+    conn = sqlite3.connect(normalized_db, isolation_level=None)
+    conn.executemany('INSERT INTO songs (id, title, artist) VALUES (?, ?, ?)',
+                     [(i, f'Song {i}', 'Band') for i in range(1, 4)])
+    conn.executemany('INSERT INTO listeners (id, identifier) VALUES (?, ?)',
+                     [(i, f'listener{i}') for i in range(1, 21)])
+    yield conn
+    conn.close()
+
+
+def _at(days_ago):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(NOW - days_ago * DAY))
+
+
+def _vote(conn, song, listener, rating, days_ago):
+    conn.execute('INSERT INTO song_votes (song_id, listener_id, rating, created_at) '
+                 'VALUES (?, ?, ?, ?) ON CONFLICT (song_id, listener_id) DO UPDATE '
+                 'SET rating = excluded.rating, created_at = excluded.created_at',
+                 (song, listener, rating, _at(days_ago)))
+
+
+def _exact(conn):
+    return ratings.check_totals(conn) == [] and ratings.check_hourly(conn) == [] \
+        and ratings.check_daily(conn) == []
+
+
+def _totals(conn, song):
+    return tuple(conn.execute('SELECT thumbs_up, thumbs_down FROM song_rating_totals '
+                              'WHERE song_id = ?', (song,)).fetchone())
+
+
+def _seed(conn):
+    for listener in range(1, 21):
+        _vote(conn, listener % 3 + 1, listener, 1 if listener % 4 else -1, listener * 7)
+
+
+def test_setup_is_detected(conn):
+    assert rollups.has_rollups(conn)
+    conn.execute('DROP TRIGGER song_votes_restore')
+    assert not rollups.has_rollups(conn)
+    rollups.setup(conn)
+    assert rollups.has_rollups(conn)
+
+
+def test_fold_moves_old_buckets_into_days_and_advances_the_watermark(conn):
+    _seed(conn)
+    hourly = conn.execute('SELECT COUNT(*) FROM song_rating_hourly').fetchone()[0]
+    folded = rollups.fold_hours(conn, NOW, hourly_days=14)
+    assert 0 < folded < hourly
+    watermark = ratings.rolled_up_hour(conn)
+    assert watermark == (NOW // DAY - 14) * 24
+    assert conn.execute('SELECT MIN(hour) FROM song_rating_hourly').fetchone()[0] >= watermark
+    assert _exact(conn)
+    assert rollups.fold_hours(conn, NOW, hourly_days=14) == 0
+
+
+def test_fold_keeps_the_chart_minimum(conn):
+    rollups.fold_hours(conn, NOW, hourly_days=1)
+    assert ratings.rolled_up_hour(conn) == (NOW // DAY - rollups.MIN_HOURLY_DAYS) * 24
+
+
+def test_changing_a_folded_vote_is_folded_into_its_day(conn):
+    _vote(conn, 1, 1, 1, 30)
+    rollups.fold_hours(conn, NOW, hourly_days=14)
+    conn.execute('UPDATE song_votes SET rating = -1 WHERE song_id = 1 AND listener_id = 1')
+    assert _exact(conn)  # the negative late bucket counts towards its day
+    rollups.fold_hours(conn, NOW, hourly_days=14)
+    assert conn.execute('SELECT COUNT(*) FROM song_rating_hourly').fetchone()[0] == 0
+    assert conn.execute('SELECT thumbs_up, thumbs_down FROM song_rating_daily').fetchall() == \
+        [(0, 1)]
+    assert _exact(conn)
+
+
+def test_archived_votes_stay_counted(conn):
+    _seed(conn)
+    before = [_totals(conn, song) for song in (1, 2, 3)]
+    result = rollups.run(conn, NOW, hourly_days=14, vote_days=60)
+    hot = conn.execute('SELECT COUNT(*) FROM song_votes').fetchone()[0]
+    assert result['votes_archived'] == 20 - hot > 0
+    assert conn.execute("SELECT MIN(created_at) FROM song_votes").fetchone()[0] >= _at(60)
+    assert [_totals(conn, song) for song in (1, 2, 3)] == before
+    assert _exact(conn)
+
+
+def test_archiving_runs_in_batches(conn):
+    _seed(conn)
+    assert rollups.archive_votes(conn, NOW, vote_days=0, batch=3) == 20
+    assert conn.execute('SELECT COUNT(*) FROM song_votes_archive').fetchone()[0] == 20
+    assert _exact(conn)
+
+
+def test_voting_again_replaces_the_archived_vote(conn):
+    _vote(conn, 1, 1, 1, 120)
+    _vote(conn, 1, 2, 1, 120)
+    rollups.run(conn, NOW, hourly_days=14, vote_days=90)
+    assert _totals(conn, 1) == (2, 0)
+    _vote(conn, 1, 1, -1, 0)
+    assert _totals(conn, 1) == (1, 1)
+    assert conn.execute('SELECT COUNT(*) FROM song_votes_archive').fetchone()[0] == 1
+    assert _exact(conn)
+
+
+def test_rollup_job_reports_passes_and_errors(normalized_db, capsys):
+    job = rollups.RollupJob(normalized_db, interval=0, vote_days=0)
+    job.run_once()
+    assert job.stats()['runs'] == 1 and job.last_error is None
+    job._conn.execute('ALTER TABLE song_rating_hourly RENAME TO moved')
+    job.run_once()
+    job.run_once()
+    assert job.stats()['runs'] == 1
+    assert 'song_rating_hourly' in job.last_error
+    assert capsys.readouterr().out.count('Rating rollups failed') == 1  # reported once
+    job._conn.close()
+
+
+def test_rollup_job_survives_unexpected_errors(normalized_db, monkeypatch, capsys):
+    def broken(*args, **kwargs):
+        raise ValueError('bad watermark')
+
+    job = rollups.RollupJob(normalized_db, interval=0.01, vote_days=0)
+    monkeypatch.setattr(rollups, 'run', broken)
+    job.start()
+    deadline = time.monotonic() + 5
+    while job.last_error is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert job._thread.is_alive()
+    assert 'bad watermark' in capsys.readouterr().out
+
+    monkeypatch.undo()
+    while job.stats()['runs'] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    job.stop()
+    assert not job._thread.is_alive()
+    assert job._conn is None
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+import search
+
+
+@pytest.fixture
+def conn(site_db):
+    conn = sqlite3.connect(site_db, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+
+def _search(conn, text, **kwargs):
+    posts, _ = search.search_posts(conn, search.match_query(text), 10, **kwargs)
+    return posts
+
+
+def test_match_query_quotes_terms_and_prefixes_the_last():
+    assert search.match_query('hello "world" NEAR') == '"hello" "world" "NEAR"*'
+    assert search.match_query('big ca') == '"big" "ca"'
+    assert search.match_query('  ;; ') is None
+    assert search.match_query(' '.join(['w'] * 40)).count('"w"') == search.MAX_TERMS
+
+
+def test_parse_search_validates_parameters():
+    assert search.parse_search({'q': 'post', 'limit': '500', 'published': 'true'}) == \
+        ('"post"*', search.MAX_LIMIT, 0, True)
+    for params in ({'q': ''}, {'q': 'x', 'limit': '0'}, {'q': 'x', 'limit': 'ten'},
+                   {'q': 'x', 'offset': str(search.MAX_OFFSET + 1)}):
+        with pytest.raises(ValueError):
+            search.parse_search(params)
+
+
+def test_search_stems_highlights_and_filters_drafts(conn):
+    posts = _search(conn, 'posts')
+    assert sorted(p['id'] for p in posts) == [1, 2]
+    assert '<mark>Post</mark>' in posts[0]['title']
+    assert [p['id'] for p in _search(conn, 'post', published_only=True)] == [1]
+    assert _search(conn, 'samp')[0]['id'] == 1  # prefix of the last term
+
+
+def test_title_hits_rank_above_content_hits(conn):
+    conn.execute("INSERT INTO posts (title, content, author_id, published) "
+                 "VALUES ('Unrelated', 'Mentions guitars once', 1, 1)")
+    conn.execute("INSERT INTO posts (title, content, author_id, published) "
+                 "VALUES ('Guitars', 'Nothing else here', 1, 1)")
+    posts = _search(conn, 'guitars')
+    assert [p['title'] for p in posts] == ['<mark>Guitars</mark>', 'Unrelated']
+    assert posts[0]['score'] > posts[1]['score']
+
+
+def test_snippets_are_escaped(conn):
+    conn.execute("INSERT INTO posts (title, content, author_id, published) "
+                 "VALUES ('Markup', '<script>alert(1)</script> payload', 1, 1)")
+    snippet = _search(conn, 'payload')[0]['snippet']
+    assert '<script>' not in snippet and '&lt;script&gt;' in snippet
+    assert '<mark>payload</mark>' in snippet
+
+
+def test_triggers_follow_updates_and_deletes(conn):
+    conn.execute("UPDATE posts SET title = 'Renamed entry' WHERE id = 1")
+    assert [p['id'] for p in _search(conn, 'renamed')] == [1]
+    assert [p['id'] for p in _search(conn, 'welcome')] == []
+    conn.execute('DELETE FROM posts WHERE id = 1')
+    assert _search(conn, 'renamed') == []
+    search.check_search_index(conn)
+
+
+def test_pages_report_the_next_offset(conn):
+    conn.executemany("INSERT INTO posts (title, content, author_id, published) VALUES (?, 'x', 1, 1)",
+                     [(f'Paged {i}',) for i in range(5)])
+    match = search.match_query('paged')
+    first, next_offset = search.search_posts(conn, match, 3)
+    rest, last = search.search_posts(conn, match, 3, next_offset)
+    assert (len(first), next_offset, len(rest), last) == (3, 3, 2, None)
+    assert {p['id'] for p in first}.isdisjoint(p['id'] for p in rest)
+
+
+def test_create_search_index_indexes_existing_posts(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)')
+    conn.execute('CREATE TABLE posts (id INTEGER PRIMARY KEY, title TEXT, content TEXT, '
+                 'author_id INTEGER, published INTEGER, created_at TEXT)')
+    conn.execute("INSERT INTO posts (title, content) VALUES ('Existing', 'before the index')")
+    body, status = search.search_response(conn, {'q': 'existing'})
+    assert status == 503
+    assert search.create_search_index(conn) is True
+    assert search.create_search_index(conn) is False
+    body, status = search.search_response(conn, {'q': 'existing'})
+    assert status == 200 and [p['id'] for p in body['posts']] == [1]
@@ -0,0 +1,107 @@
+import http.client
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import serving
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = f'{self.path} {serving.received_at() is not None}'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(mode, **kwargs):
+        port = _free_port()
+        server = serving.make_server(mode, ('127.0.0.1', port), EchoHandler, threads=4, **kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        if mode == 'asyncio':
+            server._ready.wait(5)
+        servers.append((server, thread))
+        return port
+
+    yield start
+    for server, thread in servers:
+        server.shutdown()
+        thread.join(5)
+        server.server_close()
+
+
+@pytest.mark.parametrize('mode', serving.MODES)
+def test_modes_answer_requests(serve, mode):
+    conn = http.client.HTTPConnection('127.0.0.1', serve(mode), timeout=5)
+    conn.request('GET', '/hello')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.read().startswith(b'/hello')
+    conn.close()
+
+
+@pytest.mark.parametrize('mode', ['threaded', 'asyncio'])
+def test_pooled_modes_keep_connections_alive(serve, mode):
+    conn = http.client.HTTPConnection('127.0.0.1', serve(mode), timeout=5)
+    for i in range(5):
+        conn.request('GET', f'/{i}')
+        response = conn.getresponse()
+        assert response.version == 11
+        assert response.read().startswith(f'/{i} '.encode())
+        assert response.getheader('Connection') != 'close'
+    conn.close()
+
+
+@pytest.mark.parametrize('mode', ['threaded', 'asyncio'])
+def test_backlog_beyond_max_pending_is_shed(serve, mode):
+    conn = http.client.HTTPConnection('127.0.0.1', serve(mode, max_pending=0), timeout=5)
+    conn.request('GET', '/')
+    response = conn.getresponse()
+    assert response.status == 503
+    assert response.getheader('Retry-After') == '1'
+
+
+@pytest.mark.parametrize('mode', ['threaded', 'asyncio'])
+def test_pooled_modes_record_arrival_time(serve, mode):
+    conn = http.client.HTTPConnection('127.0.0.1', serve(mode), timeout=5)
+    conn.request('GET', '/')
+    assert conn.getresponse().read() == b'/ True'
+    conn.close()
+
+
+def test_asyncio_refuses_oversized_bodies(serve):
+    with socket.create_connection(('127.0.0.1', serve('asyncio')), timeout=5) as sock:
+        sock.sendall(b'POST / HTTP/1.1\r\nHost: x\r\n'
+                     b'Content-Length: %d\r\n\r\n' % (serving.MAX_BODY_BYTES + 1))
+        response = sock.makefile('rb').read()
+    assert response.startswith(b'HTTP/1.1 413 ')
+
+
+def test_asyncio_drops_a_stalled_body(serve, monkeypatch):
+    monkeypatch.setattr(serving, 'KEEPALIVE_TIMEOUT', 0.2)
+    with socket.create_connection(('127.0.0.1', serve('asyncio')), timeout=5) as sock:
+        sock.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 100\r\n\r\nabc')
+        assert sock.recv(1024) == b''  # closed without waiting for the rest
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        serving.make_server('forking', ('127.0.0.1', 0), EchoHandler)
@@ -0,0 +1,96 @@
+"""End-to-end checks of simple_server.py, run as a subprocess"""
+import http.client
+import os
+
+
+def _vote(server, title, rating, fingerprint):
+    return server.request('POST', '/api/ratings', {
+        'title': title, 'artist': 'Band', 'rating': rating,
+        'browser_fingerprint': fingerprint})
+
+
+def test_batch_ratings_returns_counts_in_request_order(simple_server):
+    server = simple_server()
+    assert _vote(server, 'One', 1, 'a')[0] == 201
+    assert _vote(server, 'One', 1, 'b')[0] == 201
+    assert _vote(server, 'Two', -1, 'a')[0] == 201
+    status, _, body = server.request('POST', '/api/ratings/batch', {'songs': [
+        {'title': 'Two', 'artist': 'Band'},
+        {'title': 'Unrated', 'artist': 'Band'},
+        {'title': 'One', 'artist': 'Band'},
+    ]})
+    assert status == 200
+    assert [(s['song']['title'], s['ratings']['thumbs_up'], s['ratings']['thumbs_down'])
+            for s in body['songs']] == [('Two', 0, 1), ('Unrated', 0, 0), ('One', 2, 0)]
+
+
+def test_batch_ratings_rejects_incomplete_songs(simple_server):
+    server = simple_server()
+    status, _, _ = server.request('POST', '/api/ratings/batch', {'songs': [
+        {'title': 'One', 'artist': 'Band'}, {'title': '', 'artist': 'Band'}]})
+    assert status == 400
+
+
+def test_vote_floods_get_429_and_repeats_skip_the_write(simple_server):
+    server = simple_server('--vote-rate', '0.01', '--vote-burst', '3')
+    assert _vote(server, 'One', 1, 'a')[0] == 201
+    status, _, body = _vote(server, 'One', 1, 'a')
+    assert (status, body['message']) == (200, 'Rating unchanged')
+    assert _vote(server, 'Two', 1, 'a')[0] == 201  # the repeat spent a token too
+    status, headers, _ = _vote(server, 'Three', 1, 'a')
+    assert status == 429
+    assert int(headers['Retry-After']) >= 1
+    assert _vote(server, 'Three', 1, 'b')[0] == 201  # other listeners are unaffected
+
+
+def test_list_endpoints_answer_304_until_the_table_changes(simple_server):
+    server = simple_server()
+    status, headers, _ = server.request('GET', '/api/users')
+    etag = headers['ETag']
+    assert status == 200 and etag.startswith('W/')
+    assert server.request('GET', '/api/users', headers={'If-None-Match': etag})[0] == 304
+    assert server.request('GET', '/api/posts', headers={'If-None-Match': etag})[0] == 200
+    assert server.request('POST', '/api/users', {'email': 'new@example.com',
+                                                 'name': 'New'})[0] == 201
+    status, headers, _ = server.request('GET', '/api/users', headers={'If-None-Match': etag})
+    assert status == 200 and headers['ETag'] != etag
+
+
+def _raw_get(server, path):
+    """GET a path exactly as written, without client-side normalization"""
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    conn.putrequest('GET', path, skip_accept_encoding=True)
+    conn.endheaders()
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.status
+
+
+def test_static_paths_cannot_leave_the_public_assets(simple_server, site_db):
+    server = simple_server()
+    with open(os.path.join(os.path.dirname(site_db), '.env'), 'w') as f:
+        f.write('SECRET=1\n')
+    for path in ('/static/../database.db', '/static/../.env', '/static/../simple_server.py',
+                 '/static/%2e%2e/database.db', '/../database.db.css'):
+        assert _raw_get(server, path) == 404, path
+
+
+def test_event_stream_is_refused_without_a_metadata_poller(simple_server):
+    server = simple_server('--mode', 'asyncio')
+    status, _, body = server.request('GET', '/api/events')
+    assert status == 503 and 'metadata-url' in body['error']
+    assert server.request('GET', '/api/now-playing')[0] == 503
+
+
+def test_gzip_variant_is_sent_with_its_own_etag(simple_server, site_db):
+    with open(os.path.join(os.path.dirname(site_db), 'site.css'), 'w') as f:
+        f.write('body { color: red; }\n' * 100)
+    server = simple_server()
+    _, plain, _ = server.request('GET', '/site.css')
+    status, gzipped, _ = server.request('GET', '/site.css', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped['Content-Encoding'] == 'gzip'
+    assert gzipped['ETag'] == plain['ETag'][:-1] + '-gzip"'
+    status, headers, _ = server.request('GET', '/site.css', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': gzipped['ETag']})
+    assert status == 304 and headers['ETag'] == gzipped['ETag']
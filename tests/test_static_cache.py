@@ -0,0 +1,91 @@
+import gzip
+import os
+
+import pytest
+
+import static_cache
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'app.css').write_text('body { color: red; }\n' * 100)
+    (tmp_path / 'small.js').write_text('x')
+    return static_cache.StaticAssetCache(str(tmp_path))
+
+
+def test_asset_is_cached_until_the_file_changes(assets, tmp_path):
+    first = assets.get('app.css')
+    assert assets.get('app.css') is first
+    path = tmp_path / 'app.css'
+    path.write_text('body { color: blue; }\n' * 100)
+    os.utime(path, ns=(first.mtime_ns + 10**9, first.mtime_ns + 10**9))
+    second = assets.get('app.css')
+    assert second is not first
+    assert second.etag != first.etag
+
+
+@pytest.mark.parametrize('filepath', [
+    '../etc/passwd', 'static/../database.db', 'static/../app.css', './app.css',
+    '.env', 'static/.hidden.css', 'database.db', 'server.py', '..\\app.css', 'static//app.css',
+])
+def test_only_public_assets_under_root_are_served(assets, tmp_path, filepath):
+    (tmp_path / 'database.db').write_bytes(b'SQLite format 3')
+    (tmp_path / '.env').write_text('SECRET=1')
+    (tmp_path / 'server.py').write_text('print()')
+    with pytest.raises(FileNotFoundError):
+        assets.get(filepath)
+
+
+def test_compressed_variant_only_for_larger_text(assets):
+    css = assets.get('app.css')
+    assert gzip.decompress(css.variants['gzip']) == css.body
+    assert assets.get('small.js').variants == {}
+    assert static_cache.choose_encoding(css, 'gzip, deflate') == 'gzip'
+    assert static_cache.choose_encoding(css, 'gzip;q=0') is None
+
+
+def test_conditional_headers(assets):
+    css = assets.get('app.css')
+    assert static_cache.not_modified(css, {'If-None-Match': css.etag})
+    assert static_cache.not_modified(css, {'If-None-Match': 'W/' + css.etag})
+    assert not static_cache.not_modified(css, {'If-None-Match': '"other"'})
+    assert static_cache.not_modified(css, {'If-Modified-Since': css.last_modified})
+
+
+def test_compressed_variants_have_their_own_etags(assets):
+    css = assets.get('app.css')
+    gzip_etag = css.etag_for('gzip')
+    assert gzip_etag != css.etag and gzip_etag == css.etag[:-1] + '-gzip"'
+    assert static_cache.not_modified(css, {'If-None-Match': gzip_etag})
+    assert static_cache.not_modified(css, {'If-None-Match': f'"other", W/{gzip_etag}'})
+    assert not static_cache.not_modified(css, {'If-None-Match': css.etag[:-1] + '-br"'})
+
+
+def test_large_files_are_not_held_in_memory(tmp_path):
+    (tmp_path / 'big.png').write_bytes(b'a' * 2000)
+    assets = static_cache.StaticAssetCache(str(tmp_path), inline_limit=1000)
+    assert assets.get('big.png').body is None
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-9', (0, 9)),
+    ('bytes=90-', (90, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=50-500', (50, 99)),
+    ('bytes=0-1,5-6', None),
+    ('items=0-1', None),
+])
+def test_parse_range(header, expected):
+    assert static_cache.parse_range(header, 100) == expected
+
+
+def test_unsatisfiable_range():
+    with pytest.raises(ValueError):
+        static_cache.parse_range('bytes=100-', 100)
+
+
+def test_accepts():
+    assert static_cache.accepts('gzip, br;q=0.5', 'br')
+    assert not static_cache.accepts('br', 'gzip')
+    assert static_cache.accepts('*', 'gzip')
@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+import table_versions
+
+SCHEMA = '''
+CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE posts (id INTEGER PRIMARY KEY, title TEXT);
+'''
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.executescript(SCHEMA)
+    yield conn
+    conn.close()
+
+
+def test_versions_are_none_until_tracking_exists(conn):
+    assert table_versions.versions(conn, ('posts',)) is None
+    assert table_versions.create_version_tracking(conn) is True
+    assert table_versions.create_version_tracking(conn) is False
+    assert table_versions.versions(conn, ('users', 'posts')) == (0, 0)
+    assert table_versions.versions(conn, ('posts', 'comments')) is None
+
+
+def test_triggers_bump_only_the_changed_table(conn):
+    table_versions.create_version_tracking(conn)
+    conn.execute("INSERT INTO posts (title) VALUES ('a')")
+    conn.execute("UPDATE posts SET title = 'b'")
+    conn.execute('DELETE FROM posts')
+    assert table_versions.versions(conn, ('users', 'posts')) == (0, 3)
+    table_versions.bump(conn, 'users')
+    assert table_versions.versions(conn, ('users', 'posts')) == (1, 3)
+
+
+def test_rolled_back_writes_leave_the_counter(conn):
+    table_versions.create_version_tracking(conn)
+    conn.execute('BEGIN')
+    conn.execute("INSERT INTO users (name) VALUES ('x')")
+    conn.execute('ROLLBACK')
+    assert table_versions.versions(conn, ('users',)) == (0,)
+
+
+def test_list_etag_depends_on_counters_and_query():
+    etag = table_versions.list_etag((3, 4), '/api/posts', 'limit=10')
+    assert etag.startswith('W/"3.4-')
+    assert etag == table_versions.list_etag((3, 4), '/api/posts', 'limit=10')
+    assert etag != table_versions.list_etag((3, 5), '/api/posts', 'limit=10')
+    assert etag != table_versions.list_etag((3, 4), '/api/posts', 'limit=20')
+    assert etag != table_versions.list_etag((3, 4), '/api/users', 'limit=10')
+
+
+def test_etag_matches_uses_weak_comparison():
+    etag = table_versions.list_etag((1,), '/api/users')
+    strong = etag.removeprefix('W/')
+    assert table_versions.etag_matches(etag, etag)
+    assert table_versions.etag_matches(strong, etag)
+    assert table_versions.etag_matches(f'"other", {etag}', etag)
+    assert table_versions.etag_matches('*', etag)
+    assert not table_versions.etag_matches('"other"', etag)
+    assert not table_versions.etag_matches(None, etag)